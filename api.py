@@ -1,37 +1,103 @@
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from src.rag_system import RAGSystem, generate_response
+from contextlib import asynccontextmanager
+from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field
+from typing import List, Optional
+from src.admission import PRIORITY_HIGH, PRIORITY_LOW, PRIORITY_NORMAL, Overloaded, get_admission_controller, request_priority
+from src.artifact_store import exam_guide_artifact
+from src.engine import get_artifact_store, get_corpus, get_rag_system, is_ready
+from src.metrics import REQUEST_SECONDS, install_trace_id_logging, new_trace_id, render_metrics, span, trace_id_var
+from src.rag_system import RAGSystem
 from src.quiz_agent import QuizAgent
-from src.summary_tool import SummaryTool
-from src.diagram_agent import DiagramAgent
-from src.exam_guide_agent import ExamGuideAgent  # New import
+from src.sessions import get_session_store
+from src.tts import TTSPipeline
+from src.upstream import UpstreamError, close_http_client, get_http_client, get_upstream_stats
+import math
+import json
 import logging
 import os
-import requests
+import time
 
 logging.basicConfig(level=logging.INFO)
+install_trace_id_logging()
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
-
-# Initialize the RAG system
-api_key = os.getenv("GOOGLE_API_KEY")  # Make sure this environment variable is set
-pdf_path = "data/ncert_sound_chap.pdf"
-rag_system = RAGSystem(api_key, pdf_path)
-
 SARVAM_API_KEY = os.getenv("SARVAM_API_KEY")
 if not SARVAM_API_KEY:
     logger.error("SARVAM_API_KEY environment variable is not set")
     raise EnvironmentError("SARVAM_API_KEY environment variable is not set")
 
-# Initialize ExamGuideAgent
-exam_guide_agent = ExamGuideAgent(rag_system)
+# TTS pipeline on the shared keep-alive HTTP client, built in the lifespan hook
+tts_pipeline: TTSPipeline = None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global tts_pipeline
+    tts_pipeline = TTSPipeline(get_http_client(), SARVAM_API_KEY)
+    # Warm the default collection before serving; requests fall back to lazy init if this fails
+    try:
+        await run_in_threadpool(get_rag_system)
+        logger.info("RAG system warmed up")
+    except Exception as e:
+        logger.error(f"Failed to warm up RAG system: {str(e)}")
+    yield
+    await close_http_client()
+
+app = FastAPI(lifespan=lifespan)
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    # Tag the request's log lines with a trace id (the caller's X-Trace-Id if given) and time it by route
+    trace_id = request.headers.get("X-Trace-Id") or new_trace_id()
+    token = trace_id_var.set(trace_id)
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        response.headers["X-Trace-Id"] = trace_id
+        return response
+    finally:
+        route = request.scope.get("route")
+        REQUEST_SECONDS.labels(request.method, route.path if route else "unmatched", str(status)).observe(
+            time.perf_counter() - start)
+        trace_id_var.reset(token)
+
+@app.exception_handler(UpstreamError)
+async def upstream_error_handler(request: Request, exc: UpstreamError):
+    # Upstream outages surface as 503s instead of canned answers
+    headers = {"Retry-After": str(math.ceil(exc.retry_after))} if exc.retry_after else None
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers=headers)
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    # Shed load fast instead of queueing without bound behind the LLM
+    return JSONResponse(status_code=429, content={"detail": str(exc)},
+                        headers={"Retry-After": str(math.ceil(exc.retry_after))})
+
+def priority(level: int):
+    # Route dependency: LLM calls made for the request queue at this priority
+    async def set_priority():
+        request_priority.set(level)
+    return Depends(set_priority)
+
+def get_collection(collection: Optional[str] = None, chapter: Optional[str] = None) -> RAGSystem:
+    # Every endpoint takes optional ?collection=...&chapter=... query parameters
+    try:
+        rag_system = get_rag_system(collection)
+        rag_system.check_chapter(chapter)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=e.args[0])
+    return rag_system
 
 class Query(BaseModel):
     text: str
+    # Set (to "" for a new conversation) to answer as the next turn of a session; the response carries its id
+    session_id: Optional[str] = None
 
 class QuizRequest(BaseModel):
-    num_questions: int = 3
+    num_questions: int = Field(3, ge=1, le=20)
 
 class DiagramRequest(BaseModel):
     diagram_type: str
@@ -41,8 +107,32 @@ class EvaluationRequest(BaseModel):
     question: str
     answer: str
 
+class QuizItem(BaseModel):
+    # Fields as returned by /quiz, plus the student's answer
+    question: str
+    type: Optional[str] = None
+    options: List[str] = []
+    answer: Optional[str] = None
+    user_answer: str = ""
+
+class QuizAttempt(BaseModel):
+    items: List[QuizItem] = Field(..., min_length=1, max_length=50)
+
+class GradedItem(BaseModel):
+    question: str
+    user_answer: str
+    correct: bool
+    score: float
+    explanation: str
+    graded_by: str
+
+class QuizGrades(BaseModel):
+    results: List[GradedItem]
+    score: float
+    max_score: int
+
 class ExamGuideRequest(BaseModel):
-    num_questions: int = 2
+    num_questions: int = Field(2, ge=1, le=10)
 
 class TextToSpeechRequest(BaseModel):
     text: str
@@ -55,82 +145,207 @@ class TextToSpeechRequest(BaseModel):
     enable_preprocessing: bool = True
     model: str = "bulbul:v1"
 
-@app.post("/generate")
-async def generate(query: Query):
-    response = generate_response(query.text)
+@app.get("/ready")
+async def ready():
+    if not is_ready():
+        raise HTTPException(status_code=503, detail="RAG system is warming up")
+    return {"ready": True}
+
+@app.get("/collections")
+async def list_collections():
+    corpus = await run_in_threadpool(get_corpus)
+    return {"default": corpus.default_collection, "collections": corpus.list_collections()}
+
+@app.get("/metrics")
+async def metrics():
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+@app.get("/upstream/stats")
+async def upstream_stats():
+    return get_upstream_stats()
+
+@app.get("/admission/stats")
+async def admission_stats():
+    return get_admission_controller().get_stats()
+
+@app.get("/sessions/stats")
+async def session_stats():
+    return get_session_store().get_stats()
+
+@app.delete("/sessions/{session_id}")
+async def end_session(session_id: str):
+    if not get_session_store().drop(session_id):
+        raise HTTPException(status_code=404, detail=f"Unknown session {session_id!r}")
+    return {"session_id": session_id}
+
+@app.get("/cache/stats")
+async def cache_stats(rag_system: RAGSystem = Depends(get_collection)):
+    return rag_system.answer_cache.get_stats()
+
+@app.post("/reindex")
+async def reindex(rag_system: RAGSystem = Depends(get_collection)):
+    try:
+        version = await run_in_threadpool(rag_system.reindex)
+        return {"index_version": version}
+    except Exception as e:
+        logger.error(f"Error re-indexing: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/generate", dependencies=[priority(PRIORITY_HIGH)])
+async def generate(query: Query, chapter: Optional[str] = None, rag_system: RAGSystem = Depends(get_collection)):
+    if query.session_id is not None:
+        session = get_session_store().get(query.session_id, (rag_system.collection_name, chapter))
+        return await rag_system.agenerate_session_response(session, query.text, chapter)
+    response = await rag_system.agenerate_response(query.text, chapter)
     return response
 
-@app.post("/quiz")
-async def generate_quiz(request: QuizRequest):
-    quiz_agent = QuizAgent(rag_system)
-    questions = quiz_agent.generate_questions(request.num_questions)
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/generate/stream", dependencies=[priority(PRIORITY_HIGH)])
+async def generate_stream(query: Query, chapter: Optional[str] = None,
+                          rag_system: RAGSystem = Depends(get_collection)):
+    if query.session_id is not None:
+        session = get_session_store().get(query.session_id, (rag_system.collection_name, chapter))
+        stream = rag_system.astream_session_response(session, query.text, chapter)
+    else:
+        session = None
+        stream = rag_system.astream_response(query.text, chapter)
+
+    # Read up to the first token before committing to a 200, so a shed or failed LLM call still gets its
+    # 429 or 503 with Retry-After; the admission slot is only taken once retrieval is done
+    head = []
+    try:
+        async for event, data in stream:
+            head.append((event, data))
+            if event == "token":
+                break
+    except BaseException:
+        await stream.aclose()
+        raise
+
+    async def events():
+        if session is not None:
+            yield sse_event("session", {"session_id": session.id})
+        try:
+            for event, data in head:
+                yield sse_event(event, data)
+            async for event, data in stream:
+                yield sse_event(event, data)
+        except (UpstreamError, Overloaded) as e:
+            yield sse_event("error", {"detail": str(e)})
+        finally:
+            await stream.aclose()
+        yield sse_event("done", {})
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(events(), media_type="text/event-stream", headers=headers)
+
+@app.post("/quiz", dependencies=[priority(PRIORITY_NORMAL)])
+async def generate_quiz(request: QuizRequest, chapter: Optional[str] = None,
+                        rag_system: RAGSystem = Depends(get_collection)):
+    quiz_agent = QuizAgent(rag_system, chapter)
+    questions = await quiz_agent.generate_questions(request.num_questions)
     return {"questions": questions}
 
-@app.post("/evaluate_answer")
-async def evaluate_answer(request: EvaluationRequest):
-    quiz_agent = QuizAgent(rag_system)
-    evaluation = quiz_agent.evaluate_answer(request.question, request.answer)
+@app.post("/evaluate_answer", dependencies=[priority(PRIORITY_HIGH)])
+async def evaluate_answer(request: EvaluationRequest, chapter: Optional[str] = None,
+                          rag_system: RAGSystem = Depends(get_collection)):
+    quiz_agent = QuizAgent(rag_system, chapter)
+    evaluation = await quiz_agent.evaluate_answer(request.question, request.answer)
     return evaluation
 
-@app.get("/chapter_summary")
-async def get_chapter_summary():
-    summary_tool = SummaryTool(rag_system)
-    summary = summary_tool.generate_summary()
-    return {"summary": summary}
+@app.post("/evaluate_quiz", response_model=QuizGrades, dependencies=[priority(PRIORITY_HIGH)])
+async def evaluate_quiz(attempt: QuizAttempt, chapter: Optional[str] = None,
+                        rag_system: RAGSystem = Depends(get_collection)):
+    quiz_agent = QuizAgent(rag_system, chapter)
+    results = await quiz_agent.evaluate_quiz([item.model_dump() for item in attempt.items])
+    return {"results": results, "score": sum(result["score"] for result in results), "max_score": len(results)}
+
+@app.get("/chapter_summary", dependencies=[priority(PRIORITY_NORMAL)])
+async def get_chapter_summary(chapter: Optional[str] = None, rag_system: RAGSystem = Depends(get_collection)):
+    try:
+        summary = await get_artifact_store().get(rag_system, "chapter_summary", chapter)
+        return {"summary": summary}
+    except (UpstreamError, Overloaded):
+        raise
+    except Exception as e:
+        logger.error(f"Error generating chapter summary: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/important_topics")
-async def get_important_topics():
-    summary_tool = SummaryTool(rag_system)
-    topics = summary_tool.generate_important_topics()
-    return {"topics": topics}
+@app.get("/important_topics", dependencies=[priority(PRIORITY_NORMAL)])
+async def get_important_topics(chapter: Optional[str] = None, rag_system: RAGSystem = Depends(get_collection)):
+    try:
+        topics = await get_artifact_store().get(rag_system, "important_topics", chapter)
+        return {"topics": topics}
+    except (UpstreamError, Overloaded):
+        raise
+    except Exception as e:
+        logger.error(f"Error generating important topics: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/summary_flowchart")
-async def get_summary_flowchart():
+@app.get("/summary_flowchart", dependencies=[priority(PRIORITY_NORMAL)])
+async def get_summary_flowchart(chapter: Optional[str] = None, rag_system: RAGSystem = Depends(get_collection)):
     try:
         logger.info("Received request for chapter summary flowchart")
-        diagram_agent = DiagramAgent(rag_system)
-        flowchart = diagram_agent.generate_summary_flowchart()
-        logger.info("Chapter summary flowchart generated successfully")
+        flowchart = await get_artifact_store().get(rag_system, "summary_flowchart", chapter)
         return {"flowchart": flowchart}
+    except (UpstreamError, Overloaded):
+        raise
     except Exception as e:
         logger.error(f"Error generating summary flowchart: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/create_exam_guide")
-async def create_exam_guide(request: ExamGuideRequest):
+@app.post("/create_exam_guide", dependencies=[priority(PRIORITY_NORMAL)])
+async def create_exam_guide(request: ExamGuideRequest, chapter: Optional[str] = None,
+                            rag_system: RAGSystem = Depends(get_collection)):
     try:
-        guide = exam_guide_agent.create_exam_guide(request.num_questions)
+        guide = await get_artifact_store().get(rag_system, exam_guide_artifact(request.num_questions), chapter)
         return {"exam_guide": guide}
+    except (UpstreamError, Overloaded):
+        raise
     except Exception as e:
         logger.error(f"Error creating exam guide: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/artifacts/refresh", dependencies=[priority(PRIORITY_LOW)])
+async def refresh_artifacts(rag_system: RAGSystem = Depends(get_collection)):
+    try:
+        built = await get_artifact_store().refresh(rag_system)
+        return {"index_version": rag_system.index_version, "artifacts": built}
+    except (UpstreamError, Overloaded):
+        raise
+    except Exception as e:
+        logger.error(f"Error refreshing artifacts: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
     
 
 @app.post("/text_to_speech")
 async def text_to_speech(request: TextToSpeechRequest):
+    params = request.model_dump(exclude={"text"})
+    audio = tts_pipeline.stream(request.text, params)
     try:
-        url = "https://api.sarvam.ai/text-to-speech"
-        payload = {
-            "inputs": [request.text],
-            "target_language_code": request.target_language_code,
-            "speaker": request.speaker,
-            "pitch": request.pitch,
-            "pace": request.pace,
-            "loudness": request.loudness,
-            "speech_sample_rate": request.speech_sample_rate,
-            "enable_preprocessing": request.enable_preprocessing,
-            "model": request.model
-        }
-        headers = {
-            "Content-Type": "application/json",
-            "API-Subscription-Key": SARVAM_API_KEY
-        }
-        response = requests.post(url, json=payload, headers=headers)
-        response.raise_for_status()  # Raises an HTTPError for bad responses
-        return {"audio_data": response.content}
-    except requests.RequestException as e:
+        # Synthesize the first sentence before committing to a 200 so upstream failures still surface as errors
+        with span("tts_first_chunk"):
+            first_chunk = await audio.__anext__()
+    except StopAsyncIteration:
+        raise HTTPException(status_code=400, detail="No text to convert")
+    except UpstreamError:
+        await audio.aclose()
+        raise
+    except (KeyError, ValueError) as e:
+        await audio.aclose()
         logger.error(f"Error in text-to-speech conversion: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Text-to-speech conversion failed: {str(e)}")
 
+    async def body():
+        yield first_chunk
+        try:
+            async for chunk in audio:
+                yield chunk
+        except (UpstreamError, KeyError, ValueError) as e:
+            logger.error(f"Error in text-to-speech conversion: {str(e)}")
 
+    return StreamingResponse(body(), media_type="audio/wav")
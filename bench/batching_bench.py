@@ -0,0 +1,68 @@
+# batching_bench.py
+# Usage: python -m bench.batching_bench --concurrency 32 --queries 512
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from bench.embedding_bench import QUERIES, percentile
+from src.batcher import MicroBatcher
+from src.embeddings import EmbeddingService
+
+async def run(embed, queries, concurrency):
+    latencies = []
+    queue = asyncio.Queue()
+    for query in queries:
+        queue.put_nowait(query)
+
+    async def worker():
+        while not queue.empty():
+            query = queue.get_nowait()
+            start = time.perf_counter()
+            await embed(query)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {
+        "queries_per_s": round(len(queries) / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+    }
+
+async def bench(args):
+    # No cache, and distinct texts, so every query is really encoded
+    service = EmbeddingService(cache_path=None)
+    executor = ThreadPoolExecutor(max_workers=args.workers)
+    queries = [f"{QUERIES[i % len(QUERIES)]} ({i})" for i in range(args.queries)]
+    service.embed_query(queries[0])  # warm-up
+
+    loop = asyncio.get_running_loop()
+
+    async def unbatched(query):
+        return await loop.run_in_executor(executor, service.embed_query, query)
+
+    batcher = MicroBatcher(service.embed_queries, "embed", max_batch_size=args.batch_size,
+                           max_wait_ms=args.window_ms, executor=executor)
+    return {
+        "concurrency": args.concurrency,
+        "batch_size": args.batch_size,
+        "window_ms": args.window_ms,
+        "unbatched": await run(unbatched, queries, args.concurrency),
+        "batched": await run(batcher.submit, queries, args.concurrency),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Query embedding throughput with and without micro-batching")
+    parser.add_argument("--queries", type=int, default=512)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=4, help="Threads in the executor both modes run on")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--window-ms", type=float, default=5)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(bench(args)), indent=2))
+
+if __name__ == "__main__":
+    main()
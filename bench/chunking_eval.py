@@ -0,0 +1,116 @@
+# chunking_eval.py
+# Usage: python -m bench.chunking_eval --k 1 3 5 --mode hybrid
+# Compares chunking settings offline: chunks the PDF in memory with each setting, retrieves
+# for a labelled query set and reports how often the answer reaches the prompt and at what size.
+import argparse
+import json
+import re
+import statistics
+import numpy as np
+from src.chunking import make_chunker
+from src.context_builder import CONTEXT_TOKEN_BUDGET, build_context
+from src.embeddings import get_embedding_service
+from src.ingest import load_and_split_documents
+from src.retriever import BM25Index, HybridRetriever
+
+# Questions about the Sound chapter, each with phrases one of which must appear in the context.
+# Questions avoid the answer's own words so a hit means the right passage was found.
+LABELLED_QUERIES = [
+    {"query": "How fast does sound travel through air at room temperature?", "answers": ["344"]},
+    {"query": "What does the abbreviation SONAR stand for?", "answers": ["navigation and ranging"]},
+    {"query": "What range of frequencies can the human ear hear?", "answers": ["20000 hz", "20 khz"]},
+    {"query": "What is the minimum distance from a reflecting surface needed to hear an echo?",
+     "answers": ["17.2"]},
+    {"query": "How long does the sensation of a sound persist in our brain?", "answers": ["0.1 s"]},
+    {"query": "What are sounds below the audible range called?", "answers": ["infrasound", "infrasonic"]},
+    {"query": "What is the SI unit of frequency?", "answers": ["hertz"]},
+    {"query": "What is the persistence of sound in a big hall due to repeated reflections called?",
+     "answers": ["reverberation"]},
+    {"query": "Which kind of wave is sound, given that particles move parallel to the direction of travel?",
+     "answers": ["longitudinal"]},
+    {"query": "What are the regions of low pressure in a sound wave called?", "answers": ["rarefaction"]},
+    {"query": "Which property of a sound wave decides its loudness?", "answers": ["amplitude"]},
+    {"query": "Which property of a sound decides how high or low its pitch is?", "answers": ["frequency"]},
+    {"query": "Which medical instrument uses multiple reflection of sound to listen to the heart?",
+     "answers": ["stethoscope"]},
+    {"query": "What do we call the shock waves of an aircraft flying faster than sound?",
+     "answers": ["sonic boom"]},
+]
+
+# name, chunker settings
+CONFIGS = [
+    ("recursive-2000c", {"strategy": "recursive"}),
+    ("structured-96", {"chunk_tokens": 96, "overlap_tokens": 16, "small_to_big": False}),
+    ("structured-160", {"chunk_tokens": 160, "overlap_tokens": 32, "small_to_big": False}),
+    ("structured-160-s2b", {"chunk_tokens": 160, "overlap_tokens": 32, "small_to_big": True}),
+    ("structured-256-s2b", {"chunk_tokens": 256, "overlap_tokens": 48, "small_to_big": True}),
+]
+
+def normalize(text):
+    return re.sub(r"[^a-z0-9.]", "", text.lower())
+
+def contains_answer(text, answers):
+    text = normalize(text)
+    return any(normalize(answer) in text for answer in answers)
+
+def retrieve(query, chunks, vectors, bm25, k, mode):
+    query_vector = np.asarray(get_embedding_service().embed_query(query), dtype=np.float32)
+    scores = vectors @ (query_vector / np.linalg.norm(query_vector))
+    dense = [chunks[i] for i in np.argsort(-scores)[:k * 4]]
+    if mode == "dense":
+        return dense[:k]
+    lexical = [doc for doc, _ in bm25.search(query, k * 4)]
+    return HybridRetriever.fuse([dense, lexical], k)
+
+def evaluate(name, settings, pdf, queries, ks, mode, budget):
+    chunks = load_and_split_documents(pdf, chunker=make_chunker(**settings))
+    vectors = np.asarray(get_embedding_service().embed_documents([doc.page_content for doc in chunks]),
+                         dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    bm25 = BM25Index()
+    bm25.build(chunks)
+
+    result = {
+        "config": name,
+        "settings": settings,
+        "chunks": len(chunks),
+        "mean_chunk_tokens": round(statistics.mean(doc.metadata["token_count"] for doc in chunks), 1),
+    }
+    for k in ks:
+        chunk_hits = context_hits = 0
+        prompt_tokens = []
+        for item in queries:
+            documents = retrieve(item["query"], chunks, vectors, bm25, k, mode)
+            packed = build_context(documents, item["query"], budget)
+            # Chunk hit: the answer is in a retrieved chunk; context hit: it survives into the prompt
+            chunk_hits += any(contains_answer(doc.page_content, item["answers"]) for doc in documents)
+            context_hits += contains_answer(packed.text, item["answers"])
+            prompt_tokens.append(packed.tokens)
+        result[f"chunk_recall@{k}"] = round(chunk_hits / len(queries), 3)
+        result[f"context_recall@{k}"] = round(context_hits / len(queries), 3)
+        result[f"avg_prompt_tokens@{k}"] = round(statistics.mean(prompt_tokens), 1)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare chunking settings by recall@k and prompt size")
+    parser.add_argument("--pdf", default="data/ncert_sound_chap.pdf")
+    parser.add_argument("--queries", help='JSONL file of {"query": ..., "answers": [...]} to use instead')
+    parser.add_argument("--configs", nargs="+", choices=[name for name, _ in CONFIGS],
+                        default=[name for name, _ in CONFIGS])
+    parser.add_argument("--k", nargs="+", type=int, default=[1, 3, 5])
+    parser.add_argument("--mode", choices=["dense", "hybrid"], default="hybrid")
+    parser.add_argument("--budget", type=int, default=CONTEXT_TOKEN_BUDGET)
+    args = parser.parse_args()
+
+    queries = LABELLED_QUERIES
+    if args.queries:
+        with open(args.queries) as f:
+            queries = [json.loads(line) for line in f if line.strip()]
+    settings = dict(CONFIGS)
+    results = []
+    for name in args.configs:
+        results.append(evaluate(name, settings[name], args.pdf, queries, args.k, args.mode, args.budget))
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
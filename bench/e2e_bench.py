@@ -0,0 +1,339 @@
+# e2e_bench.py
+# Offline end-to-end benchmark: runs the API against the stub Gemini model and a stub Sarvam server.
+# Usage: python -m bench.e2e_bench --requests 200 --concurrency 8 [--workload workload.jsonl] [--compare old.json]
+import argparse
+import ast
+import asyncio
+import json
+import os
+import random
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+import httpx
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+QUERIES = [
+    "What is the speed of sound in air?",
+    "How does SONAR work?",
+    "Define frequency and its SI unit hertz.",
+    "What is the difference between loudness and pitch?",
+    "Explain the reflection of sound.",
+    "What is an echo and when is it heard?",
+    "What is ultrasound used for?",
+    "How is sound produced by vibrating objects?",
+]
+
+FOLLOW_UPS = ["Why?", "Give an example of this.", "Explain it more simply."]
+
+# One conversation sent turn by turn after the workload, to measure the prompt tokens each turn costs;
+# its first question is not in QUERIES, so it is not answered from the answer cache
+CONVERSATION_PROBE = ["What is reverberation and how can it be reduced?", "Why?", "Give an example of this.",
+                      "Explain it more simply.", "Why is it so?", "Give more examples."]
+PROMPT_TOKENS_RE = re.compile(r'^llm_tokens_sum\{kind="prompt"\} (\S+)$', re.MULTILINE)
+
+# (name, weight, method, path, body); one request of the workload per draw
+DEFAULT_WORKLOAD = [
+    ("generate", 5, "POST", "/generate", lambda rng: {"text": rng.choice(QUERIES)}),
+    # Opens a session; the follow-ups below are sent on it and reported as "conversation_follow_up"
+    ("conversation", 2, "POST", "/generate", lambda rng: {"text": rng.choice(QUERIES), "session_id": ""}),
+    ("quiz", 2, "POST", "/quiz", lambda rng: {"num_questions": 3}),
+    ("evaluate_answer", 2, "POST", "/evaluate_answer",
+     lambda rng: {"question": rng.choice(QUERIES), "answer": "Sound needs a medium to travel."}),
+    ("evaluate_quiz", 1, "POST", "/evaluate_quiz", lambda rng: {"items": [
+        {"question": "Sound needs a medium to travel.", "type": "true_false", "options": ["True", "False"],
+         "answer": "True", "user_answer": rng.choice(["True", "False"])},
+        {"question": "What is an echo?", "type": "short_answer", "answer": "A reflected sound heard after the original.",
+         "user_answer": "A sound that bounces back."},
+    ]}),
+    ("chapter_summary", 1, "GET", "/chapter_summary", lambda rng: None),
+    ("text_to_speech", 1, "POST", "/text_to_speech",
+     lambda rng: {"text": "Sound travels as a wave. It needs a medium. Its speed depends on the medium."}),
+]
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+def build_workload(path, total, seed):
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            entries = [json.loads(line) for line in f if line.strip()]
+        # Replayed in file order, repeated until the requested count is reached
+        return [entries[i % len(entries)] for i in range(total)]
+    rng = random.Random(seed)
+    names = [entry for entry in DEFAULT_WORKLOAD for _ in range(entry[1])]
+    workload = []
+    for _ in range(total):
+        name, _, method, endpoint, body = rng.choice(names)
+        request = {"name": name, "method": method, "path": endpoint, "json": body(rng)}
+        if name == "conversation":
+            request["follow_ups"] = rng.sample(FOLLOW_UPS, 2)
+        workload.append(request)
+    return workload
+
+def make_workspace():
+    # Fresh db/, artifacts/ and caches so the first start measures a full ingest
+    workspace = tempfile.mkdtemp(prefix="e2e_bench_")
+    for name in ("api.py", "src", "data"):
+        os.symlink(os.path.join(REPO_DIR, name), os.path.join(workspace, name))
+    return workspace
+
+def start_server(module, port, cwd, env, log_path):
+    log = open(log_path, "w")
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", module, "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=cwd, env=env, stdout=log, stderr=subprocess.STDOUT)
+    return process, log
+
+def wait_until_ready(url, process, timeout):
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode} before becoming ready")
+        try:
+            if httpx.get(url, timeout=1.0).status_code == 200:
+                return time.perf_counter() - start
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    raise TimeoutError(f"{url} not ready after {timeout}s")
+
+def stop_server(process, log):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+    log.close()
+
+def memory_stats(pid):
+    # VmRSS is current resident memory, VmHWM its peak; Linux only
+    stats = {}
+    try:
+        with open(f"/proc/{pid}/status", "r") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("VmRSS", "VmHWM"):
+                    stats[f"{key.lower()}_mb"] = round(int(value.split()[0]) / 1024, 1)
+    except OSError:
+        pass
+    return stats
+
+def ingest_stats(log_path):
+    # Parsed from the "Ingested <pdf>: {...}" lines src/ingest.py logs
+    files = []
+    with open(log_path, "r", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            match = re.search(r"Ingested (.+?): (\{.*\})\s*$", line)
+            if match:
+                files.append({"source": match.group(1), **ast.literal_eval(match.group(2))})
+    return {
+        "files": files,
+        "seconds": round(sum(entry["seconds"] for entry in files), 2),
+        "pages": sum(entry["pages"] for entry in files),
+    }
+
+async def run_workload(base_url, workload, concurrency, timeout):
+    results = defaultdict(lambda: {"latencies": [], "errors": 0, "statuses": defaultdict(int)})
+    queue = asyncio.Queue()
+    for request in workload:
+        queue.put_nowait(request)
+
+    async def send(client, name, request):
+        result = results[name]
+        start = time.perf_counter()
+        response = None
+        try:
+            response = await client.request(request["method"], request["path"], json=request.get("json"),
+                                            params=request.get("params"))
+            # Read the full body so streamed endpoints are timed to the last byte
+            await response.aread()
+            result["statuses"][response.status_code] += 1
+            if response.status_code >= 400:
+                result["errors"] += 1
+                response = None
+        except httpx.HTTPError:
+            result["statuses"]["exception"] += 1
+            result["errors"] += 1
+        result["latencies"].append((time.perf_counter() - start) * 1000)
+        return response
+
+    async def worker(client):
+        while not queue.empty():
+            request = queue.get_nowait()
+            name = request.get("name", request["path"])
+            response = await send(client, name, request)
+            if response is None or not request.get("follow_ups"):
+                continue
+            session_id = response.json()["session_id"]
+            for follow_up in request["follow_ups"]:
+                follow_up_request = {**request, "json": {**request["json"], "text": follow_up,
+                                                         "session_id": session_id}}
+                await send(client, f"{name}_follow_up", follow_up_request)
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    endpoints = {}
+    for name, result in sorted(results.items()):
+        latencies = result["latencies"]
+        endpoints[name] = {
+            "requests": len(latencies),
+            "errors": result["errors"],
+            "statuses": {str(status): count for status, count in result["statuses"].items()},
+            "p50_ms": round(statistics.median(latencies), 1),
+            "p95_ms": round(percentile(latencies, 95), 1),
+            "p99_ms": round(percentile(latencies, 99), 1),
+        }
+    all_latencies = [latency for result in results.values() for latency in result["latencies"]]
+    return {
+        "requests": len(all_latencies),
+        "errors": sum(result["errors"] for result in results.values()),
+        "seconds": round(elapsed, 2),
+        "throughput_rps": round(len(all_latencies) / elapsed, 2),
+        "p50_ms": round(statistics.median(all_latencies), 1),
+        "p95_ms": round(percentile(all_latencies, 95), 1),
+        "p99_ms": round(percentile(all_latencies, 99), 1),
+        "endpoints": endpoints,
+    }
+
+def prompt_tokens(client):
+    match = PROMPT_TOKENS_RE.search(client.get("/metrics").text)
+    return float(match.group(1)) if match else 0.0
+
+def conversation_tokens(base_url, timeout):
+    # Prompt tokens sent per turn, from the llm_tokens{kind="prompt"} sum; nothing else runs meanwhile
+    per_turn = []
+    with httpx.Client(base_url=base_url, timeout=timeout) as client:
+        session_id = ""
+        for text in CONVERSATION_PROBE:
+            before = prompt_tokens(client)
+            response = client.post("/generate", json={"text": text, "session_id": session_id})
+            response.raise_for_status()
+            session_id = response.json()["session_id"]
+            per_turn.append(round(prompt_tokens(client) - before))
+    return per_turn
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def compare(results, baseline_path):
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"Compared with {baseline_path} ({baseline.get('commit')}):")
+    rows = [("overall", baseline["workload"], results["workload"])]
+    rows += [(name, baseline["workload"]["endpoints"].get(name), stats)
+             for name, stats in results["workload"]["endpoints"].items()]
+    for name, old, new in rows:
+        if not old:
+            continue
+        changes = ", ".join(
+            f"{metric} {old[metric]} -> {new[metric]} ({(new[metric] - old[metric]) / old[metric] * 100:+.1f}%)"
+            for metric in ("p50_ms", "p95_ms", "p99_ms", "throughput_rps") if metric in old and old[metric])
+        print(f"  {name}: {changes}")
+    print(f"  cold_start_s: {baseline['cold_start_s']} -> {results['cold_start_s']}")
+    if "conversation_prompt_tokens" in baseline:
+        print(f"  conversation_prompt_tokens: {baseline['conversation_prompt_tokens']} -> "
+              f"{results['conversation_prompt_tokens']}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end API benchmark with stub Gemini and Sarvam")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--workload", help="JSONL of {name, method, path, json, params} requests to replay")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--llm-latency-ms", type=float, default=300)
+    parser.add_argument("--tts-latency-ms", type=float, default=250)
+    parser.add_argument("--port", type=int, default=8710)
+    parser.add_argument("--tts-port", type=int, default=8711)
+    parser.add_argument("--ready-timeout", type=float, default=600)
+    parser.add_argument("--request-timeout", type=float, default=120)
+    parser.add_argument("--output", help="Result JSON path (default bench/results/e2e_<commit>.json)")
+    parser.add_argument("--compare", help="Earlier result JSON to diff against")
+    parser.add_argument("--keep-workspace", action="store_true")
+    args = parser.parse_args()
+
+    workspace = make_workspace()
+    env = {
+        **os.environ,
+        "LLM_BACKEND": "stub",
+        "STUB_LLM_LATENCY_MS": str(args.llm_latency_ms),
+        "STUB_TTS_LATENCY_MS": str(args.tts_latency_ms),
+        "SARVAM_TTS_URL": f"http://127.0.0.1:{args.tts_port}/text-to-speech",
+        "SARVAM_API_KEY": os.getenv("SARVAM_API_KEY", "stub"),
+        "GOOGLE_API_KEY": os.getenv("GOOGLE_API_KEY", "stub"),
+        "PYTHONPATH": REPO_DIR,
+    }
+    base_url = f"http://127.0.0.1:{args.port}"
+    api_log = os.path.join(workspace, "api.log")
+    tts_process, tts_log = start_server("bench.stub_sarvam:app", args.tts_port, REPO_DIR, env,
+                                        os.path.join(workspace, "stub_sarvam.log"))
+    try:
+        wait_until_ready(f"http://127.0.0.1:{args.tts_port}/docs", tts_process, 30)
+
+        # First start on an empty workspace: process start, model load and full ingest
+        api_process, log = start_server("api:app", args.port, workspace, env, api_log)
+        cold_start = wait_until_ready(f"{base_url}/ready", api_process, args.ready_timeout)
+        memory_after_start = memory_stats(api_process.pid)
+        workload = build_workload(args.workload, args.requests, args.seed)
+        workload_stats = asyncio.run(run_workload(base_url, workload, args.concurrency, args.request_timeout))
+        conversation_prompt_tokens = conversation_tokens(base_url, args.request_timeout)
+        memory_after_load = memory_stats(api_process.pid)
+        stop_server(api_process, log)
+
+        # Second start reuses the persisted index, so the difference is the ingest cost
+        api_process, log = start_server("api:app", args.port, workspace, env, os.path.join(workspace, "api_warm.log"))
+        warm_start = wait_until_ready(f"{base_url}/ready", api_process, args.ready_timeout)
+        stop_server(api_process, log)
+    finally:
+        stop_server(tts_process, tts_log)
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "workload": args.workload or "default",
+            "seed": args.seed,
+            "llm_latency_ms": args.llm_latency_ms,
+            "tts_latency_ms": args.tts_latency_ms,
+        },
+        "cold_start_s": round(cold_start, 2),
+        "warm_start_s": round(warm_start, 2),
+        "ingest": ingest_stats(api_log),
+        "memory_after_start": memory_after_start,
+        "memory_after_load": memory_after_load,
+        "workload": workload_stats,
+        "conversation_prompt_tokens": conversation_prompt_tokens,
+    }
+
+    output = args.output or os.path.join(REPO_DIR, "bench", "results", f"e2e_{results['commit']}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
+    print(f"Results written to {output}")
+    if args.compare:
+        compare(results, args.compare)
+    if args.keep_workspace:
+        print(f"Workspace kept at {workspace}")
+    else:
+        shutil.rmtree(workspace, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+# embedding_bench.py
+# Usage: python -m bench.embedding_bench --backends torch onnx --batch-size 64 --workers 2
+import argparse
+import json
+import statistics
+import time
+from src.embeddings import EMBEDDING_MODEL, EmbeddingService
+from src.ingest import load_and_split_documents
+
+QUERIES = [
+    "What is the speed of sound in air?",
+    "How does SONAR work?",
+    "Define frequency and its SI unit hertz.",
+    "What is the difference between loudness and pitch?",
+    "Explain the reflection of sound.",
+    "What is an echo and when is it heard?",
+    "What is ultrasound used for?",
+    "How is sound produced by vibrating objects?",
+]
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+def bench_backend(backend, texts, batch_size, workers, query_rounds):
+    start = time.perf_counter()
+    # No cache: measure raw encoding cost
+    service = EmbeddingService(EMBEDDING_MODEL, backend=backend, batch_size=batch_size,
+                               workers=workers, cache_path=None)
+    load_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    service.embed_documents(texts)
+    ingest_seconds = time.perf_counter() - start
+
+    service.embed_query(QUERIES[0])  # warm-up
+    latencies = []
+    for _ in range(query_rounds):
+        for query in QUERIES:
+            start = time.perf_counter()
+            service.embed_query(query)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    return {
+        "backend": backend,
+        "batch_size": batch_size,
+        "workers": workers,
+        "model_load_s": round(load_seconds, 3),
+        "ingest_docs": len(texts),
+        "ingest_docs_per_s": round(len(texts) / ingest_seconds, 1),
+        "query_p50_ms": round(statistics.median(latencies), 2),
+        "query_p99_ms": round(percentile(latencies, 99), 2),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark embedding backends on CPU")
+    parser.add_argument("--pdf", default="data/ncert_sound_chap.pdf")
+    parser.add_argument("--backends", nargs="+", default=["torch", "onnx"])
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--repeat-docs", type=int, default=10, help="Repeat the chapter's chunks to get a stable rate")
+    parser.add_argument("--query-rounds", type=int, default=25)
+    args = parser.parse_args()
+
+    texts = [doc.page_content for doc in load_and_split_documents(args.pdf)] * args.repeat_docs
+    results = []
+    for backend in args.backends:
+        try:
+            results.append(bench_backend(backend, texts, args.batch_size, args.workers, args.query_rounds))
+        except Exception as e:
+            results.append({"backend": backend, "error": str(e)})
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
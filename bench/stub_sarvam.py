@@ -0,0 +1,35 @@
+# stub_sarvam.py
+# Local stand-in for the Sarvam text-to-speech API.
+# Usage: uvicorn bench.stub_sarvam:app --port 8765, then point SARVAM_TTS_URL at http://127.0.0.1:8765/text-to-speech
+import asyncio
+import base64
+import io
+import os
+import wave
+from fastapi import FastAPI, Request
+
+STUB_TTS_LATENCY_MS = float(os.getenv("STUB_TTS_LATENCY_MS", "250"))
+# Seconds of audio returned per input character, roughly matching real speech
+SECONDS_PER_CHAR = 0.06
+
+app = FastAPI()
+
+def silent_wav(seconds: float, sample_rate: int) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(b"\0\0" * int(seconds * sample_rate))
+    return buffer.getvalue()
+
+@app.post("/text-to-speech")
+async def text_to_speech(request: Request):
+    payload = await request.json()
+    await asyncio.sleep(STUB_TTS_LATENCY_MS / 1000)
+    sample_rate = int(payload.get("speech_sample_rate", 8000))
+    audios = [
+        base64.b64encode(silent_wav(len(text) * SECONDS_PER_CHAR, sample_rate)).decode("ascii")
+        for text in payload.get("inputs", [])
+    ]
+    return {"audios": audios}
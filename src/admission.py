@@ -0,0 +1,127 @@
+# admission.py
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+from src.metrics import ADMISSION_EVENTS, ADMISSION_QUEUE_DEPTH, STAGE_SECONDS
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# LLM calls allowed to run at once across all requests, calls allowed to wait for a slot,
+# and the longest a call waits before it is shed
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "64"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))
+
+# Lower runs first: interactive Q&A and grading, then quizzes and artifacts, then background rebuilds
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+# Set per request by the API; LLM calls made while handling the request queue at this priority
+request_priority: contextvars.ContextVar[int] = contextvars.ContextVar("request_priority", default=PRIORITY_NORMAL)
+
+class Overloaded(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__("Too many requests are waiting for the language model, please retry shortly")
+        self.retry_after = retry_after
+
+class AdmissionController:
+    """Global limit on concurrent LLM calls, with a bounded priority queue in front of it.
+
+    A call runs at once if a slot is free and nobody is waiting. Otherwise it
+    waits in priority order (FIFO within a priority). When the queue is full,
+    or a call has waited ``queue_timeout`` seconds, it is rejected with
+    ``Overloaded`` carrying a Retry-After estimate from recent call times.
+    """
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY, max_queue: int = LLM_MAX_QUEUE,
+                 queue_timeout: float = LLM_QUEUE_TIMEOUT):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._active = 0
+        self._queued = 0
+        self._waiters = []
+        self._sequence = itertools.count()
+        # Moving average of how long a call holds its slot
+        self._hold_seconds = 2.0
+        self._stats = {"admitted": 0, "queued": 0, "shed": 0, "timed_out": 0}
+
+    def retry_after(self) -> float:
+        return max(1.0, self._hold_seconds * (self._queued + 1) / self.max_concurrency)
+
+    def _shed(self, reason: str):
+        self._stats[reason] += 1
+        ADMISSION_EVENTS.labels(reason).inc()
+        raise Overloaded(self.retry_after())
+
+    async def _acquire(self, priority: int):
+        if self._active < self.max_concurrency and not self._queued:
+            self._active += 1
+            return
+        if self._queued >= self.max_queue:
+            self._shed("shed")
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), future))
+        self._queued += 1
+        self._stats["queued"] += 1
+        ADMISSION_EVENTS.labels("queued").inc()
+        ADMISSION_QUEUE_DEPTH.set(self._queued)
+        try:
+            await asyncio.wait_for(future, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._queued -= 1
+            ADMISSION_QUEUE_DEPTH.set(self._queued)
+            self._shed("timed_out")
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just as the caller went away
+                self._release()
+            else:
+                self._queued -= 1
+                ADMISSION_QUEUE_DEPTH.set(self._queued)
+            raise
+
+    def _release(self):
+        # Hand the slot straight to the next waiter, skipping ones that timed out or were cancelled
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                self._queued -= 1
+                ADMISSION_QUEUE_DEPTH.set(self._queued)
+                future.set_result(None)
+                return
+        self._active -= 1
+
+    @asynccontextmanager
+    async def slot(self, priority: Optional[int] = None):
+        priority = request_priority.get() if priority is None else priority
+        start = time.perf_counter()
+        await self._acquire(priority)
+        acquired = time.perf_counter()
+        STAGE_SECONDS.labels("admission_wait").observe(acquired - start)
+        self._stats["admitted"] += 1
+        ADMISSION_EVENTS.labels("admitted").inc()
+        try:
+            yield
+        finally:
+            self._hold_seconds = 0.8 * self._hold_seconds + 0.2 * (time.perf_counter() - acquired)
+            self._release()
+
+    def get_stats(self) -> Dict:
+        return {**self._stats, "active": self._active, "waiting": self._queued,
+                "max_concurrency": self.max_concurrency, "max_queue": self.max_queue,
+                "retry_after": round(self.retry_after(), 1)}
+
+_controller = AdmissionController()
+
+def get_admission_controller() -> AdmissionController:
+    return _controller
@@ -0,0 +1,129 @@
+# answer_cache.py
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+import numpy as np
+from src.metrics import record_cache
+
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1024"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+# Cosine similarity above which a cached answer is reused for a differently worded query
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95"))
+
+def normalize_query(query: str) -> str:
+    query = re.sub(r"\s+", " ", query.lower()).strip()
+    return query.strip(" ?!.")
+
+class AnswerCache:
+    """Two-tier cache of generated answers.
+
+    The exact tier is keyed on the normalized query plus the ids of the chunks
+    retrieved for it. The semantic tier stores the query embedding and serves
+    any later query whose embedding is within the similarity threshold. Both
+    tiers are bounded LRUs with a TTL and are cleared when the index version
+    changes. Semantic matches are only served within the same scope (e.g. the
+    chapter filter the query was run with).
+    """
+
+    def __init__(self, version: Optional[str] = None, max_entries: int = ANSWER_CACHE_SIZE,
+                 ttl_seconds: float = ANSWER_CACHE_TTL, similarity_threshold: float = ANSWER_CACHE_SIMILARITY):
+        self.version = version
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._exact = OrderedDict()
+        self._semantic = OrderedDict()
+        self._matrix = None
+        self._matrix_keys = []
+        self._lock = threading.Lock()
+        self._stats = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    @staticmethod
+    def _unit(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _expired(self, expires_at: float) -> bool:
+        return expires_at < time.monotonic()
+
+    def _evict(self, store: OrderedDict):
+        while len(store) > self.max_entries:
+            store.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def get_exact(self, query: str, chunk_ids: List[str]) -> Optional[Dict]:
+        key = (normalize_query(query), tuple(chunk_ids))
+        with self._lock:
+            entry = self._exact.get(key)
+            if entry is None or self._expired(entry[0]):
+                self._exact.pop(key, None)
+                self._stats["misses"] += 1
+                record_cache("answer", "miss")
+                return None
+            self._exact.move_to_end(key)
+            self._stats["exact_hits"] += 1
+            record_cache("answer", "exact_hit")
+            return entry[1]
+
+    def get_semantic(self, embedding, scope: Optional[str] = None) -> Optional[Dict]:
+        if self.similarity_threshold > 1:
+            return None
+        with self._lock:
+            if not self._semantic:
+                return None
+            if self._matrix is None:
+                self._matrix_keys = list(self._semantic.keys())
+                self._matrix = np.stack([self._semantic[key][1] for key in self._matrix_keys])
+            scores = self._matrix @ self._unit(embedding)
+            scores[[key[0] != scope for key in self._matrix_keys]] = -1.0
+            best = int(np.argmax(scores))
+            if scores[best] < self.similarity_threshold:
+                return None
+            key = self._matrix_keys[best]
+            expires_at, _, response = self._semantic[key]
+            if self._expired(expires_at):
+                del self._semantic[key]
+                self._matrix = None
+                return None
+            self._semantic.move_to_end(key)
+            self._stats["semantic_hits"] += 1
+            record_cache("answer", "semantic_hit")
+            return response
+
+    def put(self, query: str, chunk_ids: List[str], embedding, response: Dict, scope: Optional[str] = None):
+        normalized = normalize_query(query)
+        expires_at = time.monotonic() + self.ttl_seconds
+        with self._lock:
+            self._exact[(normalized, tuple(chunk_ids))] = (expires_at, response)
+            self._exact.move_to_end((normalized, tuple(chunk_ids)))
+            self._evict(self._exact)
+            if embedding is not None:
+                self._semantic[(scope, normalized)] = (expires_at, self._unit(embedding), response)
+                self._semantic.move_to_end((scope, normalized))
+                self._evict(self._semantic)
+                self._matrix = None
+
+    def invalidate(self, version: Optional[str] = None):
+        with self._lock:
+            self._exact.clear()
+            self._semantic.clear()
+            self._matrix = None
+            self._matrix_keys = []
+            self.version = version
+            self._stats["invalidations"] += 1
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            lookups = self._stats["exact_hits"] + self._stats["semantic_hits"] + self._stats["misses"]
+            hits = self._stats["exact_hits"] + self._stats["semantic_hits"]
+            return {
+                **self._stats,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "exact_entries": len(self._exact),
+                "semantic_entries": len(self._semantic),
+                "version": self.version,
+            }
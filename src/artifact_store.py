@@ -0,0 +1,152 @@
+# artifact_store.py
+import asyncio
+import json
+import logging
+import os
+import re
+import shutil
+from typing import Dict, List, Optional
+from src.diagram_agent import DiagramAgent
+from src.exam_guide_agent import ExamGuideAgent
+from src.metrics import COALESCED_REQUESTS, record_cache, span
+from src.rag_system import RAGSystem
+from src.singleflight import SingleFlight
+from src.summary_tool import SummaryTool
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+ARTIFACT_DIR = os.getenv("ARTIFACT_DIR", "artifacts")
+
+# Artifacts generated by the build step; other exam guide sizes are built on first request
+DEFAULT_ARTIFACTS = ["chapter_summary", "important_topics", "summary_flowchart", "exam_guide_2"]
+
+class ArtifactBuildError(Exception):
+    pass
+
+def exam_guide_artifact(num_questions: int) -> str:
+    return f"exam_guide_{num_questions}"
+
+def _scope_dir(chapter: Optional[str]) -> str:
+    return re.sub(r"[^A-Za-z0-9_-]+", "-", chapter).strip("-").lower() if chapter else "_all"
+
+async def build_artifact(rag_system: RAGSystem, name: str, chapter: Optional[str] = None) -> str:
+    if name == "chapter_summary":
+        with span("agent.chapter_summary"):
+            value = await SummaryTool(rag_system, chapter).generate_summary()
+    elif name == "important_topics":
+        with span("agent.important_topics"):
+            value = await SummaryTool(rag_system, chapter).generate_important_topics()
+    elif name == "summary_flowchart":
+        with span("agent.summary_flowchart"):
+            value = await DiagramAgent(rag_system, chapter).generate_summary_flowchart()
+    elif name.startswith("exam_guide_"):
+        num_questions = int(name[len("exam_guide_"):])
+        with span("agent.exam_guide"):
+            value = await ExamGuideAgent(rag_system, chapter).create_exam_guide(num_questions)
+    else:
+        raise ValueError(f"Unknown artifact: {name}")
+
+    if not value:
+        raise ArtifactBuildError(f"Failed to generate artifact {name}")
+    return value
+
+class ArtifactStore:
+    """On-disk store of generated chapter artifacts, one directory per collection and index version.
+
+    Reads are served from memory after the first load. Misses are built through
+    a single-flight group, so concurrent requests for the same missing artifact
+    trigger exactly one LLM call.
+    """
+
+    def __init__(self, directory: str = ARTIFACT_DIR):
+        self.directory = directory
+        self._memory: Dict[tuple, str] = {}
+        self._flights = SingleFlight()
+
+    def _path(self, collection: str, version: str, chapter: Optional[str], name: str) -> str:
+        return os.path.join(self.directory, collection, version, _scope_dir(chapter), f"{name}.json")
+
+    def load(self, collection: str, version: str, chapter: Optional[str], name: str) -> Optional[str]:
+        key = (collection, version, chapter, name)
+        value = self._memory.get(key)
+        if value is not None:
+            return value
+        path = self._path(*key)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            value = json.load(f)["value"]
+        self._memory[key] = value
+        return value
+
+    def save(self, collection: str, version: str, chapter: Optional[str], name: str, value: str):
+        key = (collection, version, chapter, name)
+        path = self._path(*key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"name": name, "collection": collection, "version": version, "chapter": chapter,
+                       "value": value}, f)
+        os.replace(tmp_path, path)
+        self._memory[key] = value
+
+    def clear(self, collection: str, version: str):
+        self._memory = {key: value for key, value in self._memory.items() if key[:2] != (collection, version)}
+        shutil.rmtree(os.path.join(self.directory, collection, version), ignore_errors=True)
+
+    def prune(self, collection: str, keep_version: str):
+        # Drop artifacts generated for older versions of the collection's index
+        collection_dir = os.path.join(self.directory, collection)
+        if not os.path.isdir(collection_dir):
+            return
+        for version in os.listdir(collection_dir):
+            if version != keep_version:
+                self.clear(collection, version)
+
+    async def get(self, rag_system: RAGSystem, name: str, chapter: Optional[str] = None) -> str:
+        key = (rag_system.collection_name, rag_system.index_version, chapter, name)
+        value = self.load(*key)
+        if value is not None:
+            record_cache("artifact", "hit")
+            return value
+        record_cache("artifact", "miss")
+        if key in self._flights:
+            COALESCED_REQUESTS.labels("artifact").inc()
+        return await self._flights.do(key, lambda: self._build(rag_system, key))
+
+    async def _build(self, rag_system: RAGSystem, key: tuple) -> str:
+        value = self.load(*key)
+        if value is not None:
+            return value
+        collection, version, chapter, name = key
+        logger.info(f"Building artifact {name} for {collection}/{chapter or 'all chapters'} at index version {version}")
+        value = await build_artifact(rag_system, name, chapter)
+        self.save(*key, value)
+        return value
+
+    async def refresh(self, rag_system: RAGSystem, names: List[str] = DEFAULT_ARTIFACTS) -> List[str]:
+        self.clear(rag_system.collection_name, rag_system.index_version)
+        return await self.build_all(rag_system, names)
+
+    async def build_all(self, rag_system: RAGSystem, names: List[str] = DEFAULT_ARTIFACTS) -> List[str]:
+        self.prune(rag_system.collection_name, rag_system.index_version)
+        # Whole-collection artifacts, plus per-chapter ones when the collection has several chapters
+        chapters = [None] + (rag_system.chapters if len(rag_system.chapters) > 1 else [])
+        await asyncio.gather(*(self.get(rag_system, name, chapter) for name in names for chapter in chapters))
+        return list(names)
+
+if __name__ == "__main__":
+    # Build step: python -m src.artifact_store [collection ...]
+    import sys
+    from src.engine import get_corpus
+
+    async def build_corpus(collections):
+        corpus = get_corpus()
+        store = ArtifactStore()
+        for collection in collections or list(corpus.collections):
+            rag_system = corpus.get(collection)
+            built = await store.build_all(rag_system)
+            print(f"Built {', '.join(built)} for {collection} at index version {rag_system.index_version}")
+
+    asyncio.run(build_corpus(sys.argv[1:]))
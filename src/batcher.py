@@ -0,0 +1,84 @@
+# batcher.py
+import asyncio
+import logging
+import os
+import time
+from typing import Callable, Generic, List, Optional, TypeVar
+from src.metrics import BATCH_SIZE, STAGE_SECONDS
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+# Set to 0 to send every query embedding and vector search on its own
+QUERY_BATCHING = os.getenv("QUERY_BATCHING", "1") == "1"
+QUERY_BATCH_SIZE = int(os.getenv("QUERY_BATCH_SIZE", "32"))
+# Longest a request waits for others to join its batch
+QUERY_BATCH_WINDOW_MS = float(os.getenv("QUERY_BATCH_WINDOW_MS", "5"))
+
+class MicroBatcher(Generic[T, R]):
+    """Collects concurrent calls into one call of ``fn`` on a list of items.
+
+    When no batch is running, a call is dispatched at once, so an idle server
+    adds no latency. While a batch is running, new calls gather until the
+    batch is full or ``max_wait_ms`` has passed. ``fn`` runs on ``executor``
+    and must return one result per item, in order.
+    """
+
+    def __init__(self, fn: Callable[[List[T]], List[R]], name: str, max_batch_size: int = QUERY_BATCH_SIZE,
+                 max_wait_ms: float = QUERY_BATCH_WINDOW_MS, executor=None):
+        self.fn = fn
+        self.name = name
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.executor = executor
+        self._pending = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._running = 0
+
+    async def submit(self, item: T) -> R:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        if self._running == 0 or len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._pending:
+            batch = self._pending[:self.max_batch_size]
+            self._pending = self._pending[self.max_batch_size:]
+            # Callers that were cancelled while waiting are dropped from the batch
+            batch = [(item, future) for item, future in batch if not future.done()]
+            if batch:
+                self._running += 1
+                asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch):
+        loop = asyncio.get_running_loop()
+        BATCH_SIZE.labels(self.name).observe(len(batch))
+        start = time.perf_counter()
+        try:
+            results = await loop.run_in_executor(self.executor, self.fn, [item for item, _ in batch])
+        except Exception as e:
+            logger.error(f"{self.name} batch of {len(batch)} failed: {str(e)}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self._running -= 1
+            STAGE_SECONDS.labels(f"{self.name}_batch").observe(time.perf_counter() - start)
+            # Calls that queued behind this batch go out now rather than waiting out the window
+            if self._pending and self._running == 0:
+                self._flush()
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
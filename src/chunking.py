@@ -0,0 +1,260 @@
+# chunking.py
+import hashlib
+import math
+import os
+import re
+from collections import Counter
+from typing import Callable, Dict, List, NamedTuple, Optional
+from langchain_core.documents import Document
+
+# "structured" follows the chapter's headings and boxes; "recursive" is the old 2000/200 character splitter
+CHUNK_STRATEGY = os.getenv("CHUNK_STRATEGY", "structured")
+# Retrieval chunk size and overlap, in tokens
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "160"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "32"))
+# Set to 0 to index chunks on their own instead of linking each one to its enclosing block
+SMALL_TO_BIG = os.getenv("SMALL_TO_BIG", "1") == "1"
+# Largest parent block handed to the prompt in place of a small chunk, in tokens
+PARENT_CHUNK_TOKENS = int(os.getenv("PARENT_CHUNK_TOKENS", "600"))
+# "estimate" counts one token per four characters and loads no tokenizer; "embedding" counts with the
+# embedding model's tokenizer, so no chunk is truncated by the embedder
+CHUNK_TOKENIZER = os.getenv("CHUNK_TOKENIZER", "estimate")
+
+# NCERT layout: "11.1 Production of Sound"; pypdf often drops the space, as in "11.2Propagation of Sound"
+# and "11.3.1ECHO", so the title only has to start with a capital letter right after the number
+SECTION_RE = re.compile(r"^\s*(\d{1,2}(?:\.\d{1,2}){1,2})\s*([A-Z][^.?!]{2,80})$")
+# Boxed material that should stay in one piece: "Activity _____ 12.3", "Example 12.1", end-of-chapter lists
+BOX_RE = re.compile(r"^\s*(Activity|Example)\b[\s_\-–]*\d+(?:\.\d+)*", re.IGNORECASE)
+# Figure and table captions; one after a box belongs to the text that follows, so it closes the box
+CAPTION_RE = re.compile(r"^\s*(Fig(?:ure)?|Table)\.?\s*\d+(?:\.\d+)*\s*[:.]", re.IGNORECASE)
+END_MATTER_RE = re.compile(r"^\s*(Exercises|Questions|What you have learnt|Summary)\s*:?\s*$", re.IGNORECASE)
+BOX_TYPES = ("activity", "example")
+# Bumped when block detection changes, so indexes built with the old rules are re-chunked
+STRUCTURED_CHUNKER_VERSION = 3
+# Running headers and footers ("SCIENCE128", "SOUND 129", "Rationalised 2023-24") are short lines among the
+# first and last lines of a page; one seen at the edge of two pages is dropped everywhere
+PAGE_EDGE_LINES = 2
+PAGE_EDGE_MAX_CHARS = 40
+SENTENCE_RE = re.compile(r"(?<=[.!?।])\s+(?=[A-Z0-9(\"'])")
+# Lines that are mostly symbols and numbers (equations, units) stay glued to the sentence before them
+EQUATION_RE = re.compile(r"^[^A-Za-z]*(?:[A-Za-z][^A-Za-z]{0,3}){0,6}$|[=×÷√∝]")
+
+def count_tokens(text: str) -> int:
+    # Roughly four characters per token for English prose; cheap enough for the hot path
+    return math.ceil(len(text) / 4)
+
+def embedding_token_counter() -> Callable[[str], int]:
+    from transformers import AutoTokenizer
+    from src.embeddings import EMBEDDING_MODEL
+
+    tokenizer = AutoTokenizer.from_pretrained(EMBEDDING_MODEL)
+    return lambda text: len(tokenizer.encode(text, add_special_tokens=False))
+
+def chunker_signature(strategy: str = CHUNK_STRATEGY, chunk_tokens: int = CHUNK_TOKENS,
+                      overlap_tokens: int = CHUNK_OVERLAP_TOKENS, small_to_big: bool = SMALL_TO_BIG,
+                      parent_tokens: int = PARENT_CHUNK_TOKENS, tokenizer: str = CHUNK_TOKENIZER) -> str:
+    # Stored in the ingest manifest; a different signature means the PDF is chunked again
+    if strategy == "recursive":
+        return "recursive:2000:200"
+    return (f"{strategy}.v{STRUCTURED_CHUNKER_VERSION}:{chunk_tokens}:{overlap_tokens}:{int(small_to_big)}:"
+            f"{parent_tokens}:{tokenizer}")
+
+class Block(NamedTuple):
+    section: str
+    block_type: str
+    lines: List[str]
+
+class StructuredChunker:
+    """Splits pages into small retrieval chunks that follow the chapter's structure.
+
+    Lines are grouped into blocks at section headings, activity and example
+    boxes and end-of-chapter material. A box ends at a blank line, a figure
+    or table caption, the next heading or box, the end of its page or once
+    it reaches ``parent_tokens``. Running page headers and footers are
+    dropped. Each block is cut into parents of at most ``parent_tokens``,
+    and each parent into overlapping sentence-aligned chunks of at most
+    ``chunk_tokens``. Sizes and stored token counts all use the chunker's
+    length function. Chunks carry their token count,
+    section, block type and (with small-to-big) their parent's text, so
+    prompt assembly never has to re-measure or re-fetch anything.
+
+    The current section and end-of-chapter block carry over from page to page,
+    so pages must be fed in order.
+    """
+
+    def __init__(self, chunk_tokens: int = CHUNK_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+                 small_to_big: bool = SMALL_TO_BIG, parent_tokens: int = PARENT_CHUNK_TOKENS,
+                 length_function: Optional[Callable[[str], int]] = None):
+        self.chunk_tokens = chunk_tokens
+        self.overlap_tokens = min(overlap_tokens, chunk_tokens // 2)
+        self.small_to_big = small_to_big
+        self.parent_tokens = max(parent_tokens, chunk_tokens)
+        self.length = length_function or count_tokens
+        self.section = ""
+        self.block_type = "text"
+        self._edge_counts = Counter()
+        self._edge_pages = set()
+
+    @staticmethod
+    def _edge_lines(lines: List[str]) -> Dict[int, str]:
+        # Line index -> key for the short lines at the top and bottom of a page; page numbers are ignored
+        filled = [i for i, line in enumerate(lines) if line]
+        edges = filled[:PAGE_EDGE_LINES] + filled[-PAGE_EDGE_LINES:]
+        return {i: re.sub(r"\d+", "#", re.sub(r"\s+", "", lines[i].lower()))
+                for i in edges if len(lines[i]) <= PAGE_EDGE_MAX_CHARS}
+
+    def learn_page_edges(self, documents: List[Document]):
+        for page in documents:
+            # Keyed by content, so a page the PDF repeats does not make its own first lines look like a header
+            page_key = hashlib.sha256(page.page_content.encode("utf-8")).digest()
+            if page_key not in self._edge_pages:
+                self._edge_pages.add(page_key)
+                lines = [line.strip() for line in page.page_content.splitlines()]
+                self._edge_counts.update(set(self._edge_lines(lines).values()))
+
+    def _blocks(self, text: str) -> List[Block]:
+        blocks = [Block(self.section, self.block_type, [])]
+        lines = [line.strip() for line in text.splitlines()]
+        furniture = {i for i, key in self._edge_lines(lines).items() if self._edge_counts[key] >= 2}
+        box_tokens = 0
+        for i, line in enumerate(lines):
+            if i in furniture:
+                continue
+            if not line:
+                # A blank line closes an activity or example box
+                if self.block_type in BOX_TYPES:
+                    self.block_type = "text"
+                continue
+            heading = SECTION_RE.match(line)
+            size = self.length(line)
+            if heading:
+                self.section = f"{heading.group(1)} {' '.join(heading.group(2).split()).title()}"
+                self.block_type = "text"
+            elif BOX_RE.match(line):
+                self.block_type = BOX_RE.match(line).group(1).lower()
+                box_tokens = 0
+            elif END_MATTER_RE.match(line):
+                self.section = END_MATTER_RE.match(line).group(1).title()
+                self.block_type = "exercise" if self.section in ("Exercises", "Questions") else "summary"
+            elif CAPTION_RE.match(line) and self.block_type in BOX_TYPES:
+                self.block_type = "text"
+            elif self.block_type in BOX_TYPES and box_tokens + size > self.parent_tokens:
+                # No box in the chapter is longer than a parent; past that, the text is prose again
+                self.block_type = "text"
+            box_tokens += size
+            if (self.section, self.block_type) != blocks[-1][:2]:
+                blocks.append(Block(self.section, self.block_type, []))
+            blocks[-1].lines.append(line)
+        # The PDF text rarely keeps blank lines, so a box never runs past its page
+        if self.block_type in BOX_TYPES:
+            self.block_type = "text"
+        return [block for block in blocks if block.lines]
+
+    def _units(self, lines: List[str]) -> List[str]:
+        # Sentences, with equation lines attached to the sentence they belong to
+        units = []
+        prose = []
+        for line in lines:
+            if EQUATION_RE.search(line) and len(line) < 80:
+                if prose:
+                    units.extend(SENTENCE_RE.split(" ".join(prose)))
+                    prose = []
+                if units:
+                    units[-1] = f"{units[-1]}\n{line}"
+                else:
+                    units.append(line)
+            else:
+                prose.append(line)
+        if prose:
+            units.extend(SENTENCE_RE.split(" ".join(prose)))
+        return [unit.strip() for unit in units if unit.strip()]
+
+    def _split_long(self, unit: str, limit: int) -> List[str]:
+        # A single sentence over the limit is cut on word boundaries
+        pieces, words = [], []
+        for word in unit.split(" "):
+            if words and self.length(" ".join(words + [word])) > limit:
+                pieces.append(" ".join(words))
+                words = []
+            words.append(word)
+        if words:
+            pieces.append(" ".join(words))
+        return pieces
+
+    def _pack(self, units: List[str], limit: int, overlap: int) -> List[List[str]]:
+        packed, current, used = [], [], 0
+        for unit in units:
+            size = self.length(unit)
+            if size > limit:
+                if current:
+                    packed.append(current)
+                    current, used = [], 0
+                packed.extend([piece] for piece in self._split_long(unit, limit))
+                continue
+            if current and used + size > limit:
+                packed.append(current)
+                # Carry trailing sentences into the next chunk as overlap
+                carried, carried_size = [], 0
+                for previous in reversed(current):
+                    previous_size = self.length(previous)
+                    if carried_size + previous_size > overlap or carried_size + previous_size + size > limit:
+                        break
+                    carried.insert(0, previous)
+                    carried_size += previous_size
+                current, used = carried, carried_size
+            current.append(unit)
+            used += size
+        if current:
+            packed.append(current)
+        return packed
+
+    def split_documents(self, documents: List[Document]) -> List[Document]:
+        # Pages passed together are all checked for running headers and footers before any is split
+        self.learn_page_edges(documents)
+        chunks = []
+        for page in documents:
+            for block in self._blocks(page.page_content):
+                units = self._units(block.lines)
+                metadata = {**page.metadata, "section": block.section, "block_type": block.block_type}
+                if not self.small_to_big:
+                    groups = [(metadata, self._pack(units, self.chunk_tokens, self.overlap_tokens))]
+                else:
+                    groups = []
+                    for parent_units in self._pack(units, self.parent_tokens, 0):
+                        parent = " ".join(parent_units)
+                        parent_id = hashlib.sha256(
+                            f"{page.metadata.get('source')}\x00{page.metadata.get('page')}\x00{parent}".encode()
+                        ).hexdigest()[:16]
+                        groups.append(({**metadata, "parent_id": parent_id, "parent_text": parent,
+                                        "parent_token_count": self.length(parent)},
+                                       self._pack(parent_units, self.chunk_tokens, self.overlap_tokens)))
+                for group_metadata, packed in groups:
+                    for chunk_units in packed:
+                        text = " ".join(chunk_units)
+                        chunks.append(Document(page_content=text,
+                                               metadata={**group_metadata, "token_count": self.length(text)}))
+        return chunks
+
+class RecursiveChunker:
+    """The original fixed-size character splitter, kept for comparison and old indexes."""
+
+    def __init__(self):
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+        self.splitter = RecursiveCharacterTextSplitter(chunk_size=2000, chunk_overlap=200, length_function=len)
+
+    def split_documents(self, documents: List[Document]) -> List[Document]:
+        chunks = self.splitter.split_documents(documents)
+        for chunk in chunks:
+            chunk.metadata["token_count"] = count_tokens(chunk.page_content)
+        return chunks
+
+def make_chunker(strategy: str = CHUNK_STRATEGY, chunk_tokens: int = CHUNK_TOKENS,
+                 overlap_tokens: int = CHUNK_OVERLAP_TOKENS, small_to_big: bool = SMALL_TO_BIG,
+                 parent_tokens: int = PARENT_CHUNK_TOKENS, tokenizer: str = CHUNK_TOKENIZER):
+    if strategy == "recursive":
+        return RecursiveChunker()
+    if strategy != "structured":
+        raise ValueError(f"Unknown chunking strategy: {strategy}")
+    length_function = embedding_token_counter() if tokenizer == "embedding" else count_tokens
+    return StructuredChunker(chunk_tokens, overlap_tokens, small_to_big, parent_tokens, length_function)
@@ -0,0 +1,102 @@
+# context_builder.py
+import os
+import re
+from typing import List, NamedTuple, Set
+from langchain_core.documents import Document
+from src.chunking import count_tokens
+from src.retriever import tokenize
+
+# Prompt context budgets, in (estimated) tokens
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+AGENT_CONTEXT_TOKEN_BUDGET = int(os.getenv("AGENT_CONTEXT_TOKEN_BUDGET", "3000"))
+
+# Overlaps shorter than this are treated as coincidence, not splitter overlap
+MIN_OVERLAP_CHARS = 40
+MAX_OVERLAP_CHARS = 400
+# Don't bother squeezing a trimmed chunk into less room than this
+MIN_TRIM_TOKENS = 40
+
+SENTENCE_RE = re.compile(r"(?<=[.!?।])\s+")
+
+class PackedContext(NamedTuple):
+    text: str
+    tokens: int
+    chunks: int
+
+def _overlap(left: str, right: str) -> int:
+    # Length of the longest suffix of left that is also a prefix of right
+    longest = min(MAX_OVERLAP_CHARS, len(left), len(right))
+    for size in range(longest, MIN_OVERLAP_CHARS - 1, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+def remove_overlap(selected: List[str], text: str) -> str:
+    for other in selected:
+        head = _overlap(other, text)
+        if head:
+            text = text[head:]
+        tail = _overlap(text, other)
+        if tail:
+            text = text[:-tail]
+    return text.strip()
+
+def trim_to_budget(text: str, query: str, budget: int) -> str:
+    # Keep the sentences sharing the most terms with the query, in their original order
+    sentences = [sentence for sentence in SENTENCE_RE.split(text) if sentence.strip()]
+    query_terms = set(tokenize(query))
+    ranked = sorted(
+        range(len(sentences)),
+        key=lambda i: len(query_terms.intersection(tokenize(sentences[i]))),
+        reverse=True,
+    )
+    kept = []
+    used = 0
+    for i in ranked:
+        cost = count_tokens(sentences[i])
+        if used + cost <= budget:
+            kept.append(i)
+            used += cost
+    return " ".join(sentences[i] for i in sorted(kept))
+
+def _expand(doc: Document, remaining: int, packed_parents: Set[str]):
+    # Small-to-big: a retrieved chunk brings its whole parent block when that still fits
+    parent_id = doc.metadata.get("parent_id")
+    if parent_id:
+        if parent_id in packed_parents:
+            return "", 0
+        parent_tokens = doc.metadata.get("parent_token_count")
+        if parent_tokens is not None and parent_tokens <= remaining:
+            packed_parents.add(parent_id)
+            return doc.metadata["parent_text"], parent_tokens
+    return doc.page_content, doc.metadata.get("token_count")
+
+def build_context(documents: List[Document], query: str, token_budget: int = CONTEXT_TOKEN_BUDGET) -> PackedContext:
+    """Pack retrieved chunks, most relevant first, into at most ``token_budget`` tokens.
+
+    Chunks linked to a parent block are replaced by the parent while it fits.
+    Text shared with an already packed chunk (the splitter's overlap) is dropped,
+    and the chunk that crosses the budget is cut down to its most query-relevant
+    sentences. Token counts stored at ingest are used as-is unless the text was cut.
+    """
+    pieces = []
+    used = 0
+    packed_parents = set()
+    for doc in documents:
+        original, cost = _expand(doc, token_budget - used, packed_parents)
+        text = remove_overlap(pieces, original)
+        if not text:
+            continue
+        if cost is None or text != original:
+            cost = count_tokens(text)
+        remaining = token_budget - used
+        if cost > remaining:
+            if remaining < MIN_TRIM_TOKENS:
+                break
+            text = trim_to_budget(text, query, remaining)
+            if not text:
+                break
+            cost = count_tokens(text)
+        pieces.append(text)
+        used += cost
+    return PackedContext(text="\n\n".join(pieces), tokens=used, chunks=len(pieces))
@@ -0,0 +1,93 @@
+# corpus.py
+import glob
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+from src.rag_system import RAGSystem
+
+logging.basicConfig(level=logging.INFO)
+
+CORPUS_MANIFEST = os.getenv("CORPUS_MANIFEST", "data/corpus.json")
+# Used when there is no manifest: every PDF in this directory becomes its own collection
+CORPUS_DIR = os.getenv("CORPUS_DIR", "data")
+# Upper bound on collections held in memory (BM25 index, answer cache) at once
+CORPUS_MAX_RESIDENT = int(os.getenv("CORPUS_MAX_RESIDENT", "4"))
+
+def load_corpus(manifest_path: str = CORPUS_MANIFEST, corpus_dir: str = CORPUS_DIR) -> Dict[str, Dict]:
+    """Read collection definitions: ``{name: {"subject": ..., "files": [{"path", "chapter"}]}}``."""
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)["collections"]
+
+    collections = {}
+    for path in sorted(glob.glob(os.path.join(corpus_dir, "*.pdf"))):
+        name = os.path.splitext(os.path.basename(path))[0]
+        chapter = name.replace("_", " ").replace("-", " ").title()
+        collections[name] = {"subject": "", "files": [{"path": path, "chapter": chapter}]}
+    return collections
+
+class CorpusManager:
+    """Lazily opens one RAGSystem per collection and keeps at most ``max_resident`` of them loaded.
+
+    The default collection is never evicted once loaded, so readiness and
+    requests without a collection never wait on a reload.
+    """
+
+    def __init__(self, api_key: str, collections: Dict[str, Dict], max_resident: int = CORPUS_MAX_RESIDENT,
+                 default_collection: Optional[str] = None):
+        if not collections:
+            raise ValueError("The corpus has no collections")
+        self.api_key = api_key
+        self.collections = collections
+        self.max_resident = max(1, max_resident)
+        self.default_collection = default_collection or next(iter(collections))
+        self._resident: "OrderedDict[str, RAGSystem]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._loading: Dict[str, threading.Lock] = {name: threading.Lock() for name in collections}
+
+    def list_collections(self) -> List[Dict]:
+        return [
+            {
+                "name": name,
+                "subject": spec.get("subject", ""),
+                "chapters": [file.get("chapter") for file in spec["files"] if file.get("chapter")],
+                "resident": name in self._resident,
+            }
+            for name, spec in self.collections.items()
+        ]
+
+    def is_resident(self, name: Optional[str] = None) -> bool:
+        return (name or self.default_collection) in self._resident
+
+    def get(self, name: Optional[str] = None) -> RAGSystem:
+        name = name or self.default_collection
+        if name not in self.collections:
+            raise KeyError(f"Unknown collection {name!r}")
+
+        with self._lock:
+            rag_system = self._resident.get(name)
+            if rag_system is not None:
+                self._resident.move_to_end(name)
+                return rag_system
+
+        # Load outside the global lock so one slow collection doesn't block the others
+        with self._loading[name]:
+            with self._lock:
+                rag_system = self._resident.get(name)
+            if rag_system is None:
+                spec = self.collections[name]
+                logging.info(f"Loading collection {name}")
+                rag_system = RAGSystem(self.api_key, spec["files"], collection_name=name,
+                                       subject=spec.get("subject", ""))
+
+        with self._lock:
+            self._resident[name] = rag_system
+            self._resident.move_to_end(name)
+            while len(self._resident) > self.max_resident:
+                evicted = next(resident for resident in self._resident if resident != self.default_collection)
+                del self._resident[evicted]
+                logging.info(f"Evicted collection {evicted} from memory")
+        return rag_system
@@ -1,4 +1,6 @@
 # diagram_agent.py
+from typing import Optional
+from src.context_builder import AGENT_CONTEXT_TOKEN_BUDGET
 from src.rag_system import RAGSystem
 import logging
 
@@ -6,24 +8,28 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class DiagramAgent:
-    def __init__(self, rag_system: RAGSystem):
+    def __init__(self, rag_system: RAGSystem, chapter: Optional[str] = None):
         self.rag_system = rag_system
+        self.chapter = chapter
+        self.topic = rag_system.topic(chapter)
 
-    def generate_summary_flowchart(self) -> str:
+    async def generate_summary_flowchart(self) -> str:
         try:
-            prompt = """
-            Create a simple ASCII flowchart summarizing the key concepts of the Sound chapter.
+            prompt = f"""
+            Create a simple ASCII flowchart summarizing the key concepts of the {self.topic}.
             Use '-', '|', '+', and '>' for lines and arrows.
             Include all major topics at max 10 points, organized in a logical flow.
             """
             
             logger.info("Generating chapter summary flowchart")
-            context = self.rag_system.vectorstore.similarity_search("Sound chapter summary", k=5)
-            context_text = " ".join([doc.page_content for doc in context])
+            # A chapter-wide query: reranking would cut the 5 chunks down to RERANK_TOP_N
+            context = await self.rag_system.aretrieve(f"{self.topic} summary", k=5, chapter=self.chapter,
+                                                      rerank=False)
+            context_text = self.rag_system.build_context(context, prompt, AGENT_CONTEXT_TOKEN_BUDGET).text
             
-            ascii_flowchart = self.rag_system.get_gemini_response(context_text, prompt)
+            ascii_flowchart = await self.rag_system.aget_gemini_response(context_text, prompt)
             logger.info("Chapter summary flowchart generated successfully")
             return ascii_flowchart
         except Exception as e:
             logger.error(f"Error generating flowchart: {str(e)}")
-            return "Error: Unable to generate flowchart"
\ No newline at end of file
+            raise
\ No newline at end of file
@@ -0,0 +1,169 @@
+# embeddings.py
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from src.metrics import CACHE_EVENTS
+
+logging.basicConfig(level=logging.INFO)
+
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+# "torch" (sentence-transformers default) or "onnx" (int8-quantized ONNX Runtime on CPU)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+EMBEDDING_ONNX_FILE = os.getenv("EMBEDDING_ONNX_FILE", "onnx/model_qint8_avx2.onnx")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+# Parallel encode workers used for bulk ingest
+EMBEDDING_WORKERS = int(os.getenv("EMBEDDING_WORKERS", "1"))
+# Set to an empty string to disable the on-disk cache
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "db/embedding_cache.sqlite3")
+# Query vectors are kept in memory only, least recently used first out; 0 disables the query cache
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "10000"))
+
+class EmbeddingCache:
+    """Persistent text -> vector cache stored in a single SQLite file."""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # Several worker processes may ingest into one file: wait for their locks instead of failing
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB)")
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        found = {}
+        with self._lock:
+            # Stay well below SQLite's bound-parameter limit
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+        return found
+
+    def put_many(self, items: Dict[str, List[float]]):
+        rows = [(key, np.asarray(vector, dtype=np.float32).tobytes()) for key, vector in items.items()]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", rows)
+            self._conn.commit()
+
+class QueryEmbeddingCache:
+    """Bounded in-memory LRU of query vectors, so serving queries never writes to disk."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, List[float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    found[key] = self._entries[key]
+        return found
+
+    def put_many(self, items: Dict[str, List[float]]):
+        with self._lock:
+            for key, vector in items.items():
+                self._entries[key] = vector
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+class EmbeddingService(Embeddings):
+    """One shared sentence-transformers model used for both ingest and query encoding.
+
+    Bulk encodes are split into batches and spread over a small worker pool;
+    document vectors are cached on disk by a hash of model, backend and text,
+    query vectors in a bounded in-memory LRU.
+    """
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL, backend: str = EMBEDDING_BACKEND,
+                 batch_size: int = EMBEDDING_BATCH_SIZE, workers: int = EMBEDDING_WORKERS,
+                 cache_path: Optional[str] = EMBEDDING_CACHE_PATH,
+                 query_cache_size: int = QUERY_EMBEDDING_CACHE_SIZE):
+        self.model_name = model_name
+        self.backend = backend
+        self.batch_size = batch_size
+        self.workers = max(1, workers)
+        self.model = self._load_model()
+        self.cache = EmbeddingCache(cache_path) if cache_path else None
+        self.query_cache = QueryEmbeddingCache(query_cache_size) if query_cache_size > 0 else None
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="embed") if self.workers > 1 else None
+        logging.info(f"Loaded embedding model {model_name} ({backend} backend, batch size {batch_size})")
+
+    def _load_model(self):
+        from sentence_transformers import SentenceTransformer
+
+        if self.backend == "onnx":
+            # Requires sentence-transformers>=3.2 with the optimum[onnxruntime] extra
+            return SentenceTransformer(self.model_name, device="cpu", backend="onnx",
+                                       model_kwargs={"file_name": EMBEDDING_ONNX_FILE})
+        if self.backend == "torch":
+            return SentenceTransformer(self.model_name, device="cpu")
+        raise ValueError(f"Unknown embedding backend: {self.backend}")
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\0{self.backend}\0{text}".encode("utf-8")).hexdigest()
+
+    def _encode(self, texts: List[str]) -> List[List[float]]:
+        return self.model.encode(texts, batch_size=self.batch_size, show_progress_bar=False).tolist()
+
+    def _encode_many(self, texts: List[str]) -> List[List[float]]:
+        if self._pool is None or len(texts) <= self.batch_size:
+            return self._encode(texts)
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        vectors = []
+        for batch_vectors in self._pool.map(self._encode, batches):
+            vectors.extend(batch_vectors)
+        return vectors
+
+    def _embed_cached(self, texts: List[str], cache, kind: str) -> List[List[float]]:
+        if not texts:
+            return []
+        if cache is None:
+            return self._encode_many(texts)
+
+        keys = [self._key(text) for text in texts]
+        cached = cache.get_many(list(set(keys)))
+        missing = {key: text for key, text in zip(keys, texts) if key not in cached}
+        CACHE_EVENTS.labels(kind, "hit").inc(len(keys) - len(missing))
+        CACHE_EVENTS.labels(kind, "miss").inc(len(missing))
+        if missing:
+            vectors = self._encode_many(list(missing.values()))
+            encoded = dict(zip(missing.keys(), vectors))
+            cache.put_many(encoded)
+            cached.update(encoded)
+        return [cached[key] for key in keys]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed_cached(texts, self.cache, "embedding")
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        # Queries are mostly one-off, so they stay out of the on-disk cache and off the request path's disk
+        return self._embed_cached(texts, self.query_cache, "query_embedding")
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_queries([text])[0]
+
+_service = None
+_lock = threading.Lock()
+
+def get_embedding_service() -> EmbeddingService:
+    global _service
+    if _service is None:
+        with _lock:
+            if _service is None:
+                _service = EmbeddingService()
+    return _service
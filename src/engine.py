@@ -0,0 +1,37 @@
+# engine.py
+import logging
+import os
+import threading
+from typing import Optional
+from src.corpus import CorpusManager, load_corpus
+from src.rag_system import RAGSystem
+
+logging.basicConfig(level=logging.INFO)
+
+# One CorpusManager per process; every collection's RAGSystem is shared by the API and all agents
+_corpus = None
+_lock = threading.Lock()
+
+def get_corpus() -> CorpusManager:
+    global _corpus
+    if _corpus is None:
+        with _lock:
+            if _corpus is None:
+                api_key = os.getenv("GOOGLE_API_KEY")  # Make sure this environment variable is set
+                _corpus = CorpusManager(api_key, load_corpus(), default_collection=os.getenv("DEFAULT_COLLECTION"))
+    return _corpus
+
+def get_rag_system(collection: Optional[str] = None) -> RAGSystem:
+    return get_corpus().get(collection)
+
+def is_ready() -> bool:
+    return _corpus is not None and _corpus.is_resident()
+
+_artifact_store = None
+
+def get_artifact_store():
+    global _artifact_store
+    if _artifact_store is None:
+        from src.artifact_store import ArtifactStore
+        _artifact_store = ArtifactStore()
+    return _artifact_store
@@ -1,15 +1,18 @@
 # exam_guide_agent.py
 
-from typing import List
+from typing import List, Optional
+from src.context_builder import AGENT_CONTEXT_TOKEN_BUDGET
 from src.rag_system import RAGSystem
 
 class ExamGuideAgent:
-    def __init__(self, rag_system: RAGSystem):
+    def __init__(self, rag_system: RAGSystem, chapter: Optional[str] = None):
         self.rag_system = rag_system
+        self.chapter = chapter
+        self.topic = rag_system.topic(chapter)
 
-    def create_exam_guide(self, num_questions: int = 2) -> str:
+    async def create_exam_guide(self, num_questions: int = 2) -> str:
         prompt = f"""
-        Generate an exam guide for the Sound chapter with {num_questions} important questions and their solutions.
+        Generate an exam guide for the {self.topic} with {num_questions} important questions and their solutions.
         For each question:
         1. Provide a clear and concise question
         2. Provide a detailed solution that explains the concept and how to arrive at the answer
@@ -26,8 +29,10 @@ class ExamGuideAgent:
         ... and so on for {num_questions} questions.
         """
 
-        context = self.rag_system.vectorstore.similarity_search("Sound chapter important concepts", k=10)
-        context_text = " ".join([doc.page_content for doc in context])
+        # A chapter-wide query: reranking would cut the 10 chunks down to RERANK_TOP_N
+        context = await self.rag_system.aretrieve(f"{self.topic} important concepts", k=10, chapter=self.chapter,
+                                                  rerank=False)
+        context_text = self.rag_system.build_context(context, prompt, AGENT_CONTEXT_TOKEN_BUDGET).text
 
-        exam_guide = self.rag_system.get_gemini_response(context_text, prompt)
+        exam_guide = await self.rag_system.aget_gemini_response(context_text, prompt)
         return exam_guide
\ No newline at end of file
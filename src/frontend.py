@@ -1,14 +1,14 @@
 import streamlit as st
 import requests
 import streamlit.components.v1 as components
-import base64
+import json
 
 # Define the API endpoint
 API_ENDPOINT = "http://localhost:8000"  # Update this if your FastAPI server is running on a different address
 
 st.set_page_config(layout="wide")
 
-st.title("NCERT Sound Chapter Interactive Learning Tools")
+st.title("NCERT Interactive Learning Tools")
 
 # Custom CSS to improve layout
 st.markdown("""
@@ -22,34 +22,101 @@ st.markdown("""
     </style>
     """, unsafe_allow_html=True)
 
+@st.cache_data(ttl=300)
+def load_collections():
+    try:
+        response = requests.get(f"{API_ENDPOINT}/collections")
+        response.raise_for_status()
+        return response.json()
+    except requests.exceptions.RequestException:
+        return {"default": None, "collections": []}
+
+def stream_answer(query, params, session_id=""):
+    # Parse the server-sent events from /generate/stream into (event, data) pairs
+    body = {"text": query, "session_id": session_id}
+    with requests.post(f"{API_ENDPOINT}/generate/stream", json=body, params=params, stream=True) as response:
+        response.raise_for_status()
+        event = "message"
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("data:"):
+                yield event, json.loads(line[len("data:"):].strip())
+
 # Sidebar for navigation
 st.sidebar.title("Navigation")
 
-# Q&A section in sidebar
+# Collection and chapter selection; every request below is scoped to them
+corpus = load_collections()
+collections = {collection["name"]: collection for collection in corpus["collections"]}
+scope = {}
+topic = "chapter"
+if collections:
+    names = list(collections)
+    default_index = names.index(corpus["default"]) if corpus["default"] in names else 0
+    scope["collection"] = st.sidebar.selectbox("Book", names, index=default_index)
+    chapters = collections[scope["collection"]]["chapters"]
+    chapter = st.sidebar.selectbox("Chapter", ["All chapters"] + chapters,
+                                   index=1 if len(chapters) == 1 else 0)
+    if chapter != "All chapters":
+        scope["chapter"] = chapter
+        topic = f"{chapter} chapter"
+    else:
+        topic = collections[scope["collection"]]["subject"] or scope["collection"]
+
+# Q&A section in sidebar; questions form one conversation per book and chapter, so follow-ups work
 st.sidebar.header("Q&A")
-query = st.sidebar.text_input("Ask a question about the Sound chapter:")
+conversation_scope = (scope.get("collection"), scope.get("chapter"))
+new_conversation = st.sidebar.button("New conversation")
+if new_conversation or st.session_state.get("qa_scope") != conversation_scope:
+    if st.session_state.get("qa_session_id"):
+        try:
+            requests.delete(f"{API_ENDPOINT}/sessions/{st.session_state['qa_session_id']}")
+        except requests.exceptions.RequestException:
+            pass
+    st.session_state["qa_scope"] = conversation_scope
+    st.session_state["qa_session_id"] = ""
+    st.session_state["qa_history"] = []
+
+for past_query, past_answer in st.session_state["qa_history"]:
+    st.sidebar.markdown(f"**You:** {past_query}")
+    st.sidebar.markdown(past_answer)
+
+query = st.sidebar.text_input(f"Ask a question about the {topic}:")
 
 if st.sidebar.button("Get answer"):
     if query:
-        with st.spinner("Generating response..."):
-            response = requests.post(f"{API_ENDPOINT}/generate", json={"text": query})
-            if response.status_code == 200:
-                answer = response.json()['result']
-                st.sidebar.write(answer)
-                
-                # Add text-to-speech button for the answer
-                if st.sidebar.button("Listen to Answer"):
-                    with st.spinner("Converting text to speech..."):
-                        tts_response = requests.post(f"{API_ENDPOINT}/text_to_speech", json={"text": answer})
-                        if tts_response.status_code == 200:
-                            audio_data = tts_response.content
-                            audio_base64 = base64.b64encode(audio_data).decode('utf-8')
-                            audio_tag = f'<audio autoplay="true" src="data:audio/wav;base64,{audio_base64}">'
-                            st.sidebar.markdown(audio_tag, unsafe_allow_html=True)
-                        else:
-                            st.sidebar.error("Failed to convert text to speech.")
-            else:
-                st.sidebar.error("Failed to get response from the server.")
+        answer = ""
+        st.sidebar.markdown(f"**You:** {query}")
+        answer_placeholder = st.sidebar.empty()
+        try:
+            with st.spinner("Retrieving relevant passages..."):
+                events = stream_answer(query, scope, st.session_state["qa_session_id"])
+                event, data = next(events)
+                if event == "session":
+                    st.session_state["qa_session_id"] = data["session_id"]
+                    event, data = next(events)
+            for event, data in events:
+                if event == "token":
+                    answer += data
+                    answer_placeholder.markdown(answer + "▌")
+                elif event == "error":
+                    st.sidebar.error(f"The answer was interrupted: {data['detail']}")
+                elif event == "done":
+                    break
+            answer_placeholder.markdown(answer)
+        except (requests.exceptions.RequestException, StopIteration):
+            st.sidebar.error("Failed to get response from the server.")
+        else:
+            st.session_state["qa_history"].append((query, answer))
+            # Add text-to-speech button for the answer
+            if st.sidebar.button("Listen to Answer"):
+                with st.spinner("Converting text to speech..."):
+                    tts_response = requests.post(f"{API_ENDPOINT}/text_to_speech", json={"text": answer})
+                    if tts_response.status_code == 200:
+                        st.sidebar.audio(tts_response.content, format="audio/wav", autoplay=True)
+                    else:
+                        st.sidebar.error("Failed to convert text to speech.")
 
 # Text-to-Speech section in sidebar
 st.sidebar.header("Text-to-Speech")
@@ -59,10 +126,7 @@ if st.sidebar.button("Convert to Speech"):
         with st.spinner("Converting text to speech..."):
             tts_response = requests.post(f"{API_ENDPOINT}/text_to_speech", json={"text": tts_text})
             if tts_response.status_code == 200:
-                audio_data = tts_response.content
-                audio_base64 = base64.b64encode(audio_data).decode('utf-8')
-                audio_tag = f'<audio autoplay="true" src="data:audio/wav;base64,{audio_base64}">'
-                st.sidebar.markdown(audio_tag, unsafe_allow_html=True)
+                st.sidebar.audio(tts_response.content, format="audio/wav", autoplay=True)
             else:
                 st.sidebar.error("Failed to convert text to speech.")
 
@@ -73,7 +137,7 @@ if tool == "Chapter Summary":
     st.header("Chapter Summary")
     if st.button("Generate Summary"):
         with st.spinner("Generating chapter summary..."):
-            response = requests.get(f"{API_ENDPOINT}/chapter_summary")
+            response = requests.get(f"{API_ENDPOINT}/chapter_summary", params=scope)
             if response.status_code == 200:
                 summary = response.json()['summary']
                 st.markdown(summary)
@@ -87,62 +151,57 @@ elif tool == "Quiz":
     if 'quiz_started' not in st.session_state:
         st.session_state.quiz_started = False
         st.session_state.questions = []
-        st.session_state.current_question = 0
-        st.session_state.answers = {}
-        st.session_state.evaluations = {}
+        st.session_state.grades = None
 
     if not st.session_state.quiz_started:
         num_questions = st.slider("Number of questions", min_value=1, max_value=5, value=3)
         if st.button("Start Quiz"):
             with st.spinner("Generating quiz questions..."):
-                response = requests.post(f"{API_ENDPOINT}/quiz", json={"num_questions": num_questions})
+                response = requests.post(f"{API_ENDPOINT}/quiz", json={"num_questions": num_questions}, params=scope)
                 if response.status_code == 200:
                     st.session_state.questions = response.json()['questions']
                     st.session_state.quiz_started = True
-                    st.session_state.current_question = 0
+                    st.session_state.grades = None
                     st.rerun()
                 else:
                     st.error("Failed to generate quiz questions.")
     else:
-        # Display current question
-        question = st.session_state.questions[st.session_state.current_question]
-        st.subheader(f"Question {st.session_state.current_question + 1}")
-        st.write(question)
-
-        # Input for answer
-        user_answer = st.text_input("Your answer:", key=f"answer_{st.session_state.current_question}")
-
-        col1, col2 = st.columns(2)
-        with col1:
-            if st.button("Submit Answer"):
-                st.session_state.answers[st.session_state.current_question] = user_answer
-                eval_response = requests.post(f"{API_ENDPOINT}/evaluate_answer", 
-                                              json={"question": question, "answer": user_answer})
-                if eval_response.status_code == 200:
-                    evaluation = eval_response.json()['evaluation']
-                    st.session_state.evaluations[st.session_state.current_question] = evaluation
-                    st.rerun()
-                else:
-                    st.error("Failed to evaluate the answer.")
-
-        with col2:
-            if st.button("Next Question"):
-                if st.session_state.current_question < len(st.session_state.questions) - 1:
-                    st.session_state.current_question += 1
-                    st.rerun()
+        # All answers are collected first and graded together in one request
+        with st.form("quiz_form"):
+            for i, question in enumerate(st.session_state.questions):
+                st.subheader(f"Question {i + 1}")
+                st.write(question["question"])
+                if question.get("options"):
+                    st.radio("Your answer:", question["options"], key=f"answer_{i}", index=None)
                 else:
-                    st.warning("This is the last question.")
+                    st.text_input("Your answer:", key=f"answer_{i}")
+            submitted = st.form_submit_button("Submit Quiz")
+
+        if submitted:
+            items = [
+                {**question, "user_answer": st.session_state.get(f"answer_{i}") or ""}
+                for i, question in enumerate(st.session_state.questions)
+            ]
+            with st.spinner("Grading your answers..."):
+                eval_response = requests.post(f"{API_ENDPOINT}/evaluate_quiz", json={"items": items}, params=scope)
+            if eval_response.status_code == 200:
+                st.session_state.grades = eval_response.json()
+            else:
+                st.error("Failed to evaluate the answers.")
 
         # Display evaluation if available
-        if st.session_state.current_question in st.session_state.evaluations:
-            st.write(st.session_state.evaluations[st.session_state.current_question])
-
-        # Quiz progress
-        st.progress((st.session_state.current_question + 1) / len(st.session_state.questions))
+        grades = st.session_state.get("grades")
+        if grades:
+            st.subheader(f"Score: {grades['score']:g} / {grades['max_score']}")
+            st.progress(grades['score'] / grades['max_score'])
+            for i, result in enumerate(grades['results']):
+                mark = "✅" if result['correct'] else "❌"
+                st.write(f"{mark} **Question {i + 1}**: {result['explanation']}")
 
         # Option to end quiz
         if st.button("End Quiz"):
             st.session_state.quiz_started = False
+            st.session_state.grades = None
             st.rerun()
 
 elif tool == "Summary Flowchart":
@@ -150,7 +209,7 @@ elif tool == "Summary Flowchart":
     if st.button("Generate Summary Flowchart"):
         with st.spinner("Generating chapter summary flowchart..."):
             try:
-                response = requests.get(f"{API_ENDPOINT}/summary_flowchart")
+                response = requests.get(f"{API_ENDPOINT}/summary_flowchart", params=scope)
                 response.raise_for_status()  # Raise an exception for bad status codes
                 flowchart = response.json()['flowchart']
                 
@@ -169,7 +228,8 @@ elif tool == "Exam Guide":
     
     if st.button("Generate Exam Guide"):
         with st.spinner("Generating exam guide..."):
-            response = requests.post(f"{API_ENDPOINT}/create_exam_guide", json={"num_questions": num_questions})
+            response = requests.post(f"{API_ENDPOINT}/create_exam_guide", json={"num_questions": num_questions},
+                                     params=scope)
             if response.status_code == 200:
                 exam_guide = response.json()['exam_guide']
                 st.markdown(exam_guide)
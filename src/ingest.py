@@ -1,36 +1,119 @@
 # ingest.py
-from langchain_community.document_loaders import PyPDFLoader, PDFPlumberLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_core.documents import Document
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from src.chunking import make_chunker
+from src.pdf_pages import extract_pages, page_count
+import itertools
 import logging
+import os
+import time
+
+try:
+    import resource
+except ImportError:  # Windows: peak memory is not reported
+    resource = None
 
 logging.basicConfig(level=logging.INFO)
 
-def load_and_split_documents(pdf_path):
-    # Try PyPDFLoader first
-    loader = PyPDFLoader(pdf_path)
-    documents = loader.load()
-    
-    if not documents:
-        # If PyPDFLoader fails, try PDFPlumberLoader
-        loader = PDFPlumberLoader(pdf_path)
-        documents = loader.load()
-    
-    logging.info(f"Loaded {len(documents)} pages from the PDF")
-    
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=2000,
-        chunk_overlap=200,
-        length_function=len
-    )
-    texts = text_splitter.split_documents(documents)
-    
-    logging.info(f"Split into {len(texts)} text chunks")
-    
+# Worker processes used to parse pages; small PDFs are parsed in-process
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", str(os.cpu_count() or 1)))
+INGEST_PAGES_PER_TASK = int(os.getenv("INGEST_PAGES_PER_TASK", "8"))
+# Chunks handed to the embedder at a time
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "64"))
+# Pages scanned for running headers and footers before the first one is chunked
+INGEST_HEADER_SAMPLE_PAGES = 6
+
+class IngestStats:
+    def __init__(self, pdf_path):
+        self.pdf_path = pdf_path
+        self.pages = 0
+        self.chunks = 0
+        self.fallback_pages = 0
+        self.start = time.perf_counter()
+
+    def report(self):
+        seconds = time.perf_counter() - self.start
+        stats = {
+            "pages": self.pages,
+            "chunks": self.chunks,
+            "fallback_pages": self.fallback_pages,
+            "seconds": round(seconds, 2),
+            "pages_per_sec": round(self.pages / seconds, 1) if seconds else 0.0,
+        }
+        if resource is not None:
+            # ru_maxrss is in kilobytes on Linux; workers are counted separately as children
+            stats["peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+            stats["peak_worker_rss_mb"] = round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1)
+        logging.info(f"Ingested {self.pdf_path}: {stats}")
+        return stats
+
+def iter_pages(pdf_path, stats=None, workers=INGEST_WORKERS, pages_per_task=INGEST_PAGES_PER_TASK):
+    """Yield one Document per page, in page order, parsing page ranges across a process pool.
+
+    At most ``2 * workers`` page ranges are in flight, so a slow consumer holds
+    back parsing instead of letting parsed pages pile up in memory.
+    """
+    total = page_count(pdf_path)
+    ranges = [(start, min(start + pages_per_task, total)) for start in range(0, total, pages_per_task)]
+
+    def to_documents(pages):
+        for number, text, parser in pages:
+            if stats is not None:
+                stats.pages += 1
+                stats.fallback_pages += parser != "pypdf"
+            yield Document(page_content=text, metadata={"source": pdf_path, "page": number})
+
+    if workers <= 1 or len(ranges) <= 1:
+        for start, end in ranges:
+            yield from to_documents(extract_pages(pdf_path, start, end))
+        return
+
+    # spawn: the parent may hold model threads that are unsafe to fork
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn")) as pool:
+        pending = deque()
+        remaining = iter(ranges)
+        for start, end in remaining:
+            pending.append(pool.submit(extract_pages, pdf_path, start, end))
+            if len(pending) >= 2 * workers:
+                break
+        while pending:
+            pages = pending.popleft().result()
+            next_range = next(remaining, None)
+            if next_range is not None:
+                pending.append(pool.submit(extract_pages, pdf_path, *next_range))
+            yield from to_documents(pages)
+
+def iter_chunk_batches(pdf_path, batch_size=INGEST_BATCH_SIZE, stats=None, chunker=None):
+    # Pages are split as they arrive, so chunks never span pages (matching the previous loader)
+    chunker = chunker or make_chunker()
+    batch = []
+    pages = iter_pages(pdf_path, stats)
+    # The first pages are split together, so the running header and footer are known before any is chunked
+    first = list(itertools.islice(pages, INGEST_HEADER_SAMPLE_PAGES))
+    for group in itertools.chain([first], ([page] for page in pages)):
+        for chunk in chunker.split_documents(group):
+            batch.append(chunk)
+            if len(batch) >= batch_size:
+                if stats is not None:
+                    stats.chunks += len(batch)
+                yield batch
+                batch = []
+    if batch:
+        if stats is not None:
+            stats.chunks += len(batch)
+        yield batch
+
+def load_and_split_documents(pdf_path, chunker=None):
+    stats = IngestStats(pdf_path)
+    texts = [chunk for batch in iter_chunk_batches(pdf_path, stats=stats, chunker=chunker) for chunk in batch]
+    stats.report()
     return texts
 
 # # Add this if you want to test the function directly
 # if __name__ == "__main__":
-#     pdf_path = "data/ncert_sound_chap.pdf"  
+#     pdf_path = "data/ncert_sound_chap.pdf"
 #     texts = load_and_split_documents(pdf_path)
 #     print(f"Total chunks: {len(texts)}")
-#     print(f"First chunk preview: {texts[0].page_content[:100]}...")
\ No newline at end of file
+#     print(f"First chunk preview: {texts[0].page_content[:100]}...")
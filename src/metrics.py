@@ -0,0 +1,79 @@
+# metrics.py
+# Prometheus metrics and per-request trace ids shared by the API, RAG system, agents and TTS pipeline
+import contextvars
+import logging
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+# Prefix log lines with the request's trace id
+LOG_TRACE_IDS = os.getenv("LOG_TRACE_IDS", "1") == "1"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+STAGE_SECONDS = Histogram(
+    "rag_stage_seconds", "Time spent in each stage of request handling", ["stage"], buckets=LATENCY_BUCKETS)
+REQUEST_SECONDS = Histogram(
+    "http_request_seconds", "HTTP request latency by route", ["method", "route", "status"], buckets=LATENCY_BUCKETS)
+CACHE_EVENTS = Counter(
+    "cache_events_total", "Cache lookups by cache and result", ["cache", "result"])
+UPSTREAM_CALLS = Counter(
+    "upstream_calls_total", "Upstream calls by final outcome", ["upstream", "outcome"])
+UPSTREAM_RETRIES = Counter(
+    "upstream_retries_total", "Upstream attempts that were retried", ["upstream"])
+ADMISSION_EVENTS = Counter(
+    "llm_admission_events_total", "LLM admission decisions", ["result"])
+ADMISSION_QUEUE_DEPTH = Gauge(
+    "llm_admission_queue_depth", "LLM calls waiting for a slot")
+COALESCED_REQUESTS = Counter(
+    "coalesced_requests_total", "Requests served by joining an identical in-flight request", ["endpoint"])
+RERANK_PAIRS = Counter(
+    "rerank_pairs_total", "Reranker (query, chunk) pairs by how their score was obtained", ["result"])
+SESSION_TURNS = Counter(
+    "session_turns_total", "Conversation turns by where their context came from", ["context"])
+BATCH_SIZE = Histogram(
+    "batch_size", "Items per micro-batch", ["batcher"], buckets=(1, 2, 4, 8, 16, 32, 64))
+LLM_TOKENS = Histogram(
+    "llm_tokens", "Estimated prompt and response tokens per LLM call", ["kind"], buckets=TOKEN_BUCKETS)
+
+trace_id_var: contextvars.ContextVar[str] = contextvars.ContextVar("trace_id", default="-")
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+@contextmanager
+def span(stage: str):
+    # Works in sync and async code; the cost is one perf_counter pair and a histogram observe
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(stage).observe(time.perf_counter() - start)
+
+def record_cache(cache: str, result: str):
+    CACHE_EVENTS.labels(cache, result).inc()
+
+def record_tokens(kind: str, tokens: int):
+    LLM_TOKENS.labels(kind).observe(tokens)
+
+def render_metrics():
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+class TraceIdFilter(logging.Filter):
+    def filter(self, record):
+        record.trace_id = trace_id_var.get()
+        return True
+
+def install_trace_id_logging():
+    # Adds the trace id to every handler on the root logger, so all modules' log lines carry it
+    if not LOG_TRACE_IDS:
+        return
+    logging.basicConfig(level=logging.INFO)
+    formatter = logging.Formatter("%(levelname)s:%(name)s:[%(trace_id)s] %(message)s")
+    for handler in logging.getLogger().handlers:
+        if not any(isinstance(f, TraceIdFilter) for f in handler.filters):
+            handler.addFilter(TraceIdFilter())
+            handler.setFormatter(formatter)
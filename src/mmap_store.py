@@ -0,0 +1,412 @@
+# mmap_store.py
+import json
+import logging
+import os
+import shutil
+import threading
+import uuid
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+import numpy as np
+from langchain_core.documents import Document
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# "float16" or "int8" (per-row scaled); vectors are unit-normalized before quantizing
+MMAP_VECTOR_DTYPE = os.getenv("MMAP_VECTOR_DTYPE", "float16")
+# Collections with at least this many vectors get an IVF partitioning; smaller ones are searched exhaustively
+MMAP_IVF_MIN_VECTORS = int(os.getenv("MMAP_IVF_MIN_VECTORS", "20000"))
+# Number of IVF lists (0: about sqrt of the collection size) and lists probed per query
+MMAP_IVF_LISTS = int(os.getenv("MMAP_IVF_LISTS", "0"))
+MMAP_IVF_PROBES = int(os.getenv("MMAP_IVF_PROBES", "8"))
+# Rows a write batch buffers before it commits a version early, to bound ingest memory
+MMAP_BATCH_MAX_ROWS = int(os.getenv("MMAP_BATCH_MAX_ROWS", "100000"))
+
+# Rows scored per matrix product, so float16/int8 data is widened a block at a time
+SCORE_BLOCK_ROWS = 65536
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE = 20000
+# Below this share of new rows, a commit keeps the previous IVF centroids and only assigns the new rows
+IVF_RETRAIN_FRACTION = 0.2
+
+class Snapshot:
+    """One immutable, memory-mapped version of a collection.
+
+    Files in a version directory:
+    ``vectors.npy`` (N x D float16 or int8), ``scales.npy``
+    (int8 only), ``texts.bin`` and ``offsets.npy`` (UTF-8 texts and their
+    byte offsets), ``codes.npy`` (N x K metadata codes, -1 for missing) and
+    ``table.json`` (ids and each metadata column's distinct values), plus
+    ``centroids.npy`` and ``lists.npy`` when IVF-partitioned.
+    """
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory
+        if directory is None:
+            self.ids, self.columns, self.keys = [], {}, []
+            self.vectors = self.scales = self.offsets = self.texts = self.codes = None
+            self.centroids = self.lists = None
+        else:
+            with open(os.path.join(directory, "table.json"), "r", encoding="utf-8") as f:
+                table = json.load(f)
+            self.ids = table["ids"]
+            self.columns = table["columns"]
+            self.keys = list(self.columns)
+            self.vectors = np.load(os.path.join(directory, "vectors.npy"), mmap_mode="r")
+            self.scales = self._optional(directory, "scales.npy")
+            # Offsets and metadata codes are small and read into memory; vectors and texts stay mapped
+            self.offsets = np.load(os.path.join(directory, "offsets.npy"))
+            self.texts = np.memmap(os.path.join(directory, "texts.bin"), dtype=np.uint8, mode="r") \
+                if self.offsets[-1] else np.zeros(0, dtype=np.uint8)
+            self.codes = np.load(os.path.join(directory, "codes.npy"))
+            self.centroids = self._optional(directory, "centroids.npy")
+            self.lists = self._optional(directory, "lists.npy")
+        self.index = {doc_id: row for row, doc_id in enumerate(self.ids)}
+        self.value_codes = {key: {json.dumps(value): code for code, value in enumerate(values)}
+                            for key, values in self.columns.items()}
+
+    @staticmethod
+    def _optional(directory, name):
+        path = os.path.join(directory, name)
+        return np.load(path, mmap_mode="r") if os.path.exists(path) else None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def text(self, row: int) -> str:
+        return bytes(self.texts[self.offsets[row]:self.offsets[row + 1]]).decode("utf-8")
+
+    def metadata(self, row: int) -> Dict:
+        return {key: self.columns[key][code] for key, code in zip(self.keys, self.codes[row]) if code >= 0}
+
+    def matrix(self, rows) -> np.ndarray:
+        # Rows widened to float32; int8 rows are rescaled to (approximately) unit length
+        block = np.asarray(self.vectors[rows], dtype=np.float32)
+        if self.scales is not None:
+            block *= self.scales[rows][:, None]
+        return block
+
+    def _codes_for(self, key, values) -> List[int]:
+        codes = self.value_codes.get(key, {})
+        return [codes[json.dumps(value)] for value in values if json.dumps(value) in codes]
+
+    def mask(self, where: Optional[Dict]) -> Optional[np.ndarray]:
+        """Rows matching a Chroma-style filter, or None for no filter.
+
+        Supports ``{key: value}``, ``$eq``, ``$ne``, ``$in``, ``$nin`` and ``$and``/``$or``.
+        """
+        if not where:
+            return None
+        result = np.ones(len(self), dtype=bool)
+        for key, condition in where.items():
+            if key in ("$and", "$or"):
+                masks = [self.mask(clause) for clause in condition]
+                masks = [np.ones(len(self), dtype=bool) if m is None else m for m in masks]
+                combined = np.logical_and.reduce(masks) if key == "$and" else np.logical_or.reduce(masks)
+                result &= combined
+                continue
+            if not isinstance(condition, dict):
+                condition = {"$eq": condition}
+            column = self.codes[:, self.keys.index(key)] if key in self.keys else np.full(len(self), -1)
+            for op, operand in condition.items():
+                if op in ("$eq", "$ne"):
+                    matched = np.isin(column, self._codes_for(key, [operand]))
+                elif op in ("$in", "$nin"):
+                    matched = np.isin(column, self._codes_for(key, operand))
+                else:
+                    raise ValueError(f"Unsupported filter operator: {op}")
+                result &= ~matched if op in ("$ne", "$nin") else matched
+        return result
+
+class MmapVectorStore:
+    """Vector store kept in memory-mapped NumPy files, one directory per collection.
+
+    Implements the subset of the LangChain Chroma interface the app uses
+    (``get``, ``add_documents``, ``delete``, ``similarity_search_by_vector``)
+    plus batched search. Every commit produces a new version directory and
+    atomically repoints ``CURRENT`` at it; readers, including other worker
+    processes, pick up the new version on their next call and share the
+    files through the page cache.
+
+    Writes made inside ``with store.batch():`` are buffered and committed as
+    one version when the block exits, so an ingest rewrites the collection
+    once rather than once per batch. Rows carried over from the previous
+    version keep their stored (quantized) vectors as they are.
+    """
+
+    def __init__(self, collection_name: str, embedding_function, persist_directory: str = "db",
+                 dtype: str = MMAP_VECTOR_DTYPE):
+        if dtype not in ("float16", "int8"):
+            raise ValueError(f"Unknown vector dtype: {dtype}")
+        self.embeddings = embedding_function
+        self.collection_name = collection_name
+        self.dtype = dtype
+        self.root = os.path.join(persist_directory, "mmap", collection_name)
+        os.makedirs(self.root, exist_ok=True)
+        self._write_lock = threading.RLock()
+        self._current = None
+        self._snapshot = Snapshot()
+        self._batch_depth = 0
+        self._pending = {}
+        self._deleted = set()
+
+    # Reading
+
+    def _current_version(self) -> Optional[str]:
+        try:
+            with open(os.path.join(self.root, "CURRENT"), "r", encoding="utf-8") as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def snapshot(self) -> Snapshot:
+        for _ in range(3):
+            version = self._current_version()
+            if version == self._current:
+                break
+            try:
+                self._snapshot = Snapshot(os.path.join(self.root, version)) if version else Snapshot()
+                self._current = version
+                break
+            except FileNotFoundError:
+                # Replaced by another writer between reading CURRENT and opening it; read the newer one
+                continue
+        return self._snapshot
+
+    def count(self) -> int:
+        return len(self.snapshot())
+
+    def get(self, ids: Optional[List[str]] = None, where: Optional[Dict] = None,
+            include: List[str] = ("documents", "metadatas")) -> Dict:
+        snapshot = self.snapshot()
+        if ids is not None:
+            rows = [snapshot.index[doc_id] for doc_id in ids if doc_id in snapshot.index]
+            mask = snapshot.mask(where)
+            if mask is not None:
+                rows = [row for row in rows if mask[row]]
+        else:
+            mask = snapshot.mask(where)
+            rows = range(len(snapshot)) if mask is None else np.flatnonzero(mask).tolist()
+        return {
+            "ids": [snapshot.ids[row] for row in rows],
+            "documents": [snapshot.text(row) for row in rows] if "documents" in include else None,
+            "metadatas": [snapshot.metadata(row) for row in rows] if "metadatas" in include else None,
+        }
+
+    def _candidate_rows(self, snapshot: Snapshot, queries: np.ndarray, mask: Optional[np.ndarray]):
+        # Rows to score for the batch: all of them, or the union of each query's nearest IVF lists
+        if snapshot.centroids is None:
+            return None if mask is None else np.flatnonzero(mask)
+        probes = min(MMAP_IVF_PROBES, len(snapshot.centroids))
+        nearest = np.argsort(-(queries @ np.asarray(snapshot.centroids, dtype=np.float32).T), axis=1)[:, :probes]
+        selected = np.isin(snapshot.lists, np.unique(nearest))
+        if mask is not None:
+            selected &= mask
+        return np.flatnonzero(selected)
+
+    def search_batch(self, embeddings: List[List[float]], k: int, where: Optional[Dict] = None) -> List[List[Document]]:
+        snapshot = self.snapshot()
+        if not len(snapshot) or not embeddings:
+            return [[] for _ in embeddings]
+        queries = _normalize(np.asarray(embeddings, dtype=np.float32))
+        rows = self._candidate_rows(snapshot, queries, snapshot.mask(where))
+        total = len(snapshot) if rows is None else len(rows)
+        if not total:
+            return [[] for _ in embeddings]
+
+        scores = np.empty((len(queries), total), dtype=np.float32)
+        for start in range(0, total, SCORE_BLOCK_ROWS):
+            block_rows = slice(start, min(start + SCORE_BLOCK_ROWS, total)) if rows is None \
+                else rows[start:start + SCORE_BLOCK_ROWS]
+            scores[:, start:start + SCORE_BLOCK_ROWS] = queries @ snapshot.matrix(block_rows).T
+
+        k = min(k, total)
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        results = []
+        for query_scores, candidates in zip(scores, top):
+            ordered = candidates[np.argsort(-query_scores[candidates])]
+            found = ordered if rows is None else rows[ordered]
+            results.append([Document(page_content=snapshot.text(row), metadata=snapshot.metadata(row))
+                            for row in found])
+        return results
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, filter: Optional[Dict] = None,
+                                    **kwargs) -> List[Document]:
+        return self.search_batch([embedding], k, filter)[0]
+
+    def similarity_search(self, query: str, k: int = 4, filter: Optional[Dict] = None, **kwargs) -> List[Document]:
+        return self.similarity_search_by_vector(self.embeddings.embed_query(query), k, filter)
+
+    # Writing
+
+    @contextmanager
+    def batch(self):
+        # Other writers wait until the batch is committed; nested batches commit with the outermost one
+        with self._write_lock:
+            self._batch_depth += 1
+            try:
+                yield self
+            finally:
+                self._batch_depth -= 1
+                if not self._batch_depth:
+                    self._commit()
+
+    def add_documents(self, documents: List[Document], ids: Optional[List[str]] = None, **kwargs) -> List[str]:
+        if not documents:
+            return []
+        ids = ids or [uuid.uuid4().hex for _ in documents]
+        vectors = _normalize(np.asarray(self.embeddings.embed_documents([doc.page_content for doc in documents]),
+                                        dtype=np.float32).reshape(len(documents), -1))
+        stored, scales = self._quantize(vectors)
+        with self.batch():
+            for i, (doc_id, doc) in enumerate(zip(ids, documents)):
+                self._pending.pop(doc_id, None)
+                self._pending[doc_id] = (doc.page_content, doc.metadata or {}, stored[i],
+                                         None if scales is None else scales[i])
+            if len(self._pending) >= MMAP_BATCH_MAX_ROWS:
+                self._commit()
+        return list(ids)
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs):
+        if not ids:
+            return
+        with self.batch():
+            for doc_id in ids:
+                self._pending.pop(doc_id, None)
+                self._deleted.add(doc_id)
+
+    def persist(self):
+        # Every write is already durable once its batch exits; kept for parity with Chroma
+        pass
+
+    def _quantize(self, vectors: np.ndarray):
+        # Unit vectors to the stored dtype: (float16 rows, None) or (int8 rows, per-row scales)
+        if self.dtype == "int8":
+            scales = np.abs(vectors).max(axis=1) / 127
+            scales[scales == 0] = 1
+            return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+        return vectors.astype(np.float16), None
+
+    def _commit(self):
+        if not self._pending and not self._deleted:
+            return
+        snapshot = self.snapshot()
+        pending, deleted = self._pending, self._deleted
+        self._pending, self._deleted = {}, set()
+        keep = [row for row, doc_id in enumerate(snapshot.ids) if doc_id not in deleted and doc_id not in pending]
+        if len(keep) == len(snapshot) and not pending:
+            return
+        if not keep and not pending:
+            self._write_current("")
+            logger.info(f"Emptied {self.root}")
+            return
+
+        version = uuid.uuid4().hex[:12]
+        self._write_version(version, snapshot, keep, pending)
+        self._write_current(version)
+        logger.info(f"Wrote {len(keep) + len(pending)} vectors to {self.root} (version {version}, "
+                    f"{len(pending)} added, {len(snapshot) - len(keep)} removed or replaced)")
+
+    def _write_current(self, version: str):
+        # An empty collection is an empty CURRENT with no version directory
+        tmp_path = os.path.join(self.root, "CURRENT.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(version)
+        os.replace(tmp_path, os.path.join(self.root, "CURRENT"))
+        # Readers that still map an old version keep working; the files vanish once they let go
+        for name in os.listdir(self.root):
+            if name != version and os.path.isdir(os.path.join(self.root, name)):
+                shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+
+    def _write_version(self, version: str, snapshot: Snapshot, keep: List[int], pending: Dict):
+        directory = os.path.join(self.root, version)
+        os.makedirs(directory)
+        entries = list(pending.values())
+        ids = [snapshot.ids[row] for row in keep] + list(pending)
+
+        # Kept rows are copied in their stored form, so int8 vectors are never re-quantized
+        new_stored = np.stack([entry[2] for entry in entries]) if entries else None
+        if snapshot.vectors is not None and snapshot.vectors.dtype != np.dtype(self.dtype) and keep:
+            # The dtype setting changed since the last version: convert the kept rows once
+            kept_stored, kept_scales = self._quantize(_normalize(snapshot.matrix(keep)))
+        else:
+            kept_stored = np.asarray(snapshot.vectors[keep]) if keep else None
+            kept_scales = np.asarray(snapshot.scales[keep]) if keep and snapshot.scales is not None else None
+        stored = np.concatenate([part for part in (kept_stored, new_stored) if part is not None])
+        np.save(os.path.join(directory, "vectors.npy"), stored)
+        scales = None
+        if self.dtype == "int8":
+            new_scales = np.asarray([entry[3] for entry in entries], dtype=np.float32)
+            scales = np.concatenate([part for part in (kept_scales, new_scales) if part is not None])
+            np.save(os.path.join(directory, "scales.npy"), scales.astype(np.float32))
+
+        # Kept texts are copied as raw bytes
+        encoded = [bytes(snapshot.texts[snapshot.offsets[row]:snapshot.offsets[row + 1]]) for row in keep]
+        encoded += [entry[0].encode("utf-8") for entry in entries]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(text) for text in encoded])
+        with open(os.path.join(directory, "texts.bin"), "wb") as f:
+            f.write(b"".join(encoded))
+        np.save(os.path.join(directory, "offsets.npy"), offsets)
+
+        metadatas = [snapshot.metadata(row) for row in keep] + [entry[1] for entry in entries]
+        columns = {}
+        for metadata in metadatas:
+            for key, value in metadata.items():
+                columns.setdefault(key, {}).setdefault(json.dumps(value), value)
+        keys = sorted(columns)
+        lookup = {key: {encoded_value: code for code, encoded_value in enumerate(columns[key])} for key in keys}
+        codes = np.full((len(ids), len(keys)), -1, dtype=np.int32)
+        for row, metadata in enumerate(metadatas):
+            for column, key in enumerate(keys):
+                if key in metadata:
+                    codes[row, column] = lookup[key][json.dumps(metadata[key])]
+        np.save(os.path.join(directory, "codes.npy"), codes)
+        with open(os.path.join(directory, "table.json"), "w", encoding="utf-8") as f:
+            json.dump({"ids": ids, "columns": {key: list(columns[key].values()) for key in keys}}, f)
+
+        if len(ids) >= MMAP_IVF_MIN_VECTORS:
+            centroids, lists = self._ivf(snapshot, keep, stored, scales, len(entries))
+            np.save(os.path.join(directory, "centroids.npy"), centroids)
+            np.save(os.path.join(directory, "lists.npy"), lists)
+
+    @staticmethod
+    def _ivf(snapshot: Snapshot, keep: List[int], stored: np.ndarray, scales: Optional[np.ndarray], added: int):
+        # Trained once per commit; a small append reuses the previous centroids and only assigns the new rows
+        def widen(rows):
+            block = np.asarray(stored[rows], dtype=np.float32)
+            return block * scales[rows][:, None] if scales is not None else block
+
+        if snapshot.centroids is not None and len(keep) and added <= IVF_RETRAIN_FRACTION * len(keep):
+            centroids = np.asarray(snapshot.centroids, dtype=np.float32)
+            new_rows = np.arange(len(keep), len(stored))
+            new_lists = np.argmax(widen(new_rows) @ centroids.T, axis=1).astype(np.int32) if added \
+                else np.zeros(0, dtype=np.int32)
+            return centroids, np.concatenate([np.asarray(snapshot.lists[keep], dtype=np.int32), new_lists])
+        vectors = np.concatenate([widen(np.arange(start, min(start + SCORE_BLOCK_ROWS, len(stored))))
+                                  for start in range(0, len(stored), SCORE_BLOCK_ROWS)])
+        return _build_ivf(vectors, MMAP_IVF_LISTS or int(np.sqrt(len(vectors))))
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+def _build_ivf(vectors: np.ndarray, n_lists: int):
+    # Spherical k-means on a sample, then every vector is assigned to its nearest centroid
+    rng = np.random.default_rng(0)
+    sample = vectors[rng.choice(len(vectors), min(len(vectors), KMEANS_SAMPLE), replace=False)]
+    centroids = sample[rng.choice(len(sample), n_lists, replace=False)]
+    for _ in range(KMEANS_ITERATIONS):
+        assignment = np.argmax(sample @ centroids.T, axis=1)
+        for list_id in range(n_lists):
+            members = sample[assignment == list_id]
+            if len(members):
+                centroids[list_id] = members.mean(axis=0)
+        centroids = _normalize(centroids)
+    lists = np.concatenate([
+        np.argmax(vectors[start:start + SCORE_BLOCK_ROWS] @ centroids.T, axis=1)
+        for start in range(0, len(vectors), SCORE_BLOCK_ROWS)
+    ]).astype(np.int32)
+    return centroids.astype(np.float32), lists
@@ -0,0 +1,49 @@
+# pdf_pages.py
+# Page-level text extraction run inside ingest worker processes; kept free of heavy imports
+from typing import List, Tuple
+
+# A page whose text has fewer letters/digits than this fraction is treated as garbled
+MIN_ALNUM_RATIO = 0.5
+
+def page_count(pdf_path: str) -> int:
+    from pypdf import PdfReader
+
+    return len(PdfReader(pdf_path).pages)
+
+def is_garbled(text: str) -> bool:
+    stripped = "".join(text.split())
+    if not stripped:
+        return True
+    # Unmapped glyphs come out as "(cid:123)" or the replacement character
+    if stripped.count("(cid:") * 8 > len(stripped) or stripped.count("�") * 10 > len(stripped):
+        return True
+    alnum = sum(char.isalnum() for char in stripped)
+    return alnum / len(stripped) < MIN_ALNUM_RATIO
+
+def extract_pages(pdf_path: str, start: int, end: int) -> List[Tuple[int, str, str]]:
+    """Extract pages [start, end) with pypdf, falling back to pdfplumber page by page.
+
+    Returns (page number, text, parser name) for each page.
+    """
+    from pypdf import PdfReader
+
+    reader = PdfReader(pdf_path)
+    plumber = None
+    pages = []
+    try:
+        for number in range(start, end):
+            text = reader.pages[number].extract_text() or ""
+            parser = "pypdf"
+            if is_garbled(text):
+                if plumber is None:
+                    import pdfplumber
+
+                    plumber = pdfplumber.open(pdf_path)
+                fallback = plumber.pages[number].extract_text() or ""
+                if not is_garbled(fallback) or not text.strip():
+                    text, parser = fallback, "pdfplumber"
+            pages.append((number, text, parser))
+    finally:
+        if plumber is not None:
+            plumber.close()
+    return pages
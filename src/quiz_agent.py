@@ -1,39 +1,230 @@
 # quiz_agent.py
 
+import asyncio
 import random
-from typing import List, Dict
+import re
+from typing import List, Dict, Optional
+from src.metrics import span
 from src.rag_system import RAGSystem
 
+# Questions requested per LLM call; batches run in parallel
+QUESTIONS_PER_CALL = 5
+# Extra generation rounds to replace questions lost to deduplication
+QUIZ_TOP_UP_ROUNDS = 1
+
+QUESTION_TYPES = {
+    "mcq": "a multiple-choice question with exactly four options",
+    "true_false": "a true/false question",
+    "fill_blank": "a fill-in-the-blank question",
+    "short_answer": "a short answer question",
+}
+
+# Answers graded by the LLM per call; calls run in parallel
+GRADES_PER_CALL = 10
+# Tokens of textbook excerpt given to the grader per question
+GRADING_CONTEXT_TOKENS = 300
+
+TRUE_ANSWERS = {"true", "t", "yes", "correct"}
+FALSE_ANSWERS = {"false", "f", "no", "incorrect"}
+
+def _normalize(text: str) -> str:
+    return re.sub(r"[^a-z0-9]+", " ", text.lower()).strip()
+
+def _local_grade(correct: bool, answer: str) -> Dict:
+    explanation = "Great job!" if correct else f"The correct answer is: {answer}"
+    return {"correct": correct, "score": 1.0 if correct else 0.0, "explanation": explanation, "graded_by": "local"}
+
+def _truth_value(text: str) -> Optional[bool]:
+    normalized = _normalize(text)
+    if normalized in TRUE_ANSWERS:
+        return True
+    if normalized in FALSE_ANSWERS:
+        return False
+    return None
+
+def _grade_flag(value) -> Optional[bool]:
+    # The grader's "correct" field: a JSON boolean, or a string such as "false"; anything else is unreadable
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        return _truth_value(value)
+    return None
+
+def grade_locally(item: Dict) -> Optional[Dict]:
+    """Grade an answer without an LLM when it can be checked exactly; returns None otherwise."""
+    user_answer = _normalize(item.get("user_answer") or "")
+    answer = item.get("answer") or ""
+    if not user_answer:
+        return {"correct": False, "score": 0.0, "explanation": "No answer was given.", "graded_by": "local"}
+    if not answer:
+        return None
+
+    question_type = item.get("type")
+    if question_type == "mcq" and item.get("options"):
+        options = [_normalize(option) for option in item["options"]]
+        # Accept the option text, its letter (a-d) or its number (1-4)
+        if user_answer in options:
+            chosen = options.index(user_answer)
+        elif len(user_answer) == 1 and "a" <= user_answer < chr(ord("a") + len(options)):
+            chosen = ord(user_answer) - ord("a")
+        elif user_answer.isdigit() and 1 <= int(user_answer) <= len(options):
+            chosen = int(user_answer) - 1
+        else:
+            return None
+        return _local_grade(options[chosen] == _normalize(answer), answer)
+    if question_type == "true_false":
+        expected, given = _truth_value(answer), _truth_value(user_answer)
+        if expected is None or given is None:
+            return None
+        return _local_grade(expected == given, answer)
+    if question_type == "fill_blank" and user_answer == _normalize(answer):
+        return _local_grade(True, answer)
+    return None
+
 class QuizAgent:
-    def __init__(self, rag_system: RAGSystem):
+    def __init__(self, rag_system: RAGSystem, chapter: Optional[str] = None):
         self.rag_system = rag_system
+        self.chapter = chapter
+        self.topic = rag_system.topic(chapter)
+
+    async def generate_questions(self, num_questions: int = 3) -> List[Dict]:
+        with span("agent.quiz"):
+            return await self._generate_questions(num_questions)
+
+    async def _generate_questions(self, num_questions: int) -> List[Dict]:
+        questions = []
+        seen = set()
+        # Questions dropped as duplicates or malformed are topped up once from newly sampled chunks;
+        # a small chapter may still return fewer than asked for
+        for _ in range(1 + QUIZ_TOP_UP_ROUNDS):
+            wanted = num_questions - len(questions)
+            if wanted <= 0:
+                break
+            for question in await self._generate_round(wanted):
+                key = _normalize(question["question"])
+                if key and key not in seen:
+                    seen.add(key)
+                    questions.append(question)
+        return questions[:num_questions]
+
+    async def _generate_round(self, num_questions: int) -> List[Dict]:
+        # One distinct chunk per question, sampled straight from the collection
+        chunks = await self.rag_system.asample_documents(num_questions, self.chapter)
+        question_types = [random.choice(list(QUESTION_TYPES)) for _ in chunks]
 
-    def generate_questions(self, num_questions: int = 3) -> List[str]:
-        question_prompts = [
-            "Generate a multiple-choice question about",
-            "Create a true/false question related to",
-            "Formulate a fill-in-the-blank question concerning",
-            "Devise a short answer question about",
+        batches = [
+            (chunks[i:i + QUESTIONS_PER_CALL], question_types[i:i + QUESTIONS_PER_CALL])
+            for i in range(0, len(chunks), QUESTIONS_PER_CALL)
         ]
-        
+        results = await asyncio.gather(*(self._generate_batch(batch, types) for batch, types in batches))
+        return [question for batch in results for question in batch]
+
+    async def _generate_batch(self, chunks, question_types) -> List[Dict]:
+        excerpts = "\n\n".join(
+            # Small retrieval chunks are too thin to write a question from; use the enclosing block
+            f"EXCERPT {i + 1} (write {QUESTION_TYPES[question_type]}):\n"
+            f"{chunk.metadata.get('parent_text', chunk.page_content)}"
+            for i, (chunk, question_type) in enumerate(zip(chunks, question_types))
+        )
+        prompt = f"""
+        You are writing quiz questions for a high school student studying the {self.topic}.
+        Write exactly one question for each excerpt below, of the requested kind, answerable from that excerpt alone.
+        All questions must be different from each other.
+
+        {excerpts}
+
+        Return a JSON list with one object per excerpt, in order, each with the keys:
+        "type": one of {list(QUESTION_TYPES)},
+        "question": the question text,
+        "options": a list of options for multiple-choice questions, ["True", "False"] for true/false, otherwise [],
+        "answer": the correct answer (for multiple-choice, the exact text of the correct option)
+        """
+        generated = await self.rag_system.aget_gemini_json(prompt)
+        if not isinstance(generated, list):
+            return []
+
         questions = []
-        for _ in range(num_questions):
-            topic = self.rag_system.vectorstore.similarity_search("Generate a random topic from the sound chapter", k=2)[0].page_content
-            prompt = random.choice(question_prompts)
-            question = self.rag_system.get_gemini_response(topic, f"{prompt} {topic}")
-            questions.append(question)
-        
+        for item, question_type in zip(generated, question_types):
+            if not isinstance(item, dict) or not item.get("question"):
+                continue
+            questions.append({
+                "type": item.get("type") if item.get("type") in QUESTION_TYPES else question_type,
+                "question": str(item["question"]),
+                "options": [str(option) for option in item.get("options") or []],
+                "answer": str(item.get("answer", "")),
+            })
         return questions
 
-    def evaluate_answer(self, question: str, user_answer: str) -> Dict[str, str]:
+    async def evaluate_answer(self, question: str, user_answer: str) -> Dict:
+        # Single free-form question without a reference answer; graded like one item of a quiz attempt
+        grade = (await self.evaluate_quiz([{"question": question, "user_answer": user_answer}]))[0]
+        evaluation = f"Correct: {grade['correct']}\nExplanation: {grade['explanation']}"
+        return {"evaluation": evaluation, **grade}
+
+    async def evaluate_quiz(self, items: List[Dict]) -> List[Dict]:
+        """Grade a whole quiz attempt, one result per item in order.
+
+        Items carry the fields returned by ``generate_questions`` plus the
+        student's ``user_answer``. Exact multiple-choice, true/false and
+        fill-in-the-blank matches are graded locally; the rest are graded
+        against a retrieved excerpt in a few parallel structured LLM calls.
+        """
+        with span("agent.evaluate_quiz"):
+            grades = [grade_locally(item) for item in items]
+            pending = [index for index, grade in enumerate(grades) if grade is None]
+            batches = [pending[i:i + GRADES_PER_CALL] for i in range(0, len(pending), GRADES_PER_CALL)]
+            results = await asyncio.gather(*(self._grade_batch([items[index] for index in batch]) for batch in batches))
+            for batch, batch_grades in zip(batches, results):
+                for index, grade in zip(batch, batch_grades):
+                    grades[index] = grade
+        return [{"question": item["question"], "user_answer": item.get("user_answer", ""), **grade}
+                for item, grade in zip(items, grades)]
+
+    async def _grade_batch(self, items: List[Dict]) -> List[Dict]:
+        # Supporting excerpt per question; concurrent lookups share the batched embedder and k-NN search
+        retrieved = await asyncio.gather(*(
+            self.rag_system.aretrieve(f"{item['question']} {item.get('answer') or ''}", k=2, chapter=self.chapter)
+            for item in items
+        ))
+        blocks = []
+        for i, (item, documents) in enumerate(zip(items, retrieved)):
+            excerpt = self.rag_system.build_context(documents, item["question"], GRADING_CONTEXT_TOKENS).text
+            lines = [f"ITEM {i + 1}:", f"EXCERPT: {excerpt}", f"QUESTION: {item['question']}"]
+            if item.get("options"):
+                lines.append(f"OPTIONS: {'; '.join(item['options'])}")
+            if item.get("answer"):
+                lines.append(f"REFERENCE ANSWER: {item['answer']}")
+            lines.append(f"STUDENT ANSWER: {item.get('user_answer', '')}")
+            blocks.append("\n".join(lines))
+        items_text = "\n\n".join(blocks)
         prompt = f"""
-        Question: {question}
-        User's Answer: {user_answer}
-        
-        Evaluate if the user's answer is correct. If it's not entirely correct, provide a brief explanation of the correct answer.
-        Return your response in the following format:
-        Correct: [True/False]
-        Explanation: [Your explanation if the answer is incorrect, or 'Great job!' if correct]
+        You are grading a high school student's quiz answers on the {self.topic}.
+        Grade each item using its reference answer, if given, and the textbook excerpt.
+        Accept answers that are correct in meaning even if they are worded differently.
+
+        {items_text}
+
+        Return a JSON list with one object per item, in order, each with the keys:
+        "correct": true or false,
+        "score": a number from 0 to 1, giving partial credit to partly correct answers,
+        "explanation": one or two sentences; if the answer is wrong, say what the correct answer is
         """
-        evaluation = self.rag_system.get_gemini_response("", prompt)
-        return {"evaluation": evaluation}
\ No newline at end of file
+        graded = await self.rag_system.aget_gemini_json(prompt)
+        if not isinstance(graded, list):
+            graded = []
+
+        grades = []
+        for i in range(len(items)):
+            result = graded[i] if i < len(graded) and isinstance(graded[i], dict) else None
+            correct = _grade_flag(result.get("correct")) if result is not None else None
+            if correct is None:
+                grades.append({"correct": False, "score": 0.0, "explanation": "This answer could not be graded.",
+                               "graded_by": "ungraded"})
+                continue
+            try:
+                score = min(1.0, max(0.0, float(result.get("score", 1.0 if correct else 0.0))))
+            except (TypeError, ValueError):
+                score = 1.0 if correct else 0.0
+            grades.append({"correct": correct, "score": score, "explanation": str(result.get("explanation", "")),
+                           "graded_by": "llm"})
+        return grades
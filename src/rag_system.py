@@ -1,18 +1,77 @@
 # rag_system.py
+import asyncio
+import contextvars
+import functools
+import time
+import json
 import os
+import random
+from concurrent.futures import ThreadPoolExecutor
 import google.generativeai as genai
-from langchain_community.vectorstores import Chroma
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from src.ingest import load_and_split_documents
+from langchain_core.documents import Document
+from src.admission import get_admission_controller
+from src.answer_cache import AnswerCache, normalize_query
+from src.batcher import QUERY_BATCHING, MicroBatcher
+from src.context_builder import CONTEXT_TOKEN_BUDGET, build_context, count_tokens
+from src.embeddings import get_embedding_service
+from src.metrics import COALESCED_REQUESTS, SESSION_TURNS, STAGE_SECONDS, record_tokens, span
+from src.reranker import RERANK, RERANK_CANDIDATES, RERANK_TOP_N, get_reranker
+from src.retriever import RRF_CANDIDATE_FACTOR, HybridRetriever
+from src.sessions import FOLLOW_UP_PROMPT, rewrite_query
+from src.singleflight import SingleFlight
+from src.upstream import UpstreamError, get_upstream
+from src.vector_db import DEFAULT_COLLECTION, collection_size, index_version, sync_collection
 import logging
 
 logging.basicConfig(level=logging.INFO)
 
+# Bounded pool for blocking retrieval work so it never runs on the event loop, shared by all collections
+RETRIEVAL_WORKERS = int(os.getenv("RETRIEVAL_WORKERS", "4"))
+_executor = ThreadPoolExecutor(max_workers=RETRIEVAL_WORKERS, thread_name_prefix="retrieval")
+
+# Concurrent query embeddings from every collection are encoded together, since they share one model
+_embed_batcher = MicroBatcher(lambda texts: get_embedding_service().embed_queries(texts), "embed",
+                              executor=_executor)
+
+# "gemini", or "stub" for the deterministic offline model in src/stub_llm.py
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini")
+
+# A quiz reads this many random chunks per question asked, and spreads its picks across their pages
+QUIZ_SAMPLE_POOL = int(os.getenv("QUIZ_SAMPLE_POOL", "4"))
+
 class RAGSystem:
-    def __init__(self, api_key, pdf_path):
-        self.configure_genai(api_key)
-        self.model = genai.GenerativeModel('gemini-1.5-flash')
-        self.vectorstore = self.initialize_vectorstore(pdf_path)
+    """Retrieval and generation over one named collection.
+
+    ``files`` is a PDF path or a list of ``{"path": ..., "chapter": ...}``
+    entries; each file's chapter is stored as chunk metadata so queries can
+    be restricted to a single chapter.
+    """
+
+    def __init__(self, api_key, files, collection_name=DEFAULT_COLLECTION, subject=""):
+        self.model = self.create_model(api_key)
+        self.files = [{"path": files}] if isinstance(files, str) else list(files)
+        self.collection_name = collection_name
+        self.subject = subject
+        self.chapters = [file["chapter"] for file in self.files if file.get("chapter")]
+        self.vectorstore = self.initialize_vectorstore(self.files, collection_name, subject)
+        self.retriever = HybridRetriever(self.vectorstore)
+        self.executor = _executor
+        self.search_batcher = MicroBatcher(lambda requests: self.retriever.dense_search_batch(requests),
+                                           "dense_search", executor=_executor)
+        self.index_version = index_version('db', collection_name)
+        self.answer_cache = AnswerCache(version=self.index_version)
+        self._flights = SingleFlight()
+        if RERANK:
+            get_reranker()  # load the cross-encoder before the first request needs it
+
+    @classmethod
+    def create_model(cls, api_key):
+        if LLM_BACKEND == "stub":
+            from src.stub_llm import StubGenerativeModel
+
+            return StubGenerativeModel()
+        cls.configure_genai(api_key)
+        return genai.GenerativeModel('gemini-1.5-flash')
 
     @staticmethod
     def configure_genai(api_key):
@@ -20,51 +79,327 @@ class RAGSystem:
         genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
 
     @staticmethod
-    def initialize_vectorstore(pdf_path):
-        texts = load_and_split_documents(pdf_path)
-        embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-        vectorstore = Chroma.from_documents(texts, embeddings, persist_directory='db')
-        logging.info(f"Vector store initialized with {len(texts)} documents.")
+    def initialize_vectorstore(files, collection_name=DEFAULT_COLLECTION, subject=""):
+        metadata = {"collection": collection_name, "subject": subject}
+        vectorstore = sync_collection(files, get_embedding_service(), persist_directory='db',
+                                      collection_name=collection_name, metadata=metadata)
+        logging.info(f"Vector store {collection_name} initialized with {collection_size(vectorstore)} documents.")
         return vectorstore
 
-    def get_gemini_response(self, context, query):
-        try:
-            response = self.model.generate_content(f""" 
-            Using the context given below answer the query.                             
+    def reindex(self):
+        # Re-sync the index with the PDFs and drop cached answers if anything changed
+        self.vectorstore = self.initialize_vectorstore(self.files, self.collection_name, self.subject)
+        self.retriever = HybridRetriever(self.vectorstore)
+        self.index_version = index_version('db', self.collection_name)
+        if self.index_version != self.answer_cache.version:
+            self.answer_cache.invalidate(self.index_version)
+        return self.index_version
+
+    def check_chapter(self, chapter):
+        if chapter is not None and chapter not in self.chapters:
+            raise KeyError(f"Unknown chapter {chapter!r} in collection {self.collection_name!r}")
+
+    def topic(self, chapter=None):
+        # How prompts refer to the material, e.g. "Sound chapter"
+        if chapter:
+            return f"{chapter} chapter"
+        if len(self.chapters) == 1:
+            return f"{self.chapters[0]} chapter"
+        return f"{self.subject or self.collection_name} textbook"
+
+    @staticmethod
+    def chapter_filter(chapter):
+        return {"chapter": chapter} if chapter else None
+
+    @staticmethod
+    def build_prompt(context, query):
+        return f"""
+            Using the context given below answer the query.
             CONTEXT: {context}
-            QUERY: {query}   
-            Give answers to point and easy to understand with good formatting.                            
-            """)
+            QUERY: {query}
+            Give answers to point and easy to understand with good formatting.
+            """
+
+    # The async methods go through the shared "gemini" upstream (timeouts, retries, circuit breaker)
+    # and raise UpstreamError instead of returning a canned apology.
+    async def _acall_llm(self, generate, prompt_tokens):
+        record_tokens("prompt", prompt_tokens)
+        async with get_admission_controller().slot():
+            with span("llm"):
+                text = await get_upstream("gemini").call(generate)
+        record_tokens("response", count_tokens(text))
+        return text
+
+    async def aget_gemini_text(self, prompt, **kwargs):
+        async def generate():
+            response = await self.model.generate_content_async(prompt, **kwargs)
+            return response.text
+
+        return await self._acall_llm(generate, count_tokens(prompt))
+
+    async def achat_text(self, chat, message, history_tokens=0):
+        # One turn of a multi-turn chat; the earlier turns are resent by the SDK and counted as prompt
+        async def generate():
+            response = await chat.send_message_async(message)
             return response.text
-        except Exception as e:
-            logging.error(f"Error generating Gemini response: {str(e)}")
-            return "I'm sorry, but I encountered an error while processing your request."
 
-    def generate_response(self, query):
+        return await self._acall_llm(generate, history_tokens + count_tokens(message))
+
+    async def aget_gemini_response(self, context, query):
+        return await self.aget_gemini_text(self.build_prompt(context, query))
+
+    async def aget_gemini_json(self, prompt):
+        # Structured output: returns the parsed JSON value, or None if the model's output is not valid JSON
+        text = await self.aget_gemini_text(prompt, generation_config={"response_mime_type": "application/json"})
         try:
-            retrieved_documents = self.vectorstore.similarity_search(query, k=5)
-            context = " ".join([doc.page_content for doc in retrieved_documents])
-            
-            result = self.get_gemini_response(context, query)
-            
-            return {"result": result, "source": context}
-        except Exception as e:
-            logging.error(f"Error generating response: {str(e)}")
-            return {"result": "I'm sorry, but I encountered an error while processing your request.", "source": ""}
-
-# Initialize the RAG system
-api_key = os.getenv("GOOGLE_API_KEY")  # Make sure this environment variable is set
-pdf_path = "data/ncert_sound_chap.pdf"  # Ensure this path is correct
-
-rag_system = None
-try:
-    rag_system = RAGSystem(api_key, pdf_path)
-except Exception as e:
-    logging.error(f"Failed to initialize RAG system: {str(e)}")
-
-# Function to be called by the API
-def generate_response(query):
-    if rag_system:
-        return rag_system.generate_response(query)
-    else:
-        return {"result": "RAG system is not initialized properly.", "source": ""}
\ No newline at end of file
+            return json.loads(text)
+        except ValueError as e:
+            logging.error(f"Gemini returned invalid JSON: {str(e)}")
+            return None
+
+    async def astream_gemini_response(self, context, query):
+        prompt = self.build_prompt(context, query)
+        async for text in self._astream_llm(lambda: self.model.generate_content_async(prompt, stream=True),
+                                            count_tokens(prompt)):
+            yield text
+
+    async def astream_chat(self, chat, message, history_tokens=0):
+        async for text in self._astream_llm(lambda: chat.send_message_async(message, stream=True),
+                                            history_tokens + count_tokens(message)):
+            yield text
+
+    async def _astream_llm(self, start_stream, prompt_tokens):
+        record_tokens("prompt", prompt_tokens)
+        # The admission slot is held until the whole stream has been read
+        async with get_admission_controller().slot():
+            start = time.perf_counter()
+            response = await get_upstream("gemini").call(start_stream)
+            response_tokens = 0
+            first = True
+            try:
+                async for chunk in response:
+                    if chunk.text:
+                        if first:
+                            STAGE_SECONDS.labels("llm_first_token").observe(time.perf_counter() - start)
+                            first = False
+                        response_tokens += count_tokens(chunk.text)
+                        yield chunk.text
+            except Exception as e:
+                raise UpstreamError("gemini", f"stream interrupted: {str(e)}") from e
+        STAGE_SECONDS.labels("llm_stream").observe(time.perf_counter() - start)
+        record_tokens("response", response_tokens)
+
+    def retrieve(self, query, k=5, embedding=None, mode=None, chapter=None, rerank=True):
+        # mode: "hybrid", "dense" or "lexical"; defaults to RETRIEVAL_MODE
+        where = self.chapter_filter(chapter)
+        if not (RERANK and rerank):
+            return self.retriever.search(query, k=k, mode=mode, embedding=embedding, where=where)
+        candidates = self.retriever.search(query, k=max(k, RERANK_CANDIDATES), mode=mode, embedding=embedding,
+                                           where=where)
+        return get_reranker().rerank(query, candidates, min(k, RERANK_TOP_N))
+
+    async def run_blocking(self, fn, *args, **kwargs):
+        # Runs fn on the retrieval pool, carrying over context variables such as the request's trace id
+        loop = asyncio.get_running_loop()
+        call = functools.partial(contextvars.copy_context().run, fn, *args, **kwargs)
+        return await loop.run_in_executor(self.executor, call)
+
+    async def aembed_query(self, query):
+        with span("embed"):
+            if QUERY_BATCHING:
+                return await _embed_batcher.submit(query)
+            return await self.run_blocking(self.vectorstore.embeddings.embed_query, query)
+
+    async def aretrieve(self, query, k=5, embedding=None, mode=None, chapter=None, rerank=True):
+        if not (RERANK and rerank):
+            return await self._aretrieve(query, k, embedding, mode, chapter)
+        # Over-fetch cheaply, then keep only the few chunks the cross-encoder ranks best
+        candidates = await self._aretrieve(query, max(k, RERANK_CANDIDATES), embedding, mode, chapter)
+        return await self.run_blocking(get_reranker().rerank, query, candidates, min(k, RERANK_TOP_N))
+
+    async def _aretrieve(self, query, k, embedding, mode, chapter):
+        mode = mode or self.retriever.mode
+        if not QUERY_BATCHING or mode not in ("dense", "hybrid"):
+            with span("retrieve"):
+                return await self.run_blocking(self.retrieve, query, k=k, embedding=embedding, mode=mode,
+                                               chapter=chapter, rerank=False)
+
+        # Dense lookups from concurrent requests share one batched k-NN query
+        if embedding is None:
+            embedding = await self.aembed_query(query)
+        with span("retrieve"):
+            where = self.chapter_filter(chapter)
+            if mode == "dense":
+                return await self.search_batcher.submit((embedding, k, where))
+            candidates = k * RRF_CANDIDATE_FACTOR
+            dense, lexical = await asyncio.gather(
+                self.search_batcher.submit((embedding, candidates, where)),
+                self.run_blocking(self.retriever.lexical_search, query, candidates, where))
+            return self.retriever.fuse([dense, lexical], k)
+
+    def sample_documents(self, n, chapter=None):
+        # Draw up to n distinct chunks from a random pool of ids, spreading picks across pages
+        # before reusing a page; only the pool's rows (with their parent text) are read
+        ids = self.vectorstore.get(where=self.chapter_filter(chapter), include=[])["ids"]
+        if not ids or n <= 0:
+            return []
+        pool = random.sample(ids, min(len(ids), n * QUIZ_SAMPLE_POOL))
+        stored = self.vectorstore.get(ids=pool, include=["documents", "metadatas"])
+        by_page = {}
+        for text, metadata in zip(stored["documents"], stored["metadatas"]):
+            metadata = metadata or {}
+            by_page.setdefault((metadata.get("source"), metadata.get("page")), []).append(
+                Document(page_content=text, metadata=metadata))
+        pages = list(by_page.values())
+        random.shuffle(pages)
+
+        chosen = []
+        while len(chosen) < n and any(pages):
+            for documents in pages:
+                if documents and len(chosen) < n:
+                    chosen.append(documents.pop())
+        return chosen
+
+    async def asample_documents(self, n, chapter=None):
+        with span("sample"):
+            return await self.run_blocking(self.sample_documents, n, chapter)
+
+    async def alookup(self, query, chapter=None, embedding=None):
+        # Returns (cached response or None, embedding, documents, chunk ids) for the retrieval stage
+        if embedding is None:
+            embedding = await self.aembed_query(query)
+        cached = self.answer_cache.get_semantic(embedding, scope=chapter)
+        if cached is not None:
+            return cached, embedding, [], []
+
+        retrieved_documents = await self.aretrieve(query, k=5, embedding=embedding, chapter=chapter)
+        chunk_ids = [doc.metadata.get("chunk_id", "") for doc in retrieved_documents]
+        cached = self.answer_cache.get_exact(query, chunk_ids)
+        return cached, embedding, retrieved_documents, chunk_ids
+
+    def build_context(self, documents, query, token_budget=CONTEXT_TOKEN_BUDGET):
+        with span("context"):
+            packed = build_context(documents, query, token_budget)
+        logging.info(f"Packed {packed.chunks}/{len(documents)} chunks into {packed.tokens} context tokens "
+                     f"(budget {token_budget})")
+        return packed
+
+    async def agenerate_response(self, query, chapter=None):
+        # Identical questions asked while one is being answered share that answer
+        key = (normalize_query(query), chapter)
+        if key in self._flights:
+            COALESCED_REQUESTS.labels("generate").inc()
+        return await self._flights.do(key, lambda: self._agenerate_response(query, chapter))
+
+    async def _agenerate_response(self, query, chapter=None):
+        cached, embedding, retrieved_documents, chunk_ids = await self.alookup(query, chapter)
+        if cached is not None:
+            return cached
+        packed = self.build_context(retrieved_documents, query)
+
+        result = await self.aget_gemini_response(packed.text, query)
+
+        response = {"result": result, "source": packed.text, "context_tokens": packed.tokens}
+        self.answer_cache.put(query, chunk_ids, embedding, response, scope=chapter)
+        return response
+
+    async def astream_response(self, query, chapter=None):
+        # Yields ("sources", context) as soon as retrieval finishes, then ("token", text) per chunk
+        cached, embedding, retrieved_documents, chunk_ids = await self.alookup(query, chapter)
+        if cached is not None:
+            yield "sources", cached["source"]
+            yield "token", cached["result"]
+            return
+        packed = self.build_context(retrieved_documents, query)
+        yield "sources", packed.text
+
+        tokens = []
+        async for token in self.astream_gemini_response(packed.text, query):
+            tokens.append(token)
+            yield "token", token
+        response = {"result": "".join(tokens), "source": packed.text, "context_tokens": packed.tokens}
+        self.answer_cache.put(query, chunk_ids, embedding, response, scope=chapter)
+
+    async def _aprepare_session_turn(self, session, query, chapter=None):
+        # Returns (message to send on the session's chat, cached response, (query, chunk ids, embedding) to cache under)
+        search_query = rewrite_query(query, session.topic_query)
+        embedding = None
+        reuse = False
+        if session.context:
+            # Only the embedding decides reuse: the rewrite makes "why?" comparable with the topic,
+            # while a standalone question is compared as it stands
+            embedding = await self.aembed_query(search_query)
+            reuse = session.is_on_topic(embedding)
+        if reuse:
+            if session.chat is not None:
+                SESSION_TURNS.labels("reused").inc()
+                session.trim_chat()
+                return FOLLOW_UP_PROMPT.format(query=query), None, None
+            # Same context, but the last turn failed and dropped the chat: start over with the context
+            SESSION_TURNS.labels("restarted").inc()
+            session.start_chat(self.model)
+            return self.build_prompt(session.context, search_query), None, None
+
+        # A new topic: retrieve as for a stateless question
+        SESSION_TURNS.labels("retrieved").inc()
+        cached, embedding, retrieved_documents, chunk_ids = await self.alookup(search_query, chapter, embedding)
+        if cached is not None:
+            session.set_topic(search_query, embedding, cached["source"], cached.get("context_tokens", 0))
+            # Seed the chat as if the cached answer had been given in it
+            session.start_chat(self.model, [self.build_prompt(cached["source"], search_query), cached["result"]])
+            return None, cached, None
+        packed = self.build_context(retrieved_documents, search_query)
+        session.set_topic(search_query, embedding, packed.text, packed.tokens)
+        session.start_chat(self.model)
+        return self.build_prompt(packed.text, search_query), None, (search_query, chunk_ids, embedding)
+
+    async def agenerate_session_response(self, session, query, chapter=None):
+        """Answer ``query`` as the next turn of ``session``.
+
+        Follow-ups on the same topic skip retrieval and are sent on the
+        session's Gemini chat, which already holds the context.
+        """
+        async with session.lock:
+            message, cached, cache_entry = await self._aprepare_session_turn(session, query, chapter)
+            if cached is not None:
+                session.turns += 1
+                return {**cached, "session_id": session.id}
+            try:
+                result = await self.achat_text(session.chat, message, session.chat_tokens)
+            except BaseException:
+                # The chat's history may be half-updated; the next turn starts a fresh one
+                session.reset_chat()
+                raise
+            session.record_turn(message, result)
+            response = {"result": result, "source": session.context, "context_tokens": session.context_tokens}
+            if cache_entry is not None:
+                # The first message of a chat is the same prompt a stateless request sends
+                cache_query, chunk_ids, embedding = cache_entry
+                self.answer_cache.put(cache_query, chunk_ids, embedding, response, scope=chapter)
+            return {**response, "session_id": session.id}
+
+    async def astream_session_response(self, session, query, chapter=None):
+        # Streaming counterpart of agenerate_session_response, with the same events as astream_response
+        async with session.lock:
+            message, cached, cache_entry = await self._aprepare_session_turn(session, query, chapter)
+            if cached is not None:
+                session.turns += 1
+                yield "sources", cached["source"]
+                yield "token", cached["result"]
+                return
+            yield "sources", session.context
+
+            tokens = []
+            try:
+                async for token in self.astream_chat(session.chat, message, session.chat_tokens):
+                    tokens.append(token)
+                    yield "token", token
+            except BaseException:
+                session.reset_chat()
+                raise
+            result = "".join(tokens)
+            session.record_turn(message, result)
+            if cache_entry is not None:
+                response = {"result": result, "source": session.context, "context_tokens": session.context_tokens}
+                cache_query, chunk_ids, embedding = cache_entry
+                self.answer_cache.put(cache_query, chunk_ids, embedding, response, scope=chapter)
@@ -0,0 +1,100 @@
+# reranker.py
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Tuple
+from langchain_core.documents import Document
+from src.answer_cache import normalize_query
+from src.metrics import RERANK_PAIRS, span
+from src.retriever import doc_key
+
+logging.basicConfig(level=logging.INFO)
+
+# Set to 1 to rerank retrieved chunks with a cross-encoder before they reach the prompt
+RERANK = os.getenv("RERANK", "0") == "1"
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+# Candidates fetched per query, and how many of them are kept
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "20"))
+RERANK_TOP_N = int(os.getenv("RERANK_TOP_N", "3"))
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "8"))
+# CPU time one rerank may spend; candidates not scored in time keep their retrieval order
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "150"))
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "20000"))
+
+class Reranker:
+    """Cross-encoder scoring of (query, chunk) pairs on CPU.
+
+    Candidates are scored in retrieval order, one batch at a time, until the
+    time budget runs out. Scored candidates are ranked by score, followed by
+    any unscored ones in their original order. Scores are kept in an LRU keyed
+    on the normalized query and chunk id, so repeated questions cost nothing.
+    """
+
+    def __init__(self, model_name: str = RERANK_MODEL, batch_size: int = RERANK_BATCH_SIZE,
+                 budget_ms: float = RERANK_BUDGET_MS, cache_size: int = RERANK_CACHE_SIZE):
+        from sentence_transformers import CrossEncoder
+
+        self.model = CrossEncoder(model_name, device="cpu", max_length=512)
+        self.batch_size = batch_size
+        self.budget = budget_ms / 1000
+        self.cache_size = cache_size
+        self._scores: OrderedDict[Tuple[str, str], float] = OrderedDict()
+        self._lock = threading.Lock()
+        logging.info(f"Loaded reranker {model_name}")
+
+    def _cached(self, keys):
+        with self._lock:
+            found = {}
+            for key in keys:
+                if key in self._scores:
+                    self._scores.move_to_end(key)
+                    found[key] = self._scores[key]
+            return found
+
+    def _store(self, scored):
+        with self._lock:
+            self._scores.update(scored)
+            for key in scored:
+                self._scores.move_to_end(key)
+            while len(self._scores) > self.cache_size:
+                self._scores.popitem(last=False)
+
+    def rerank(self, query: str, documents: List[Document], top_n: int = RERANK_TOP_N) -> List[Document]:
+        if len(documents) <= 1:
+            return documents[:top_n]
+        with span("rerank"):
+            normalized = normalize_query(query)
+            keys = [(normalized, doc_key(doc)) for doc in documents]
+            scores = self._cached(keys)
+            RERANK_PAIRS.labels("cached").inc(len(scores))
+
+            pending = [i for i, key in enumerate(keys) if key not in scores]
+            deadline = time.perf_counter() + self.budget
+            scored = {}
+            while pending and time.perf_counter() < deadline:
+                batch, pending = pending[:self.batch_size], pending[self.batch_size:]
+                values = self.model.predict([(query, documents[i].page_content) for i in batch],
+                                            batch_size=self.batch_size, show_progress_bar=False)
+                scored.update({keys[i]: float(value) for i, value in zip(batch, values)})
+            self._store(scored)
+            scores.update(scored)
+            RERANK_PAIRS.labels("scored").inc(len(scored))
+            RERANK_PAIRS.labels("skipped").inc(len(pending))
+
+            ranked = sorted((i for i, key in enumerate(keys) if key in scores), key=lambda i: scores[keys[i]],
+                            reverse=True)
+            ranked += [i for i, key in enumerate(keys) if key not in scores]
+            return [documents[i] for i in ranked[:top_n]]
+
+_reranker = None
+_lock = threading.Lock()
+
+def get_reranker() -> Reranker:
+    global _reranker
+    if _reranker is None:
+        with _lock:
+            if _reranker is None:
+                _reranker = Reranker()
+    return _reranker
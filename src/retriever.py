@@ -0,0 +1,144 @@
+# retriever.py
+import json
+import logging
+import math
+import os
+import re
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+from langchain_core.documents import Document
+from src.vector_db import query_by_vectors
+
+logging.basicConfig(level=logging.INFO)
+
+# "hybrid" (BM25 + dense fused with RRF), "dense" or "lexical"
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+# Standard reciprocal-rank-fusion constant
+RRF_K = int(os.getenv("RRF_K", "60"))
+# Each ranker contributes this many candidates per requested result before fusion
+RRF_CANDIDATE_FACTOR = int(os.getenv("RRF_CANDIDATE_FACTOR", "4"))
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_RE.findall(text.lower())
+
+def doc_key(doc: Document) -> str:
+    return doc.metadata.get("chunk_id") or doc.page_content
+
+class BM25Index:
+    """Okapi BM25 over an in-memory inverted index."""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.documents: List[Document] = []
+        self.postings = defaultdict(list)
+        self.doc_lengths: List[int] = []
+        self.avg_length = 0.0
+        self.idf = {}
+
+    def build(self, documents: List[Document]):
+        self.documents = documents
+        self.postings = defaultdict(list)
+        self.doc_lengths = []
+        for index, doc in enumerate(documents):
+            terms = Counter(tokenize(doc.page_content))
+            self.doc_lengths.append(sum(terms.values()))
+            for term, tf in terms.items():
+                self.postings[term].append((index, tf))
+        total = len(documents)
+        self.avg_length = sum(self.doc_lengths) / total if total else 0.0
+        self.idf = {
+            term: math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self.postings.items()
+        }
+
+    def search(self, query: str, k: int, where: Optional[Dict] = None) -> List[Tuple[Document, float]]:
+        # where: exact-match metadata filter, e.g. {"chapter": "Sound"}
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for index, tf in self.postings[term]:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[index] / self.avg_length)
+                scores[index] += idf * tf * (self.k1 + 1) / (tf + norm)
+        if where:
+            scores = {
+                index: score for index, score in scores.items()
+                if all(self.documents[index].metadata.get(key) == value for key, value in where.items())
+            }
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(self.documents[index], score) for index, score in ranked]
+
+class HybridRetriever:
+    """Dense, lexical or RRF-fused hybrid search over one vector store.
+
+    The BM25 index is built from the texts already stored in the collection,
+    so it needs no embedding work and is rebuilt whenever the index is synced.
+    """
+
+    def __init__(self, vectorstore, mode: str = RETRIEVAL_MODE):
+        self.vectorstore = vectorstore
+        self.mode = mode
+        self.bm25 = BM25Index()
+        self.rebuild()
+
+    def rebuild(self):
+        stored = self.vectorstore.get(include=["documents", "metadatas"])
+        documents = [
+            Document(page_content=text, metadata=metadata or {})
+            for text, metadata in zip(stored["documents"], stored["metadatas"])
+        ]
+        self.bm25.build(documents)
+        logging.info(f"BM25 index built over {len(documents)} chunks")
+
+    def dense_search(self, query: str, k: int, embedding=None, where: Optional[Dict] = None) -> List[Document]:
+        if embedding is None:
+            embedding = self.vectorstore.embeddings.embed_query(query)
+        return self.vectorstore.similarity_search_by_vector(embedding, k=k, filter=where or None)
+
+    def dense_search_batch(self, requests: List[Tuple[List[float], int, Optional[Dict]]]) -> List[List[Document]]:
+        # requests: (embedding, k, where) per caller; one k-NN query per distinct filter
+        groups = defaultdict(list)
+        for index, (_, _, where) in enumerate(requests):
+            groups[json.dumps(where or None, sort_keys=True)].append(index)
+        results = [None] * len(requests)
+        for key, indexes in groups.items():
+            n_results = max(requests[index][1] for index in indexes)
+            found = query_by_vectors(self.vectorstore, [requests[index][0] for index in indexes], n_results,
+                                     json.loads(key))
+            for documents, index in zip(found, indexes):
+                results[index] = documents[:requests[index][1]]
+        return results
+
+    def lexical_search(self, query: str, k: int, where: Optional[Dict] = None) -> List[Document]:
+        return [doc for doc, _ in self.bm25.search(query, k, where)]
+
+    def search(self, query: str, k: int = 5, mode: Optional[str] = None, embedding=None,
+               where: Optional[Dict] = None) -> List[Document]:
+        mode = mode or self.mode
+        if mode == "dense":
+            return self.dense_search(query, k, embedding, where)
+        if mode == "lexical":
+            return self.lexical_search(query, k, where)
+        if mode != "hybrid":
+            raise ValueError(f"Unknown retrieval mode: {mode}")
+
+        candidates = k * RRF_CANDIDATE_FACTOR
+        rankings = [self.dense_search(query, candidates, embedding, where), self.lexical_search(query, candidates, where)]
+        return self.fuse(rankings, k)
+
+    @staticmethod
+    def fuse(rankings: List[List[Document]], k: int) -> List[Document]:
+        # Reciprocal-rank fusion of several ranked lists
+        scores = defaultdict(float)
+        documents = {}
+        for ranking in rankings:
+            for rank, doc in enumerate(ranking):
+                key = doc_key(doc)
+                scores[key] += 1.0 / (RRF_K + rank + 1)
+                documents.setdefault(key, doc)
+        fused = sorted(scores, key=scores.get, reverse=True)[:k]
+        return [documents[key] for key in fused]
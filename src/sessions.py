@@ -0,0 +1,175 @@
+# sessions.py
+import asyncio
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional
+import numpy as np
+from src.chunking import count_tokens
+from src.retriever import tokenize
+
+# Sessions kept in memory, and how long an idle one lives
+SESSION_MAX = int(os.getenv("SESSION_MAX", "1000"))
+SESSION_TTL = float(os.getenv("SESSION_TTL", "1800"))
+# Cosine similarity above which a new question is answered from the session's current context
+SESSION_REUSE_SIMILARITY = float(os.getenv("SESSION_REUSE_SIMILARITY", "0.8"))
+# Earlier follow-up turns kept on the chat after its context turn; older ones are trimmed before each send,
+# since the SDK resends the whole history every turn
+SESSION_HISTORY_TURNS = int(os.getenv("SESSION_HISTORY_TURNS", "2"))
+
+# Short questions that lean on the previous turn: "why?", "give an example", "what about its speed?"
+FOLLOW_UP_RE = re.compile(
+    r"\b(it|its|this|these|those|they|them|their|why|how so|how come|example|examples|more|again|"
+    r"elaborate|simpler|else)\b", re.IGNORECASE)
+FOLLOW_UP_MAX_WORDS = 8
+# Words a follow-up may use without naming a new subject; any other word not in the topic question
+# means the question brings its own subject and is searched as it stands
+FOLLOW_UP_FILLER = frozenset("""
+    a an the is are was were be been do does did can could would should will what which who how why when where
+    it its this that these those they them their there here of in on at to for from with by about as and or
+    so come more again else also please give show tell explain elaborate describe simpler simply another
+    example examples one some detail details mean means meant
+""".split())
+
+FOLLOW_UP_PROMPT = """
+            Using the same context as before, answer the follow-up question.
+            QUERY: {query}
+            Give answers to point and easy to understand with good formatting.
+            """
+
+def is_follow_up(query: str, topic_query: str) -> bool:
+    if len(query.split()) > FOLLOW_UP_MAX_WORDS or not FOLLOW_UP_RE.search(query):
+        return False
+    topic_terms = set(tokenize(topic_query))
+    return all(term in FOLLOW_UP_FILLER or term in topic_terms for term in tokenize(query))
+
+def rewrite_query(query: str, topic_query: Optional[str]) -> str:
+    # A follow-up is searched together with the question that set the session's topic. This only
+    # shapes the search query; whether the session's context is reused is decided by embedding.
+    if topic_query and is_follow_up(query, topic_query):
+        return f"{topic_query} {query}"
+    return query
+
+class Session:
+    """One conversation: the context it is grounded in and the chat carrying its turns.
+
+    ``topic_query`` is the standalone question the current context was
+    retrieved for. ``chat`` opens with one turn holding the context prompt,
+    followed by at most ``SESSION_HISTORY_TURNS`` recent follow-ups, so a
+    follow-up resends the context once plus a bounded tail of the conversation.
+    """
+
+    def __init__(self, session_id: str, scope: Hashable):
+        self.id = session_id
+        self.scope = scope
+        self.turns = 0
+        self.topic_query: Optional[str] = None
+        self.topic_embedding: Optional[np.ndarray] = None
+        self.context = ""
+        self.context_tokens = 0
+        self.chat = None
+        # Tokens of each turn (message and answer) on the chat, the context turn first
+        self.chat_turn_tokens: List[int] = []
+        self.last_used = time.monotonic()
+        # Turns of one session run one at a time; the chat history is not safe to share
+        self.lock = asyncio.Lock()
+
+    def is_on_topic(self, embedding) -> bool:
+        if self.topic_embedding is None or embedding is None:
+            return False
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return bool(norm) and float(self.topic_embedding @ (vector / norm)) >= SESSION_REUSE_SIMILARITY
+
+    def set_topic(self, query: str, embedding, context: str, context_tokens: int):
+        self.topic_query = query
+        vector = np.asarray(embedding, dtype=np.float32) if embedding is not None else None
+        self.topic_embedding = vector / np.linalg.norm(vector) if vector is not None and vector.any() else None
+        self.context = context
+        self.context_tokens = context_tokens
+
+    @property
+    def chat_tokens(self) -> int:
+        return sum(self.chat_turn_tokens)
+
+    def start_chat(self, model, history: Optional[List[str]] = None):
+        # history: alternating user and model messages to seed the chat with, e.g. a cached answer
+        history = history or []
+        self.chat = model.start_chat(history=[
+            {"role": "user" if i % 2 == 0 else "model", "parts": [text]} for i, text in enumerate(history)
+        ])
+        self.chat_turn_tokens = [count_tokens(history[i]) + count_tokens(history[i + 1])
+                                 for i in range(0, len(history) - 1, 2)]
+
+    def record_turn(self, message: str, answer: str):
+        self.turns += 1
+        self.chat_turn_tokens.append(count_tokens(message) + count_tokens(answer))
+
+    def trim_chat(self, keep: int = SESSION_HISTORY_TURNS):
+        # Keeps the context turn and the last `keep` follow-ups; each turn is one user and one model message
+        extra = len(self.chat_turn_tokens) - 1 - keep
+        if self.chat is None or extra <= 0:
+            return
+        history = list(self.chat.history)
+        self.chat.history = history[:2] + history[2 + 2 * extra:]
+        del self.chat_turn_tokens[1:1 + extra]
+
+    def reset_chat(self):
+        self.chat = None
+        self.chat_turn_tokens = []
+
+class SessionStore:
+    """In-memory conversations, evicted after ``ttl_seconds`` idle or least recently used first."""
+
+    def __init__(self, max_sessions: int = SESSION_MAX, ttl_seconds: float = SESSION_TTL):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self._sessions: OrderedDict[str, Session] = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"created": 0, "resumed": 0, "expired": 0, "evicted": 0}
+
+    def _expire(self, now: float):
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if now - session.last_used < self.ttl_seconds:
+                break
+            self._sessions.popitem(last=False)
+            self._stats["expired"] += 1
+
+    def get(self, session_id: Optional[str], scope: Hashable) -> Session:
+        # Unknown, expired or empty ids, or a change of collection or chapter, start a new session
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            session = self._sessions.get(session_id) if session_id else None
+            if session is not None and session.scope == scope:
+                self._stats["resumed"] += 1
+            else:
+                if session is not None:
+                    del self._sessions[session.id]
+                session = Session(uuid.uuid4().hex, scope)
+                self._sessions[session.id] = session
+                self._stats["created"] += 1
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+                    self._stats["evicted"] += 1
+            self._sessions.move_to_end(session.id)
+            session.last_used = now
+            return session
+
+    def drop(self, session_id: str) -> bool:
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {**self._stats, "active": len(self._sessions), "max_sessions": self.max_sessions,
+                    "ttl_seconds": self.ttl_seconds}
+
+_store = SessionStore()
+
+def get_session_store() -> SessionStore:
+    return _store
@@ -0,0 +1,128 @@
+# stub_llm.py
+# Deterministic local stand-in for the Gemini model, selected with LLM_BACKEND=stub (benchmarks, offline runs)
+import asyncio
+import hashlib
+import json
+import os
+import re
+import time
+
+# Simulated latency of one full response, and the delay between streamed chunks
+STUB_LLM_LATENCY_MS = float(os.getenv("STUB_LLM_LATENCY_MS", "300"))
+STUB_LLM_TOKEN_DELAY_MS = float(os.getenv("STUB_LLM_TOKEN_DELAY_MS", "10"))
+
+EXCERPT_RE = re.compile(r"EXCERPT (\d+) \(write ([^)]*)\)")
+GRADE_ITEM_RE = re.compile(r"ITEM (\d+):")
+
+WORDS = ("sound", "wave", "frequency", "amplitude", "echo", "pitch", "loudness", "medium",
+         "vibration", "compression", "rarefaction", "speed", "ultrasound", "reflection")
+
+class StubResponse:
+    def __init__(self, text):
+        self.text = text
+
+class StubStream:
+    def __init__(self, text, delay):
+        self._pieces = re.findall(r"\S+\s*", text)
+        self._delay = delay
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for piece in self._pieces:
+            await asyncio.sleep(self._delay)
+            yield StubResponse(piece)
+
+class StubChatSession:
+    """Mimics ``genai.ChatSession``: each message is answered with the whole history as the prompt."""
+
+    def __init__(self, model, history=None):
+        self.model = model
+        self.history = list(history or [])
+
+    def _prompt(self, content):
+        return "\n".join([part for message in self.history for part in message["parts"]] + [content])
+
+    async def send_message_async(self, content, stream=False):
+        prompt = self._prompt(content)
+        response = await self.model.generate_content_async(prompt, stream=stream)
+        self.history += [{"role": "user", "parts": [content]},
+                         {"role": "model", "parts": [self.model._render(prompt, None)]}]
+        return response
+
+class StubGenerativeModel:
+    """Mimics the parts of ``genai.GenerativeModel`` the app uses.
+
+    Output depends only on the prompt, so repeated runs of a workload produce
+    the same answers, quiz questions and cache behaviour.
+    """
+
+    def __init__(self, latency_ms=STUB_LLM_LATENCY_MS, token_delay_ms=STUB_LLM_TOKEN_DELAY_MS):
+        self.latency = latency_ms / 1000
+        self.token_delay = token_delay_ms / 1000
+
+    @staticmethod
+    def _seed(prompt):
+        return int(hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8], 16)
+
+    def _text(self, prompt):
+        seed = self._seed(prompt)
+        sentences = []
+        for i in range(4):
+            words = [WORDS[(seed >> (i + j)) % len(WORDS)] for j in range(6)]
+            sentences.append(f"- The {words[0]} of a {words[1]} depends on its {words[2]} and {words[3]}.")
+        return "\n".join(sentences)
+
+    def _json(self, prompt):
+        excerpts = EXCERPT_RE.findall(prompt)
+        seed = self._seed(prompt)
+        if not excerpts:
+            items = GRADE_ITEM_RE.findall(prompt)
+            if items:
+                # Cycles through correct, partly correct and wrong
+                scores = [[1.0, 0.5, 0.0][(seed + int(number)) % 3] for number in items]
+                return json.dumps([
+                    {"correct": score == 1.0, "score": score,
+                     "explanation": "The answer is compared with the textbook excerpt."}
+                    for score in scores
+                ])
+            return json.dumps({})
+        questions = []
+        for number, kind in excerpts:
+            word = WORDS[(seed + int(number)) % len(WORDS)]
+            if "multiple-choice" in kind:
+                options = [WORDS[(seed + int(number) + i) % len(WORDS)] for i in range(4)]
+                questions.append({"type": "mcq", "question": f"Q{number}-{seed}: which term describes {word}?",
+                                  "options": options, "answer": options[0]})
+            elif "true/false" in kind:
+                questions.append({"type": "true_false", "question": f"Q{number}-{seed}: {word} needs a medium.",
+                                  "options": ["True", "False"], "answer": "True"})
+            elif "fill-in-the-blank" in kind:
+                questions.append({"type": "fill_blank", "question": f"Q{number}-{seed}: ____ is a property of {word}.",
+                                  "options": [], "answer": word})
+            else:
+                questions.append({"type": "short_answer", "question": f"Q{number}-{seed}: explain {word}.",
+                                  "options": [], "answer": f"{word} is explained in the chapter."})
+        return json.dumps(questions)
+
+    def _render(self, prompt, generation_config):
+        if (generation_config or {}).get("response_mime_type") == "application/json":
+            return self._json(prompt)
+        return self._text(prompt)
+
+    def start_chat(self, history=None):
+        return StubChatSession(self, history)
+
+    def generate_content(self, prompt, generation_config=None, stream=False):
+        time.sleep(self.latency)
+        return StubResponse(self._render(prompt, generation_config))
+
+    async def generate_content_async(self, prompt, generation_config=None, stream=False):
+        text = self._render(prompt, generation_config)
+        if stream:
+            # Time to first chunk is a fraction of the full latency, the rest is spread over the chunks
+            await asyncio.sleep(self.latency / 4)
+            return StubStream(text, self.token_delay)
+        await asyncio.sleep(self.latency)
+        return StubResponse(text)
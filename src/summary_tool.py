@@ -1,14 +1,18 @@
 # summary_tool.py
 
+from typing import Optional
+from src.context_builder import AGENT_CONTEXT_TOKEN_BUDGET
 from src.rag_system import RAGSystem
 
 class SummaryTool:
-    def __init__(self, rag_system: RAGSystem):
+    def __init__(self, rag_system: RAGSystem, chapter: Optional[str] = None):
         self.rag_system = rag_system
+        self.chapter = chapter
+        self.topic = rag_system.topic(chapter)
 
-    def generate_summary(self) -> str:
-        prompt = """
-        Generate a concise summary of the most important points in the Sound chapter. Try to cover the experiments and important question additionally.
+    async def generate_summary(self) -> str:
+        prompt = f"""
+        Generate a concise summary of the most important points in the {self.topic}. Try to cover the experiments and important question additionally.
         The summary should:
         1. Cover the main concepts and principles
         2. Highlight key experiments or demonstrations
@@ -17,25 +21,26 @@ class SummaryTool:
         5. Be organized with bullet points or numbered list for clarity
         """
         
-        context = self.rag_system.vectorstore.similarity_search(prompt, k=10)
-        context_text = " ".join([doc.page_content for doc in context])
+        # The instruction text is a poor keyword or rerank query, so rank these by embedding only
+        context = await self.rag_system.aretrieve(prompt, k=10, mode="dense", chapter=self.chapter, rerank=False)
+        context_text = self.rag_system.build_context(context, prompt, AGENT_CONTEXT_TOKEN_BUDGET).text
         
-        summary = self.rag_system.get_gemini_response(context_text, prompt)
+        summary = await self.rag_system.aget_gemini_response(context_text, prompt)
         return summary
 
-    def generate_important_topics(self) -> str:
-        prompt = """
-        Generate a list of important topics covered in the Sound chapter of the NCERT book. The list should be in form of a flow chart made with symbols.
+    async def generate_important_topics(self) -> str:
+        prompt = f"""
+        Generate a list of important topics covered in the {self.topic} of the NCERT book. The list should be in form of a flow chart made with symbols.
         The list should:
-        1. Include major concepts and principles related to sound
+        1. Include major concepts and principles related to the {self.topic}
         2. Cover key phenomena and their explanations
         3. Include any significant experiments or applications discussed
         4. Be organized as a bulleted list
         5. Provide a brief (1-2 sentence) explanation for each topic at the end of flow chart.
         """
 
-        context = self.rag_system.vectorstore.similarity_search(prompt, k=10)
-        context_text = " ".join([doc.page_content for doc in context])
+        context = await self.rag_system.aretrieve(prompt, k=10, mode="dense", chapter=self.chapter, rerank=False)
+        context_text = self.rag_system.build_context(context, prompt, AGENT_CONTEXT_TOKEN_BUDGET).text
 
-        topics = self.rag_system.get_gemini_response(context_text, prompt)
+        topics = await self.rag_system.aget_gemini_response(context_text, prompt)
         return topics
\ No newline at end of file
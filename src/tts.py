@@ -0,0 +1,157 @@
+# tts.py
+import asyncio
+import base64
+import hashlib
+import io
+import itertools
+import json
+import logging
+import os
+import re
+import struct
+import wave
+from collections import deque
+from typing import AsyncIterator, Dict, List, Optional
+import httpx
+from src.metrics import record_cache, span
+from src.upstream import get_upstream
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SARVAM_TTS_URL = os.getenv("SARVAM_TTS_URL", "https://api.sarvam.ai/text-to-speech")
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", "tts_cache")
+# Segments synthesized in parallel per request
+TTS_CONCURRENCY = int(os.getenv("TTS_CONCURRENCY", "4"))
+# Segments a stream synthesizes ahead of the one it is sending, so a slow client holds few finished segments
+TTS_LOOKAHEAD = int(os.getenv("TTS_LOOKAHEAD", "4"))
+# Sarvam accepts at most 500 characters per input
+TTS_MAX_SEGMENT_CHARS = int(os.getenv("TTS_MAX_SEGMENT_CHARS", "500"))
+
+SENTENCE_RE = re.compile(r"(?<=[.!?।])\s+")
+
+def split_sentences(text: str, max_chars: int = TTS_MAX_SEGMENT_CHARS) -> List[str]:
+    # Split at sentence boundaries, hard-wrapping any sentence longer than max_chars at whitespace
+    segments = []
+    for sentence in SENTENCE_RE.split(text.strip()):
+        sentence = sentence.strip()
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(" ", 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            segments.append(sentence[:cut].strip())
+            sentence = sentence[cut:].strip()
+        if sentence:
+            segments.append(sentence)
+    return segments
+
+def wav_header(channels: int, sample_width: int, frame_rate: int) -> bytes:
+    # RIFF header with maximal sizes, the usual convention for WAV of unknown length
+    data_size = 0xFFFFFFFF - 36
+    byte_rate = frame_rate * channels * sample_width
+    return (
+        b"RIFF" + struct.pack("<I", data_size + 36) + b"WAVE"
+        + b"fmt " + struct.pack("<IHHIIHH", 16, 1, channels, frame_rate, byte_rate,
+                                channels * sample_width, sample_width * 8)
+        + b"data" + struct.pack("<I", data_size)
+    )
+
+def read_wav(audio: bytes):
+    try:
+        with wave.open(io.BytesIO(audio), "rb") as wav:
+            params = (wav.getnchannels(), wav.getsampwidth(), wav.getframerate())
+            return params, wav.readframes(wav.getnframes())
+    except (wave.Error, EOFError) as e:
+        raise ValueError(f"Invalid WAV audio: {e}") from e
+
+class TTSCache:
+    """Content-addressed on-disk cache of synthesized WAV segments."""
+
+    def __init__(self, directory: str = TTS_CACHE_DIR):
+        self.directory = directory
+
+    @staticmethod
+    def key(text: str, params: Dict) -> str:
+        return hashlib.sha256(json.dumps({"text": text, **params}, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.wav")
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+
+    def put(self, key: str, audio: bytes):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(audio)
+        os.replace(tmp_path, path)
+
+class TTSPipeline:
+    """Sentence-segmented, concurrent, cached text-to-speech against the Sarvam API.
+
+    ``stream`` yields one WAV header followed by raw PCM frames for each segment
+    in order, so playback can start as soon as the first sentence is ready.
+    """
+
+    def __init__(self, client: httpx.AsyncClient, api_key: str, url: str = SARVAM_TTS_URL,
+                 cache: Optional[TTSCache] = None, concurrency: int = TTS_CONCURRENCY,
+                 lookahead: int = TTS_LOOKAHEAD):
+        self.client = client
+        self.api_key = api_key
+        self.url = url
+        self.cache = cache or TTSCache()
+        self.lookahead = max(1, lookahead)
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    async def synthesize(self, text: str, params: Dict) -> bytes:
+        key = self.cache.key(text, params)
+        audio = self.cache.get(key)
+        if audio is not None:
+            record_cache("tts", "hit")
+            return audio
+        record_cache("tts", "miss")
+
+        payload = {"inputs": [text], **params}
+        headers = {
+            "Content-Type": "application/json",
+            "API-Subscription-Key": self.api_key
+        }
+
+        async def request():
+            response = await self.client.post(self.url, json=payload, headers=headers)
+            response.raise_for_status()
+            return response
+
+        async with self._semaphore:
+            with span("tts_synthesize"):
+                response = await get_upstream("sarvam").call(request)
+        audio = base64.b64decode(response.json()["audios"][0])
+        # Only audio that decodes is cached; a bad response would otherwise be replayed on every hit
+        read_wav(audio)
+        self.cache.put(key, audio)
+        return audio
+
+    async def stream(self, text: str, params: Dict) -> AsyncIterator[bytes]:
+        segments = iter(split_sentences(text))
+        tasks = deque()
+        try:
+            header_sent = False
+            while True:
+                # Keep at most `lookahead` segments in flight or finished but not yet sent
+                for segment in itertools.islice(segments, self.lookahead - len(tasks)):
+                    tasks.append(asyncio.ensure_future(self.synthesize(segment, params)))
+                if not tasks:
+                    break
+                wav_params, frames = read_wav(await tasks.popleft())
+                if not header_sent:
+                    yield wav_header(*wav_params)
+                    header_sent = True
+                yield frames
+        finally:
+            for task in tasks:
+                task.cancel()
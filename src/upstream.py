@@ -0,0 +1,220 @@
+# upstream.py
+import asyncio
+import logging
+import os
+import random
+import time
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+import httpx
+from google.api_core import exceptions as google_exceptions
+from src.metrics import UPSTREAM_CALLS, UPSTREAM_RETRIES
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+RETRYABLE_GOOGLE_ERRORS = (
+    google_exceptions.TooManyRequests,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.InternalServerError,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.DeadlineExceeded,
+)
+
+class UpstreamError(Exception):
+    def __init__(self, upstream: str, message: str, retry_after: Optional[float] = None):
+        super().__init__(f"{upstream}: {message}")
+        self.upstream = upstream
+        self.retry_after = retry_after
+
+class UpstreamUnavailable(UpstreamError):
+    """Raised without calling the upstream while its circuit breaker is open."""
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, (asyncio.TimeoutError, httpx.TransportError)):
+        return True
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code in RETRYABLE_STATUS_CODES
+    return isinstance(error, RETRYABLE_GOOGLE_ERRORS)
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    if isinstance(error, httpx.HTTPStatusError):
+        try:
+            return float(error.response.headers.get("Retry-After", ""))
+        except ValueError:
+            return None
+    return None
+
+class CircuitBreaker:
+    """Opens after consecutive failures, then lets a single trial call through after reset_timeout.
+
+    A trial that has not resolved within reset_timeout is given up on and the
+    next call becomes the new trial, so the breaker never stays half open.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_started_at = 0.0
+
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        now = time.monotonic()
+        if self.state == "open" and now - self.opened_at >= self.reset_timeout:
+            self.state = "half_open"
+            self.trial_started_at = now
+            return True
+        if self.state == "half_open" and now - self.trial_started_at >= self.reset_timeout:
+            self.trial_started_at = now
+            return True
+        return False
+
+    def retry_after(self) -> float:
+        return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                logger.warning(f"Circuit breaker opened after {self.failures} consecutive failures")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def abort_trial(self):
+        # The trial ended without telling us anything (e.g. it was cancelled); the next call tries again
+        if self.state == "half_open":
+            self.state = "open"
+            self.opened_at = time.monotonic() - self.reset_timeout
+
+class Upstream:
+    """Concurrency limit, timeout, jittered exponential backoff and circuit breaker around one upstream service."""
+
+    def __init__(self, name: str, max_concurrency: int = 8, timeout: float = 30.0, max_retries: int = 3,
+                 backoff_base: float = 0.5, backoff_max: float = 8.0, failure_threshold: int = 5,
+                 reset_timeout: float = 30.0):
+        self.name = name
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._inflight = 0
+        self._stats = {"calls": 0, "successes": 0, "failures": 0, "retries": 0, "timeouts": 0,
+                       "short_circuited": 0, "latency_seconds_total": 0.0}
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        # Full jitter, but never earlier than the upstream asked us to wait
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        retry_after = retry_after_seconds(error)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.backoff_max))
+        return delay
+
+    async def call(self, fn: Callable[[], Awaitable[T]]) -> T:
+        self._stats["calls"] += 1
+        if not self.breaker.allow():
+            self._stats["short_circuited"] += 1
+            UPSTREAM_CALLS.labels(self.name, "short_circuited").inc()
+            raise UpstreamUnavailable(self.name, "circuit breaker is open", retry_after=self.breaker.retry_after())
+
+        trial = self.breaker.state == "half_open"
+        resolved = False
+        try:
+            for attempt in range(self.max_retries + 1):
+                start = time.perf_counter()
+                try:
+                    async with self._semaphore:
+                        self._inflight += 1
+                        try:
+                            result = await asyncio.wait_for(fn(), self.timeout)
+                        finally:
+                            self._inflight -= 1
+                            self._stats["latency_seconds_total"] += time.perf_counter() - start
+                except Exception as e:
+                    if isinstance(e, asyncio.TimeoutError):
+                        self._stats["timeouts"] += 1
+                    retryable = is_retryable(e)
+                    if not retryable or attempt == self.max_retries:
+                        self._stats["failures"] += 1
+                        UPSTREAM_CALLS.labels(self.name, "timeout" if isinstance(e, asyncio.TimeoutError) else "error").inc()
+                        if retryable:
+                            self.breaker.record_failure()
+                        elif trial:
+                            # The upstream answered; only this request was bad
+                            self.breaker.record_success()
+                        resolved = True
+                        logger.error(f"{self.name} call failed after {attempt + 1} attempt(s): {e!r}")
+                        raise UpstreamError(self.name, str(e) or type(e).__name__,
+                                            retry_after=retry_after_seconds(e)) from e
+                    self._stats["retries"] += 1
+                    UPSTREAM_RETRIES.labels(self.name).inc()
+                    delay = self._backoff(attempt, e)
+                    logger.warning(f"{self.name} call failed ({e!r}), retrying in {delay:.2f}s")
+                    await asyncio.sleep(delay)
+                else:
+                    self._stats["successes"] += 1
+                    UPSTREAM_CALLS.labels(self.name, "success").inc()
+                    self.breaker.record_success()
+                    resolved = True
+                    return result
+        finally:
+            if trial and not resolved:
+                # Cancelled (e.g. the client went away) before the trial said anything about the upstream
+                self.breaker.abort_trial()
+
+    def get_stats(self) -> Dict:
+        return {**self._stats, "inflight": self._inflight, "breaker_state": self.breaker.state,
+                "consecutive_failures": self.breaker.failures}
+
+def _upstream_from_env(name: str, prefix: str, **defaults) -> Upstream:
+    return Upstream(
+        name,
+        max_concurrency=int(os.getenv(f"{prefix}_MAX_CONCURRENCY", defaults.get("max_concurrency", 8))),
+        timeout=float(os.getenv(f"{prefix}_TIMEOUT", defaults.get("timeout", 30))),
+        max_retries=int(os.getenv(f"{prefix}_MAX_RETRIES", 3)),
+        failure_threshold=int(os.getenv(f"{prefix}_BREAKER_THRESHOLD", 5)),
+        reset_timeout=float(os.getenv(f"{prefix}_BREAKER_RESET", 30)),
+    )
+
+UPSTREAMS = {
+    "gemini": _upstream_from_env("gemini", "GEMINI", max_concurrency=16, timeout=60),
+    "sarvam": _upstream_from_env("sarvam", "SARVAM", max_concurrency=8, timeout=30),
+}
+
+def get_upstream(name: str) -> Upstream:
+    return UPSTREAMS[name]
+
+def get_upstream_stats() -> Dict[str, Dict]:
+    return {name: upstream.get_stats() for name, upstream in UPSTREAMS.items()}
+
+# Keep-alive connection pool shared by all outbound HTTP calls
+_http_client: Optional[httpx.AsyncClient] = None
+
+def get_http_client() -> httpx.AsyncClient:
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(30.0, connect=5.0),
+            limits=httpx.Limits(
+                max_connections=int(os.getenv("HTTP_MAX_CONNECTIONS", "100")),
+                max_keepalive_connections=int(os.getenv("HTTP_MAX_KEEPALIVE", "20")),
+            ),
+        )
+    return _http_client
+
+async def close_http_client():
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
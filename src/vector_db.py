@@ -1,26 +1,216 @@
 # vector_db.py
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_community.vectorstores import Chroma
+from langchain_core.documents import Document
+from src.chunking import chunker_signature
+from src.embeddings import get_embedding_service
+from src.ingest import IngestStats, iter_chunk_batches
+import hashlib
+import json
+import logging
 import os
+import threading
+from contextlib import nullcontext
+
+logging.basicConfig(level=logging.INFO)
+
+# "chroma", or "mmap" for the memory-mapped NumPy store in src/mmap_store.py
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+
+# Each backend tracks what it has ingested separately, so switching backends re-ingests into the new one
+MANIFEST_FILE = "ingest_manifest.json" if VECTOR_BACKEND == "chroma" else f"ingest_manifest.{VECTOR_BACKEND}.json"
+# Chroma's own default collection name
+DEFAULT_COLLECTION = "langchain"
+
+# The manifest is shared by every collection in the persist directory
+_manifest_lock = threading.Lock()
+
+def open_vector_store(embeddings, persist_directory='db', collection_name=DEFAULT_COLLECTION,
+                      backend=VECTOR_BACKEND):
+    os.makedirs(persist_directory, exist_ok=True)
+    if backend == "mmap":
+        from src.mmap_store import MmapVectorStore
+
+        return MmapVectorStore(collection_name, embeddings, persist_directory=persist_directory)
+    if backend != "chroma":
+        raise ValueError(f"Unknown vector backend: {backend}")
+    # Imported lazily so the mmap backend never loads chromadb
+    from langchain_community.vectorstores import Chroma
+
+    return Chroma(collection_name=collection_name, embedding_function=embeddings,
+                  persist_directory=persist_directory)
+
+def write_batch(vectorstore):
+    # The mmap store buffers writes made inside its batch() and commits one version; Chroma writes through
+    return vectorstore.batch() if hasattr(vectorstore, "batch") else nullcontext()
+
+def collection_size(vectorstore):
+    if hasattr(vectorstore, "count"):
+        return vectorstore.count()
+    return vectorstore._collection.count()
+
+def query_by_vectors(vectorstore, embeddings, k, where=None):
+    # One k-NN query for several embeddings; returns a list of Documents per embedding
+    if hasattr(vectorstore, "search_batch"):
+        return vectorstore.search_batch(embeddings, k, where)
+    found = vectorstore._collection.query(query_embeddings=embeddings, n_results=k, where=where,
+                                          include=["documents", "metadatas"])
+    return [
+        [Document(page_content=text, metadata=metadata or {}) for text, metadata in zip(texts, metadatas)]
+        for texts, metadatas in zip(found["documents"], found["metadatas"])
+    ]
 
 def create_vector_store(texts, persist_directory='db'):
     try:
-        embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-        
+        from langchain_community.vectorstores import Chroma
+
+        embeddings = get_embedding_service()
+
         # Ensure the persist directory exists
         os.makedirs(persist_directory, exist_ok=True)
-        
+
         vectorstore = Chroma.from_documents(
-            documents=texts, 
-            embedding=embeddings, 
+            documents=texts,
+            embedding=embeddings,
             persist_directory=persist_directory
         )
-        
+
         # Persist the vectorstore
         vectorstore.persist()
-        
+
         print(f"Vector store created successfully with {len(texts)} documents.")
         return vectorstore
     except Exception as e:
         print(f"Error creating vector store: {str(e)}")
-        return None
\ No newline at end of file
+        return None
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def chunk_id(doc):
+    # Stable key for a chunk: same file, page, text (and parent) always map to the same id
+    digest = hashlib.sha256()
+    digest.update(str(doc.metadata.get("source", "")).encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(str(doc.metadata.get("page", "")).encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(doc.page_content.encode("utf-8"))
+    # Structured chunks also carry their parent and place in the chapter; an unchanged small chunk
+    # under an edited parent must get a new id, or the stale parent text would be reused
+    for key in ("parent_id", "section", "block_type"):
+        if key in doc.metadata:
+            digest.update(b"\0")
+            digest.update(f"{key}={doc.metadata[key]}".encode("utf-8"))
+    return digest.hexdigest()
+
+def load_manifest(persist_directory):
+    path = os.path.join(persist_directory, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_manifest(persist_directory, manifest):
+    path = os.path.join(persist_directory, MANIFEST_FILE)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def sync_vector_store(pdf_path, embeddings, persist_directory='db', collection_name=DEFAULT_COLLECTION,
+                      metadata=None, vectorstore=None):
+    """Open the persisted collection and bring it in line with ``pdf_path``.
+
+    Chunks are keyed by a content hash, so only chunks that are not already
+    stored get embedded and chunks that no longer exist in the PDF are removed.
+    If the PDF, its metadata and the chunking settings are unchanged since the
+    last sync, nothing is parsed or embedded at all.
+    """
+    if vectorstore is None:
+        vectorstore = open_vector_store(embeddings, persist_directory, collection_name)
+    metadata = metadata or {}
+    chunker = chunker_signature()
+
+    with _manifest_lock:
+        entry = load_manifest(persist_directory).get(collection_name, {}).get(pdf_path)
+    digest = file_digest(pdf_path)
+    # Manifests written before chunking was configurable used the fixed character splitter
+    rechunked = entry is not None and entry.get("chunker", "recursive:2000:200") != chunker
+    if entry and entry.get("digest") == digest and entry.get("metadata", {}) == metadata and not rechunked:
+        logging.info(f"{pdf_path} unchanged since last ingest, reusing {entry.get('chunks', 0)} stored chunks.")
+        return vectorstore
+
+    # One write batch per PDF: stores that support it commit every change at the end, at once
+    with write_batch(vectorstore):
+        existing_ids = set(vectorstore.get(where={"source": pdf_path}, include=[])["ids"])
+        if entry and (entry.get("metadata", {}) != metadata or rechunked) and existing_ids:
+            # Metadata (including parent links) is not part of the chunk id, so drop the old chunks
+            # and re-add every chunk to update it
+            vectorstore.delete(ids=list(existing_ids))
+            removed = len(existing_ids)
+            existing_ids = set()
+        else:
+            removed = 0
+
+        # Chunks arrive in bounded batches while later pages are still being parsed,
+        # so only one batch of chunks and embeddings is held in memory at a time
+        stats = IngestStats(pdf_path)
+        seen_ids = set()
+        added = 0
+        for batch in iter_chunk_batches(pdf_path, stats=stats):
+            new_chunks = {}
+            for doc in batch:
+                doc_id = chunk_id(doc)
+                if doc_id in seen_ids:
+                    continue
+                seen_ids.add(doc_id)
+                if doc_id not in existing_ids:
+                    doc.metadata.update(metadata)
+                    doc.metadata["chunk_id"] = doc_id
+                    new_chunks[doc_id] = doc
+            if new_chunks:
+                vectorstore.add_documents(list(new_chunks.values()), ids=list(new_chunks))
+                added += len(new_chunks)
+        stats.report()
+
+        stale_ids = [doc_id for doc_id in existing_ids if doc_id not in seen_ids]
+        if stale_ids:
+            vectorstore.delete(ids=stale_ids)
+        removed += len(stale_ids)
+
+    with _manifest_lock:
+        manifest = load_manifest(persist_directory)
+        manifest.setdefault(collection_name, {})[pdf_path] = {
+            "digest": digest, "chunks": len(seen_ids), "metadata": metadata, "chunker": chunker}
+        save_manifest(persist_directory, manifest)
+    logging.info(f"Synced {pdf_path} into {collection_name}: {added} added, {removed} removed, "
+                 f"{len(seen_ids) - added} reused.")
+    return vectorstore
+
+def sync_collection(files, embeddings, persist_directory='db', collection_name=DEFAULT_COLLECTION, metadata=None):
+    # files: [{"path": ..., "chapter": ...}]; sources no longer listed are dropped from the collection
+    vectorstore = open_vector_store(embeddings, persist_directory, collection_name)
+    paths = [file["path"] for file in files]
+    for file in files:
+        file_metadata = {**(metadata or {}), **{key: value for key, value in file.items() if key != "path"}}
+        sync_vector_store(file["path"], embeddings, persist_directory, collection_name,
+                          metadata=file_metadata, vectorstore=vectorstore)
+
+    removed_ids = vectorstore.get(where={"source": {"$nin": paths}}, include=[])["ids"]
+    if removed_ids:
+        vectorstore.delete(ids=removed_ids)
+    with _manifest_lock:
+        manifest = load_manifest(persist_directory)
+        entries = manifest.get(collection_name, {})
+        if set(entries) - set(paths):
+            manifest[collection_name] = {path: entry for path, entry in entries.items() if path in paths}
+            save_manifest(persist_directory, manifest)
+    return vectorstore
+
+def index_version(persist_directory='db', collection_name=DEFAULT_COLLECTION):
+    # Changes whenever any source of the collection changes, so caches keyed on it go stale with the index
+    with _manifest_lock:
+        entries = load_manifest(persist_directory).get(collection_name, {})
+    return hashlib.sha256(json.dumps(entries, sort_keys=True).encode("utf-8")).hexdigest()[:16]
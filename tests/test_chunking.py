@@ -0,0 +1,102 @@
+# test_chunking.py
+import pytest
+from langchain_core.documents import Document
+from src.chunking import SECTION_RE, StructuredChunker
+
+def blocks(chunker, text):
+    return [(block.block_type, block.lines[0]) for block in chunker._blocks(text)]
+
+# Headings as pypdf extracts them from data/ncert_sound_chap.pdf, most with no space after the number
+@pytest.mark.parametrize("line, section", [
+    ("11.1 Production of Sound", "11.1 Production Of Sound"),
+    ("11.2Propagation of Sound", "11.2 Propagation Of Sound"),
+    ("11.2.1SOUND WAVES ARE LONGITUDINAL", "11.2.1 Sound Waves Are Longitudinal"),
+    ("11.2.2CHARACTERISTICS  OF  A  SOUND", "11.2.2 Characteristics Of A Sound"),
+    ("11.3.1ECHO", "11.3.1 Echo"),
+    ("11.3.3USES OF MULTIPLE  REFLECTION", "11.3.3 Uses Of Multiple Reflection"),
+    ("11.4Range of Hearing", "11.4 Range Of Hearing"),
+    ("11.5Applications of Ultrasound", "11.5 Applications Of Ultrasound"),
+])
+def test_headings_without_a_space_are_detected(line, section):
+    chunker = StructuredChunker()
+    assert chunker._blocks(f"{line}\nSound is produced by vibrating objects.")[0].section == section
+
+@pytest.mark.parametrize("line", ["1.5 km?", "0.1s. Hence, the total distance covered by", "11.3.",
+                                  "sound in air as 344 m s –1."])
+def test_numbers_in_prose_are_not_headings(line):
+    assert not SECTION_RE.match(line)
+
+def test_box_ends_at_the_next_heading():
+    chunker = StructuredChunker()
+    text = "\n".join([
+        "Activity _____________ 11.3",
+        "• Make a list of different types of",
+        "musical instruments and discuss",
+        "with your friends which part of the",
+        "instrument vibrates to produce",
+        "sound.",
+        "11.2Propagation of Sound",
+        "Sound is produced by vibrating objects. The",
+    ])
+    assert blocks(chunker, text) == [
+        ("activity", "Activity _____________ 11.3"),
+        ("text", "11.2Propagation of Sound"),
+    ]
+    assert chunker._blocks(text)[1].section == "11.2 Propagation Of Sound"
+
+def test_boxes_end_at_caption_and_blank_line():
+    chunker = StructuredChunker()
+    text = "\n".join([
+        "11.1 Production of Sound",
+        "Sound is produced by vibrating objects.",
+        "Activity _____________ 11.1",
+        "Take a tuning fork and strike it.",
+        "Fig. 11.1: Vibrating tuning fork just touching the",
+        "We see that the fork vibrates.",
+        "Example 11.1 A sound wave has a",
+        "",
+        "Now we continue with prose.",
+    ])
+    assert blocks(chunker, text) == [
+        ("text", "11.1 Production of Sound"),
+        ("activity", "Activity _____________ 11.1"),
+        ("text", "Fig. 11.1: Vibrating tuning fork just touching the"),
+        ("example", "Example 11.1 A sound wave has a"),
+        ("text", "Now we continue with prose."),
+    ]
+
+def test_box_is_capped_at_the_parent_size():
+    chunker = StructuredChunker(chunk_tokens=20, parent_tokens=20)
+    text = "Example 11.1 A sound wave has a\n" + "\n".join(f"line {i} of the worked solution" for i in range(10))
+    found = chunker._blocks(text)
+    assert [block.block_type for block in found] == ["example", "text"]
+    assert sum(chunker.length(line) for line in found[0].lines) <= 20
+
+def test_box_ends_with_its_page_but_section_carries_over():
+    chunker = StructuredChunker()
+    chunker._blocks("11.3 Reflection of Sound\nActivity _____________ 11.5\nTake two identical pipes.")
+    assert chunker._blocks("More prose on the next page.")[0][:2] == ("11.3 Reflection Of Sound", "text")
+
+def test_running_headers_and_footers_are_dropped():
+    pages = [
+        Document(page_content=f"{header}\n{body}\nRationalised 2023-24", metadata={"source": "s.pdf", "page": n})
+        for n, (header, body) in enumerate([
+            ("SCIENCE128", "The vibrating object sets the medium in motion."),
+            ("SOUND 129", "Compression is the region of high pressure."),
+            ("SCIENCE130", "Heinrich Rudolph Hertz was born in Hamburg."),
+            ("SOUND 131", "The pitch of a sound depends on its frequency."),
+        ])
+    ]
+    # A page the PDF repeats does not turn its own edge lines into furniture
+    pages.append(Document(page_content=pages[3].page_content, metadata={"source": "s.pdf", "page": 4}))
+    text = " ".join(chunk.page_content for chunk in StructuredChunker().split_documents(pages))
+    for furniture in ("Rationalised", "SCIENCE1", "SOUND 1"):
+        assert furniture not in text
+    assert text.count("The pitch of a sound depends on its frequency.") == 2
+
+def test_token_counts_use_the_length_function():
+    words = StructuredChunker(chunk_tokens=5, overlap_tokens=0, length_function=lambda text: len(text.split()))
+    chunks = words.split_documents([Document(page_content="One two three. Four five six. Seven eight nine.",
+                                             metadata={"source": "s.pdf", "page": 0})])
+    assert [chunk.metadata["token_count"] for chunk in chunks] == [3, 3, 3]
+    assert chunks[0].metadata["parent_token_count"] == 9
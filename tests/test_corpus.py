@@ -0,0 +1,31 @@
+# test_corpus.py
+import pytest
+from src import corpus
+from src.corpus import CorpusManager
+
+class FakeRAG:
+    def __init__(self, api_key, files, collection_name, subject=""):
+        self.collection_name = collection_name
+
+@pytest.fixture
+def manager(monkeypatch):
+    monkeypatch.setattr(corpus, "RAGSystem", FakeRAG)
+    collections = {name: {"files": [{"path": f"{name}.pdf"}]} for name in ("sound", "motion", "force", "work")}
+    return CorpusManager("key", collections, max_resident=2, default_collection="sound")
+
+def test_default_collection_is_never_evicted(manager):
+    manager.get()
+    for name in ("motion", "force", "work", "motion"):
+        manager.get(name)
+        assert manager.is_resident()
+        assert len(manager._resident) == 2
+    assert manager.is_resident("motion") and not manager.is_resident("force")
+
+def test_other_collections_are_evicted_least_recently_used(manager):
+    for name in ("motion", "force", "work"):
+        manager.get(name)
+    assert not manager.is_resident("motion") and manager.is_resident("force") and manager.is_resident("work")
+    loaded = manager.get("force")
+    assert manager.get("force") is loaded
+    with pytest.raises(KeyError):
+        manager.get("missing")
@@ -0,0 +1,127 @@
+# test_mmap_store.py
+import os
+import zlib
+import numpy as np
+import pytest
+from langchain_core.documents import Document
+from src import mmap_store
+from src.mmap_store import MmapVectorStore
+
+class FakeEmbeddings:
+    # Deterministic vectors: "vN" text maps to direction N, anything else to a hash-seeded vector
+    dim = 16
+
+    def _vector(self, text):
+        if text.startswith("v") and text[1:].isdigit():
+            vector = np.zeros(self.dim)
+            vector[int(text[1:]) % self.dim] = 1.0
+            return vector.tolist()
+        return np.random.default_rng(zlib.crc32(text.encode())).normal(size=self.dim).tolist()
+
+    def embed_documents(self, texts):
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._vector(text)
+
+def make_store(tmp_path, dtype="float16"):
+    return MmapVectorStore("test", FakeEmbeddings(), persist_directory=str(tmp_path), dtype=dtype)
+
+def docs(*specs):
+    return [Document(page_content=text, metadata=metadata) for text, metadata in specs]
+
+def versions(store):
+    return [name for name in os.listdir(store.root) if os.path.isdir(os.path.join(store.root, name))]
+
+@pytest.fixture
+def store(tmp_path):
+    store = make_store(tmp_path)
+    store.add_documents(docs(("v0", {"source": "a.pdf", "chapter": "Sound"}),
+                             ("v1", {"source": "b.pdf", "chapter": "Sound"}),
+                             ("v2", {"source": "c.pdf", "chapter": "Motion"}),
+                             ("v3", {"source": "a.pdf"})),
+                        ids=["a0", "b1", "c2", "a3"])
+    return store
+
+def test_mask_filters(store):
+    def ids(where):
+        return sorted(store.get(where=where, include=[])["ids"])
+
+    assert ids({"source": "a.pdf"}) == ["a0", "a3"]
+    assert ids({"source": {"$ne": "a.pdf"}}) == ["b1", "c2"]
+    assert ids({"source": {"$in": ["a.pdf", "c.pdf"]}}) == ["a0", "a3", "c2"]
+    assert ids({"source": {"$nin": ["a.pdf", "b.pdf"]}}) == ["c2"]
+    assert ids({"source": {"$nin": ["missing.pdf"]}}) == ["a0", "a3", "b1", "c2"]
+    # Rows without the key never match an equality and always match a negation
+    assert ids({"chapter": {"$nin": ["Sound"]}}) == ["a3", "c2"]
+    assert ids({"$and": [{"chapter": "Sound"}, {"source": {"$ne": "a.pdf"}}]}) == ["b1"]
+    assert ids({"$or": [{"chapter": "Motion"}, {"source": "b.pdf"}]}) == ["b1", "c2"]
+    assert ids({"$or": [{"$and": [{"source": "a.pdf"}, {"chapter": "Sound"}]}, {"chapter": "Motion"}]}) \
+        == ["a0", "c2"]
+    with pytest.raises(ValueError):
+        ids({"source": {"$gt": 1}})
+
+def test_delete_to_empty(store):
+    store.delete(ids=["a0", "b1", "c2", "a3"])
+    assert store.count() == 0
+    assert versions(store) == []
+    with open(os.path.join(store.root, "CURRENT"), encoding="utf-8") as f:
+        assert f.read() == ""
+    assert store.similarity_search("v0", k=2) == []
+    assert store.get()["ids"] == []
+
+    store.add_documents(docs(("v5", {"source": "d.pdf"})), ids=["d5"])
+    assert store.get()["ids"] == ["d5"]
+
+def test_batch_commits_one_version(tmp_path):
+    store = make_store(tmp_path)
+    with store.batch():
+        for i in range(5):
+            store.add_documents(docs((f"v{i}", {"source": "a.pdf"})), ids=[f"a{i}"])
+        store.delete(ids=["a1"])
+        # Nothing is visible until the batch exits
+        assert store.count() == 0
+    assert len(versions(store)) == 1
+    assert sorted(store.get()["ids"]) == ["a0", "a2", "a3", "a4"]
+    assert store.similarity_search("v3", k=1)[0].page_content == "v3"
+
+def test_int8_rows_are_not_requantized(tmp_path):
+    store = make_store(tmp_path, dtype="int8")
+    texts = [f"text {i}" for i in range(20)]
+    store.add_documents(docs(*[(text, {"n": i}) for i, text in enumerate(texts)]),
+                        ids=[str(i) for i in range(20)])
+    before = store.snapshot()
+    stored, scales = np.array(before.vectors), np.array(before.scales)
+
+    store.add_documents(docs(("another", {})), ids=["new"])
+    store.delete(ids=["0"])
+    after = store.snapshot()
+    assert after.vectors.dtype == np.int8
+    rows = [after.index[str(i)] for i in range(1, 20)]
+    assert np.array_equal(after.vectors[rows], stored[1:])
+    assert np.array_equal(after.scales[rows], scales[1:])
+    assert after.metadata(after.index["5"]) == {"n": 5}
+
+def test_ivf_search(tmp_path, monkeypatch):
+    monkeypatch.setattr(mmap_store, "MMAP_IVF_MIN_VECTORS", 50)
+    monkeypatch.setattr(mmap_store, "MMAP_IVF_LISTS", 4)
+    monkeypatch.setattr(mmap_store, "MMAP_IVF_PROBES", 4)
+    store = make_store(tmp_path)
+    texts = [f"passage {i}" for i in range(200)]
+    store.add_documents(docs(*[(text, {"half": i % 2}) for i, text in enumerate(texts)]),
+                        ids=[str(i) for i in range(200)])
+    snapshot = store.snapshot()
+    assert snapshot.centroids is not None and len(snapshot.lists) == 200
+
+    # Probing every list is exhaustive, so each passage is its own nearest neighbour
+    for i in (0, 57, 199):
+        assert store.similarity_search(texts[i], k=1)[0].page_content == texts[i]
+    found = store.similarity_search(texts[3], k=5, filter={"half": 1})
+    assert found[0].page_content == texts[3] and all(doc.metadata["half"] == 1 for doc in found)
+
+    # A small append keeps the trained centroids and assigns only the new rows
+    store.add_documents(docs(("passage new", {"half": 0})), ids=["new"])
+    appended = store.snapshot()
+    assert np.array_equal(appended.centroids, snapshot.centroids)
+    assert np.array_equal(appended.lists[:200], snapshot.lists)
+    assert store.similarity_search("passage new", k=1)[0].page_content == "passage new"
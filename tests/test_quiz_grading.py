@@ -0,0 +1,51 @@
+# test_quiz_grading.py
+import asyncio
+from types import SimpleNamespace
+import pytest
+from src.quiz_agent import QuizAgent, grade_locally
+
+class FakeRAG:
+    def __init__(self, graded):
+        self.graded = graded
+
+    def topic(self, chapter):
+        return "Sound chapter"
+
+    async def aretrieve(self, query, k, chapter=None):
+        return []
+
+    def build_context(self, documents, query, budget):
+        return SimpleNamespace(text="excerpt")
+
+    async def aget_gemini_json(self, prompt):
+        return self.graded
+
+def grade(graded, count=1):
+    items = [{"question": f"Q{i}", "type": "short_answer", "answer": "ref", "user_answer": "mine"}
+             for i in range(count)]
+    return asyncio.run(QuizAgent(FakeRAG(graded)).evaluate_quiz(items))
+
+@pytest.mark.parametrize("flag, expected", [(True, True), (False, False), ("false", False), ("True", True),
+                                            ("no", False), ("yes", True)])
+def test_llm_correct_flag_is_parsed(flag, expected):
+    [result] = grade([{"correct": flag, "score": 1.0 if expected else 0.0, "explanation": "e"}])
+    assert result["graded_by"] == "llm"
+    assert result["correct"] is expected
+
+@pytest.mark.parametrize("flag", ["maybe", None, 1, [True]])
+def test_unreadable_correct_flag_is_ungraded(flag):
+    [result] = grade([{"correct": flag, "score": 1.0}])
+    assert result["graded_by"] == "ungraded"
+    assert result["correct"] is False and result["score"] == 0.0
+
+def test_missing_results_are_ungraded():
+    results = grade([{"correct": True, "score": 1.0}], count=2)
+    assert [result["graded_by"] for result in results] == ["llm", "ungraded"]
+
+def test_local_grading():
+    mcq = {"type": "mcq", "options": ["Echo", "Pitch", "Tone", "Noise"], "answer": "Pitch"}
+    assert grade_locally({**mcq, "user_answer": "b"})["correct"]
+    assert not grade_locally({**mcq, "user_answer": "1"})["correct"]
+    assert grade_locally({"type": "true_false", "answer": "False", "user_answer": "no"})["correct"]
+    assert grade_locally({"type": "short_answer", "answer": "x", "user_answer": "y"}) is None
+    assert grade_locally({"type": "mcq", "answer": "x", "user_answer": ""})["graded_by"] == "local"
@@ -0,0 +1,68 @@
+# test_sessions.py
+import pytest
+from src.sessions import SESSION_REUSE_SIMILARITY, Session, SessionStore, is_follow_up, rewrite_query
+
+TOPIC = "What is an echo?"
+
+@pytest.mark.parametrize("query", [
+    "Why is sound a longitudinal wave?",
+    "Explain reverberation in more detail",
+    "What is an echo? Give an example",
+    "How does it travel through water?",
+    "What else is SONAR used for?",
+])
+def test_standalone_questions_are_not_rewritten(query):
+    topic = "How does a stethoscope work?"
+    assert not is_follow_up(query, topic)
+    assert rewrite_query(query, topic) == query
+
+@pytest.mark.parametrize("query", ["Why?", "Give an example of this.", "Explain it more simply.", "Why is it so?"])
+def test_follow_ups_are_searched_with_the_topic(query):
+    assert is_follow_up(query, TOPIC)
+    assert rewrite_query(query, TOPIC) == f"{TOPIC} {query}"
+
+def test_no_rewrite_without_a_topic():
+    assert rewrite_query("Why?", None) == "Why?"
+
+def test_reuse_is_decided_by_embedding():
+    session = Session("s", scope=("default", None))
+    session.set_topic(TOPIC, [1.0, 0.0], "context", 10)
+    assert session.is_on_topic([1.0, 0.05])
+    assert not session.is_on_topic([0.0, 1.0])
+    below = (1 - SESSION_REUSE_SIMILARITY ** 2) ** 0.5 + 0.05
+    assert not session.is_on_topic([SESSION_REUSE_SIMILARITY - 0.05, below])
+    assert not Session("t", scope=None).is_on_topic([1.0, 0.0])
+
+def test_store_starts_a_new_session_on_scope_change_and_evicts():
+    store = SessionStore(max_sessions=2, ttl_seconds=60)
+    first = store.get("", ("default", "Sound"))
+    assert store.get(first.id, ("default", "Sound")) is first
+    moved = store.get(first.id, ("default", "Motion"))
+    assert moved.id != first.id
+    store.get("", ("default", None))
+    store.get("", ("default", None))
+    assert store.get_stats()["active"] == 2
+    assert store.get(moved.id, ("default", "Motion")).id != moved.id
+
+class FakeChat:
+    def __init__(self, history):
+        self.history = list(history)
+
+class FakeModel:
+    def start_chat(self, history):
+        return FakeChat(history)
+
+def test_chat_keeps_the_context_turn_and_recent_follow_ups():
+    session = Session("s", scope=None)
+    session.start_chat(FakeModel(), ["CONTEXT " * 100, "answer"])
+    for i in range(4):
+        session.trim_chat(keep=2)
+        session.chat.history += [{"role": "user", "parts": [f"q{i}"]}, {"role": "model", "parts": [f"a{i}"]}]
+        session.record_turn(f"q{i}", f"a{i}")
+    session.trim_chat(keep=2)
+    assert [message["parts"][0] for message in session.chat.history] == ["CONTEXT " * 100, "answer",
+                                                                         "q2", "a2", "q3", "a3"]
+    assert len(session.chat_turn_tokens) == 3
+    assert session.chat_tokens == sum(session.chat_turn_tokens)
+    session.reset_chat()
+    assert session.chat is None and session.chat_tokens == 0
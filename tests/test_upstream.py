@@ -0,0 +1,79 @@
+# test_upstream.py
+import asyncio
+import pytest
+from src.upstream import Upstream, UpstreamError, UpstreamUnavailable
+
+def make_open_upstream():
+    upstream = Upstream("test", max_retries=0, failure_threshold=1, reset_timeout=30.0)
+
+    async def fail():
+        raise asyncio.TimeoutError()
+
+    with pytest.raises(UpstreamError):
+        asyncio.run(upstream.call(fail))
+    assert upstream.breaker.state == "open"
+    # Pretend reset_timeout has passed so the next call is the trial
+    upstream.breaker.opened_at -= upstream.breaker.reset_timeout
+    return upstream
+
+async def ok():
+    return "ok"
+
+def test_open_breaker_short_circuits():
+    upstream = make_open_upstream()
+    upstream.breaker.opened_at += upstream.breaker.reset_timeout
+    with pytest.raises(UpstreamUnavailable):
+        asyncio.run(upstream.call(ok))
+
+def test_successful_trial_closes():
+    upstream = make_open_upstream()
+    assert asyncio.run(upstream.call(ok)) == "ok"
+    assert upstream.breaker.state == "closed"
+
+def test_retryable_trial_failure_reopens():
+    upstream = make_open_upstream()
+
+    async def fail():
+        raise asyncio.TimeoutError()
+
+    with pytest.raises(UpstreamError):
+        asyncio.run(upstream.call(fail))
+    assert upstream.breaker.state == "open"
+    with pytest.raises(UpstreamUnavailable):
+        asyncio.run(upstream.call(ok))
+
+def test_non_retryable_trial_failure_closes():
+    upstream = make_open_upstream()
+
+    async def bad_request():
+        raise ValueError("bad request")
+
+    with pytest.raises(UpstreamError):
+        asyncio.run(upstream.call(bad_request))
+    assert upstream.breaker.state == "closed"
+    for _ in range(3):
+        assert asyncio.run(upstream.call(ok)) == "ok"
+
+def test_cancelled_trial_lets_next_call_try():
+    upstream = make_open_upstream()
+
+    async def cancel_trial():
+        task = asyncio.ensure_future(upstream.call(lambda: asyncio.sleep(10)))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_trial())
+    assert upstream.breaker.state == "open"
+    assert asyncio.run(upstream.call(ok)) == "ok"
+    assert upstream.breaker.state == "closed"
+
+def test_stale_half_open_trial_times_out():
+    upstream = make_open_upstream()
+    assert upstream.breaker.allow()
+    assert upstream.breaker.state == "half_open"
+    assert not upstream.breaker.allow()
+    upstream.breaker.trial_started_at -= upstream.breaker.reset_timeout
+    assert asyncio.run(upstream.call(ok)) == "ok"
+    assert upstream.breaker.state == "closed"